@@ -1,7 +1,13 @@
 import fastapi
 from FastAPIApp import schemas
 from FastAPIApp import database
+from FastAPIApp import migrations  # noqa: F401  create_all 때 이미 있던 테이블도 고칩니다.
+from FastAPIApp import replicas
+from FastAPIApp import response_cache
+from FastAPIApp import search  # noqa: F401  create_all 때 검색 색인도 만듭니다.
 
 app = fastapi.FastAPI()
+app.add_middleware(replicas.PrimaryPinMiddleware)
+app.add_middleware(response_cache.ResponseCacheMiddleware)
 
 schemas.Base.metadata.create_all(bind=database.engine)
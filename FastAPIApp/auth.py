@@ -1,17 +1,23 @@
 from datetime import datetime, timedelta
 import re
+import threading
+import time
 from typing import Union
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 import FastAPIApp.crud as crud
 import FastAPIApp.database as database
+import FastAPIApp.invalidation as invalidation
 import FastAPIApp.models as models
+import FastAPIApp.schemas as schemas
+from FastAPIApp.cache import TTLCache
 from FastAPIApp.settings import get_settings
-import requests
+from FastAPIApp.workers import WorkerPool
+import FastAPIApp.portal as portal
 
 SECRET_KEY = get_settings().JWT_SECRET
 ALGORITHM = "HS256"
@@ -33,19 +39,105 @@ class TokenData(BaseModel):
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt는 한 번에 수백 ms씩 CPU를 쓰므로 이벤트 루프를 막지 않도록 따로 돌립니다.
+hashing_pool = WorkerPool("PASSWORD_HASHING_WORKERS")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# 로그인한 회원 정보를 username으로 기억해 둡니다. 회원 정보를 바꾸는 crud 함수가 지웁니다.
+member_cache = TTLCache(get_settings().MEMBER_CACHE_SIZE, get_settings().MEMBER_CACHE_TTL)
 
-def authenticate(db: Session, username: str, password: str):
-    member = crud.get_member_by_username(db, username)
+
+MEMBER_TAG = "member:"
+
+
+def forget_members(*usernames: str):
+    for username in usernames:
+        member_cache.pop(username)
+
+
+def member_tags(*usernames: str) -> list[str]:
+    """회원 정보를 고친 뒤 `invalidation.publish`에 넘길 캐시 태그"""
+    return [MEMBER_TAG + username for username in usernames]
+
+
+@invalidation.listen
+def drop_members(tags: list[str]):
+    if invalidation.EVERYTHING in tags:
+        member_cache.clear()
+    else:
+        forget_members(*(tag[len(MEMBER_TAG):] for tag in tags if tag.startswith(MEMBER_TAG)))
+
+
+class Revocations:
+    """`schemas.TokenVersion`을 메모리에 옮겨 둔 것.
+
+    `TOKEN_REVOCATION_REFRESH`초마다 DB에서 다시 읽으므로, 다른 인스턴스에서 올린 버전도
+    그 시간 안에는 반영됩니다. 이 인스턴스에서 올린 버전은 `bump`로 바로 반영합니다.
+    """
+
+    def __init__(self):
+        self.versions: dict[str, int] = {}
+        self.refreshed = float("-inf")
+        self.lock = threading.Lock()
+
+    async def version(self, db: AsyncSession, student_id: str) -> int:
+        if time.monotonic() - self.refreshed >= get_settings().TOKEN_REVOCATION_REFRESH:
+            await self.refresh(db)
+        return self.versions.get(student_id, 0)
+
+    async def refresh(self, db: AsyncSession):
+        versions = await crud.get_token_versions(db)
+        with self.lock:
+            self.versions = versions
+            self.refreshed = time.monotonic()
+
+    def bump(self, student_id: str, version: int):
+        with self.lock:
+            self.versions[student_id] = max(self.versions.get(student_id, 0), version)
+
+
+revocations = Revocations()
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
+
+
+async def hash_password(password: str) -> str:
+    return await hashing_pool.run(_hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await hashing_pool.run(_verify, password, hashed)
+
+
+async def authenticate(db: AsyncSession, username: str, password: str):
+    member = await crud.get_member_by_username(db, username)
     if not member:
         return False
-    if not pwd_context.verify(password, member.password):
+    if not await verify_password(password, member.password):
         return False
     return member
 
 
+async def token_claims(db: AsyncSession, member: schemas.Member) -> dict:
+    """`JWT_STATELESS`이면 회원 정보와 토큰 버전을 토큰에 함께 담습니다."""
+    claims = {"sub": member.username}
+    if get_settings().JWT_STATELESS:
+        claims.update({
+            "student_id": member.student_id,
+            "role": member.role,
+            "name": member.real_name,
+            "ver": await crud.get_token_version(db, member.student_id),
+        })
+    return claims
+
+
 def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -57,7 +149,7 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
 
 
 async def get_current_member(
-    db: Session = Depends(database.get_db), token: str = Depends(oauth2_scheme)
+    db: AsyncSession = Depends(database.get_async_db), token: str = Depends(oauth2_scheme)
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -72,11 +164,26 @@ async def get_current_member(
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    member = models.Member.from_orm(
-        crud.get_member_by_username(db, username=token_data.username))
-    if member is None:
-        raise credentials_exception
-    return member
+    if get_settings().JWT_STATELESS and "ver" in payload:
+        try:
+            member = models.Member(
+                username=username,
+                student_id=payload["student_id"],
+                role=payload["role"],
+                real_name=payload["name"],
+            )
+        except (KeyError, ValidationError):
+            raise credentials_exception
+        if payload["ver"] < await revocations.version(db, member.student_id):
+            raise credentials_exception
+        return member
+    if (member := member_cache.get(token_data.username)) is None:
+        db_member = await crud.get_member_by_username(db, username=token_data.username)
+        if db_member is None:
+            raise credentials_exception
+        member = models.Member.from_orm(db_member)
+        member_cache.set(token_data.username, member)
+    return member.copy()
 
 
 async def get_current_member_board_only(
@@ -87,32 +194,23 @@ async def get_current_member_board_only(
     raise HTTPException(403, "권한이 없습니다.")
 
 
-def is_yonsei_member(id: str, pw: str) -> bool:
-    return get_student_information(id, pw)
+async def is_yonsei_member(id: str, pw: str) -> bool:
+    return await get_student_information(id, pw)
 
 
 def is_sinchon_member(student_id: str) -> bool:
     return re.match(sinchon_student_id_pattern, student_id)
 
 
-def get_student_status(id: str, pw: str):
-    return get_student_information(id, pw).status
+async def get_student_status(id: str, pw: str):
+    return (await get_student_information(id, pw)).status
 
 
-def get_student_information(id: str, pw: str):
+async def get_student_information(id: str, pw: str):
     if len(pw) > 1024:
         raise
     if len(id) > 1024:
         raise
     if not is_sinchon_member(id):
         raise HTTPException(401, "신촌캠 학부 학번이 필요합니다.")
-    settings = get_settings()
-    response = requests.get(settings.YONSEI_AUTH_FUNCTION_ENDPOINT, params={
-        "id": id,
-        "pw": pw,
-        "code": settings.YONSEI_AUTH_FUNCTION_CODE
-    })
-    if response.status_code == 500:
-        raise HTTPException(777, "연세포탈에서 정보를 받아오는 데 실패했습니다.")
-    json = response.json()
-    return models.ClubMember(status=json["status"], student_id=id, name=json["name"], dept_and_major=json["deptMajor"])
+    return await portal.get_student_information(id, pw)
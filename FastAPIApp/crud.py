@@ -1,77 +1,136 @@
+import logging
 import re
-from typing import Union
-from datetime import datetime, date
+from collections import Counter
+from typing import AsyncIterator, Iterable, Union
+from datetime import datetime, date, timedelta
+from sqlalchemy import delete, func, insert, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, joinedload
+from starlette.concurrency import run_in_threadpool
 from fastapi import UploadFile, HTTPException
 import FastAPIApp.auth as auth
+import FastAPIApp.imaging as imaging
+import FastAPIApp.invalidation as invalidation
 import FastAPIApp.models as models
 import FastAPIApp.schemas as schemas
+import FastAPIApp.snapshots as snapshots
+import FastAPIApp.storage as storage
+from FastAPIApp.settings import get_settings
 
 
-def get_member(db: Session, student_id: str) -> schemas.Member:
-    return (
-        db.query(schemas.Member).filter(
-            schemas.Member.student_id == student_id).first()
+async def get_member(db: AsyncSession, student_id: str) -> schemas.Member:
+    return await db.scalar(
+        select(schemas.Member).filter(schemas.Member.student_id == student_id).limit(1)
     )
 
 
-def get_member_by_username(db: Session, username: str) -> schemas.Member:
-    return db.query(schemas.Member).filter(schemas.Member.username == username).first()
+async def get_member_by_username(db: AsyncSession, username: str) -> schemas.Member:
+    return await db.scalar(
+        select(schemas.Member).filter(schemas.Member.username == username).limit(1)
+    )
 
 
-def get_members(db: Session, skip: int = 0, limit: int = 100) -> list[schemas.Member]:
-    return db.query(schemas.Member).offset(skip).limit(limit).all()
+async def get_members(
+    db: AsyncSession, skip: int = 0, limit: int = 100, after: Union[str, None] = None
+) -> list[schemas.Member]:
+    """학번 순으로 돌려줍니다. `after`를 주면 그 학번 다음부터 돌려줍니다."""
+    query = select(schemas.Member).order_by(schemas.Member.student_id)
+    if after is not None:
+        query = query.filter(schemas.Member.student_id > after)
+    return (await db.scalars(query.offset(skip).limit(limit))).all()
 
 
-def create_member(db: Session, student_id: str, member: models.MemberCreate):
+async def create_member(db: AsyncSession, student_id: str, member: models.MemberCreate):
     db_member = schemas.Member(
         student_id=student_id,
         real_name=member.real_name,
         username=member.username,
-        password=auth.pwd_context.hash(member.password),
+        password=await auth.hash_password(member.password),
         role=models.Role.member,
     )
     db.add(db_member)
-    db.commit()
-    db.refresh(db_member)
+    await db.commit()
+    await db.refresh(db_member)
+    await invalidation.publish(*auth.member_tags(db_member.username))
     return db_member
 
 
-def update_member(db: Session, student_id: str, member: models.MemberModify):
+async def update_member(db: AsyncSession, student_id: str, member: models.MemberModify):
     """`password`는 평문으로 주세요. 이 함수에서 `hash`해줍니다."""
     if member.password:
         if not re.match(auth.password_pattern, member.password):
             raise HTTPException(400, "비밀번호가 규칙에 맞지 않습니다.")
-        member.password = auth.pwd_context.hash(member.password)
-    updated = db.query(schemas.Member).filter(
-        schemas.Member.student_id == student_id)
-    actual_object: schemas.Member = updated.first()
+        member.password = await auth.hash_password(member.password)
+    actual_object: schemas.Member = await get_member(db, student_id)
     if actual_object is None:
         return actual_object
+    previous_username = actual_object.username
     to = {key: value for key, value in member.dict().items()
           if value is not None}
-    updated.update(to)
-    db.commit()
-    db.refresh(actual_object)
+    await db.execute(
+        update(schemas.Member).where(schemas.Member.student_id == student_id).values(**to)
+    )
+    version = await revoke_tokens(db, student_id)
+    await db.commit()
+    await db.refresh(actual_object)
+    await invalidation.publish(*auth.member_tags(previous_username, actual_object.username))
+    auth.revocations.bump(student_id, version)
     return actual_object
 
 
-def delete_member(db: Session, student_id: str):
-    if (
-        db.query(schemas.Member)
-        .filter(schemas.Member.student_id == student_id)
-        .delete()
-    ):
-        db.commit()
+async def delete_member(db: AsyncSession, student_id: str):
+    usernames = (await db.scalars(
+        select(schemas.Member.username).filter(schemas.Member.student_id == student_id)
+    )).all()
+    if (await db.execute(
+        delete(schemas.Member).where(schemas.Member.student_id == student_id)
+    )).rowcount:
+        version = await revoke_tokens(db, student_id)
+        await db.commit()
+        await invalidation.publish(*auth.member_tags(*usernames))
+        auth.revocations.bump(student_id, version)
         return True
     return False
 
 
-def get_posts(
-    db: Session, type: models.PostType, skip: int = 0, limit: Union[int, None] = None
+async def get_token_version(db: AsyncSession, student_id: str) -> int:
+    return await db.scalar(
+        select(schemas.TokenVersion.version).filter(
+            schemas.TokenVersion.student_id == student_id)
+    ) or 0
+
+
+async def get_token_versions(db: AsyncSession) -> dict[str, int]:
+    return dict((await db.execute(
+        select(schemas.TokenVersion.student_id, schemas.TokenVersion.version)
+    )).all())
+
+
+async def revoke_tokens(db: AsyncSession, student_id: str) -> int:
+    """지금까지 발급한 토큰을 못 쓰게 토큰 버전을 올리고 새 버전을 돌려줍니다. 커밋은 부르는 쪽에서 하세요."""
+    if not (await db.execute(
+        update(schemas.TokenVersion)
+        .where(schemas.TokenVersion.student_id == student_id)
+        .values(version=schemas.TokenVersion.version + 1)
+        .execution_options(synchronize_session=False)
+    )).rowcount:
+        db.add(schemas.TokenVersion(student_id=student_id, version=1))
+        await db.flush()
+    return await get_token_version(db, student_id)
+
+
+async def get_posts(
+    db: AsyncSession,
+    type: models.PostType,
+    skip: int = 0,
+    limit: Union[int, None] = None,
+    after: Union[int, None] = None,
 ):
-    return (
-        db.query(
+    """최신 글부터 돌려줍니다. `after`를 주면 그 번호보다 오래된 글부터 돌려줍니다."""
+    query = (
+        select(
             schemas.Post.no,
             schemas.Post.author,
             schemas.Post.title,
@@ -79,27 +138,130 @@ def get_posts(
         )
         .filter(schemas.Post.type == type.name)
         .order_by(schemas.Post.no.desc())
-        .offset(skip)
-        .limit(limit)
-        .all()
     )
+    if after is not None:
+        query = query.filter(schemas.Post.no < after)
+    return (await db.execute(query.offset(skip).limit(limit))).all()
 
 
-def get_post_count(db: Session, type: models.PostType):
-    return db.query(schemas.Post).filter(schemas.Post.type == type.name).count()
+async def get_post_count(db: AsyncSession, type: models.PostType):
+    if (count := await db.scalar(
+        select(schemas.PostCount.count).filter(schemas.PostCount.type == type.name)
+    )) is not None:
+        return count
+    # 아직 세어 두지 않았으면 세기만 합니다. 세어 두는 건 글을 쓸 때와 `MaintenanceFunction`이 합니다.
+    return await _count_posts(db, type.name)
 
 
-def get_post(db: Session, type: models.PostType, no: int = None):
-    return (
-        db.query(schemas.Post)
+async def _count_posts(db: AsyncSession, type: str) -> int:
+    return await db.scalar(
+        select(func.count()).select_from(schemas.Post).filter(schemas.Post.type == type)
+    )
+
+
+# `INSERT … ON CONFLICT DO UPDATE`를 쓸 수 있는 DB
+_upserting_inserts = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+async def _increment(db: AsyncSession, column, delta: int, initial: int, **values):
+    """`values`의 기본 키로 찾은 행의 `column`에 `delta`를 더합니다. 없으면 `values`와 `column=initial`로 만듭니다.
+
+    처음 쓰는 요청 둘이 겹쳐도 둘 다 행이 없다고 보고 `INSERT`하다 키가 부딪치지 않도록 한 문장으로 씁니다.
+    그럴 수 없는 DB에서는 `UPDATE`하고 없으면 `INSERT`하되, 부딪치면 한 번 더 해 봅니다.
+    """
+    table = column.class_
+    keys = [primary.name for primary in table.__table__.primary_key]
+    row = {**values, column.key: initial}
+    if (upserting_insert := _upserting_inserts.get(db.get_bind().dialect.name)) is not None:
+        await db.execute(upserting_insert(table).values(**row).on_conflict_do_update(
+            index_elements=keys, set_={column.key: column + delta}))
+        return
+    for retry in (True, False):
+        try:
+            async with db.begin_nested():
+                if not (await db.execute(
+                    update(table)
+                    .where(*(getattr(table, name) == values[name] for name in keys))
+                    .values({column.key: column + delta})
+                    .execution_options(synchronize_session=False)
+                )).rowcount:
+                    await db.execute(insert(table).values(**row))
+            return
+        except IntegrityError:
+            if not retry:
+                raise
+
+
+async def _adjust_post_count(db: AsyncSession, type: str, delta: int):
+    """`type` 글 수를 `delta`만큼 고칩니다. 바뀐 글은 미리 `flush`해 두세요."""
+    if not (await db.execute(
+        update(schemas.PostCount)
+        .where(schemas.PostCount.type == type)
+        .values(count=schemas.PostCount.count + delta)
+        .execution_options(synchronize_session=False)
+    )).rowcount:  # 아직 세지 않았으면 지금 센 값으로 만듭니다. 바뀐 글은 이미 들어 있습니다.
+        await _increment(db, schemas.PostCount.count, delta, await _count_posts(db, type), type=type)
+
+
+async def recount_posts(db: AsyncSession) -> dict[str, int]:
+    """글 수를 처음부터 다시 세어 맞춥니다. 커밋은 부르는 쪽에서 하세요."""
+    counts = {type.value: 0 for type in models.PostType}
+    counts.update((await db.execute(
+        select(schemas.Post.type, func.count()).group_by(schemas.Post.type)
+    )).all())
+    await db.execute(delete(schemas.PostCount))
+    db.add_all([schemas.PostCount(type=type, count=count) for type, count in counts.items()])
+    await db.flush()
+    return counts
+
+
+# 어느 종류의 글이 바뀌었는지 모를 때 버전을 올리고 캐시에서 지울 자료들
+_post_resources = tuple(type.value for type in models.PostType)
+
+
+async def _changed(*resources: str, keys: Iterable = ()):
+    """고친 내용을 커밋한 뒤에 부릅니다. 모든 인스턴스의 캐시에서 지우고 바뀐 스냅숏 파일을 다시 쓰게 합니다.
+
+    `keys`는 바뀐 글 번호나 문예지 발행일입니다.
+    """
+    await invalidation.publish(*resources)
+    snapshots.snapshotter.refresh(resources, keys)
+
+
+async def get_resource_version(db: AsyncSession, resource: str) -> int:
+    return await db.scalar(
+        select(schemas.ResourceVersion.version).filter(schemas.ResourceVersion.resource == resource)
+    ) or 0
+
+
+async def _bump_versions(db: AsyncSession, *resources: str):
+    """`resources`의 버전을 하나씩 올립니다. 고친 내용과 함께 커밋하세요."""
+    for resource in dict.fromkeys(resources):
+        await _increment(db, schemas.ResourceVersion.version, 1, 1, resource=resource)
+
+
+async def get_post(db: AsyncSession, type: models.PostType, no: int = None):
+    """딸린 파일까지 한 번에 읽습니다. 글 하나만 읽으므로 `joinedload`로 왕복을 한 번 줄입니다."""
+    return (await db.scalars(
+        select(schemas.Post)
         .options(joinedload(schemas.Post.attached))
         .filter(schemas.Post.no == no if no else schemas.Post.type == type.name)
-        .first()
-    )
+        .limit(1)
+    )).unique().first()
+
+
+async def _reload_post(db: AsyncSession, no: int) -> schemas.Post:
+    """방금 쓴 글을 딸린 파일과 함께 다시 읽습니다. 비동기 세션에서는 나중에 불러올 수 없습니다."""
+    return (await db.scalars(
+        select(schemas.Post)
+        .options(joinedload(schemas.Post.attached))
+        .filter(schemas.Post.no == no)
+        .execution_options(populate_existing=True)
+    )).unique().first()
 
 
-def create_post(
-    db: Session, author: models.Member, post: models.PostCreate, type: models.PostType
+async def create_post(
+    db: AsyncSession, author: models.Member, post: models.PostCreate, type: models.PostType
 ):
     db_post = schemas.Post(
         type=type.value,
@@ -107,128 +269,408 @@ def create_post(
         author=author.real_name,
         content=post.content,
         published=datetime.today().date(),
-        attached=db.query(schemas.UploadedFile)
-        .filter(schemas.UploadedFile.id.in_(post.attached))
-        .all(),
     )
     db.add(db_post)
-    db.commit()
-    return db_post
+    await db.flush()
+    await _link_attached(db, db_post.no, post.attached, current=set())
+    await _adjust_post_count(db, type.value, 1)
+    await _bump_versions(db, type.value)
+    await db.commit()
+    await _changed(type.value, keys=[db_post.no])
+    return await _reload_post(db, db_post.no)
 
 
-def update_post(
-    db: Session,
+async def update_post(
+    db: AsyncSession,
     post: models.PostCreate,
     modifier: models.Member,
     no: int = None,
     type: models.PostType = None,
+    store: storage.BlobStore = None,
 ):
-    """`no`가 있으면 `no`번 `Post`를, 없으면 `type`이 `type`인 `Post`를 수정합니다."""
+    """`no`가 있으면 `no`번 `Post`를, 없으면 `type`이 `type`인 `Post`를 수정합니다.
+
+    `type`으로 고칠 때는 글을 새로 쓰므로, 새 글에 다시 붙이지 않은 파일은 `delete_post`처럼 `store`에서 지웁니다.
+    """
     if no:
-        updated = db.query(schemas.Post).filter(schemas.Post.no == no)
-        updated.update(
-            {
-                "title": post.title,
-                "content": post.content,
-                "modified": datetime.today().date(),
-                "modifier": modifier.real_name,
-            }
-        )
-        updated.first().attached = (
-            db.query(schemas.UploadedFile)
-            .filter(schemas.UploadedFile.id.in_(post.attached))
-            .all()
+        if not (await db.execute(
+            update(schemas.Post)
+            .where(schemas.Post.no == no)
+            .values(
+                title=post.title,
+                content=post.content,
+                modified=datetime.today().date(),
+                modifier=modifier.real_name,
+            )
+        )).rowcount:
+            return None
+        await _link_attached(db, no, post.attached)
+        await _bump_versions(db, *_post_resources)  # 어느 종류의 글인지 따로 읽지 않습니다.
+        await db.commit()
+        await _changed(*_post_resources, keys=[no])
+        return await _reload_post(db, no)
+    replaced = select(schemas.Post.no).where(schemas.Post.type == type.value)
+    previous = (await db.execute(
+        select(schemas.UploadedFile.id, schemas.UploadedFile.key)
+        .filter(schemas.UploadedFile.post_no.in_(replaced))
+    )).all()
+    # 새 글에도 붙일 파일은 지우는 글과 함께 지워지지 않도록 먼저 떼어 놓습니다. 나머지는 함께 지워집니다.
+    if kept := [id for id, _ in previous if id in post.attached]:
+        await db.execute(
+            update(schemas.UploadedFile)
+            .where(schemas.UploadedFile.id.in_(kept))
+            .values(post_no=None)
+            .execution_options(synchronize_session=False)
         )
-        db.commit()
-        return updated.first()
-    db.query(schemas.Post).filter(schemas.Post.type == type.value).delete()
+    replaced_count = (await db.execute(
+        delete(schemas.Post).where(schemas.Post.type == type.value)
+    )).rowcount
     new = schemas.Post(
         type=type.value,
         title=post.title,
         author=modifier.real_name,
         content=post.content,
         published=datetime.today().date(),
-        attached=db.query(schemas.UploadedFile)
-        .filter(schemas.UploadedFile.id.in_(post.attached))
-        .all(),
     )
     db.add(new)
-    db.commit()
-    return new
+    await db.flush()
+    await _link_attached(db, new.no, post.attached, current=set())
+    await _adjust_post_count(db, type.value, 1 - replaced_count)
+    await _bump_versions(db, type.value)
+    released = await _release_blobs(db, [key for id, key in previous if id not in kept])
+    await db.commit()
+    await _changed(type.value)
+    await _delete_blobs(db, store, released)
+    return await _reload_post(db, new.no)
+
+
+async def _link_attached(
+    db: AsyncSession, post_no: int, attached: list[int], current: Union[set[int], None] = None
+):
+    """`post_no`번 글에 딸린 파일을 `attached`로 맞춥니다.
+
+    파일을 불러오지 않고 바뀐 것만 `UPDATE`합니다. `current`는 지금 딸린 파일 ID들이며,
+    주지 않으면 DB에서 읽습니다.
+    """
+    if current is None:
+        current = set((await db.scalars(
+            select(schemas.UploadedFile.id).filter(schemas.UploadedFile.post_no == post_no)
+        )).all())
+    wanted = set(attached)
+    if unlinked := current - wanted:
+        await db.execute(
+            update(schemas.UploadedFile)
+            .where(schemas.UploadedFile.id.in_(unlinked))
+            .values(post_no=None)
+            .execution_options(synchronize_session=False)
+        )
+    if linked := wanted - current:
+        await db.execute(
+            update(schemas.UploadedFile)
+            .where(schemas.UploadedFile.id.in_(linked))
+            .values(post_no=post_no)
+            .execution_options(synchronize_session=False)
+        )
+
+
+async def delete_post(db: AsyncSession, store: storage.BlobStore, type: models.PostType, no: int):
+    keys = await _attached_keys(db, no)  # 글을 지우면 딸린 파일도 함께 지워집니다.
+    if not (deleted := (await db.execute(
+        delete(schemas.Post)
+        .where(schemas.Post.no == no, schemas.Post.type == type.value)
+    )).rowcount):
+        return deleted
+    await _adjust_post_count(db, type.value, -deleted)
+    await _bump_versions(db, type.value)
+    released = await _release_blobs(db, keys)
+    await db.commit()
+    await _changed(type.value, keys=[no])
+    await _delete_blobs(db, store, released)
+    return deleted
+
+
+async def get_club_information(db: AsyncSession):
+    rows = (await db.scalars(select(schemas.ClubInformation))).all()
+    return models.ClubInformation(**{row.key: row.value for row in rows})
+
+
+async def create_outbox_message(db: AsyncSession, to: str, content: str) -> schemas.OutboxMessage:
+    now = datetime.utcnow()
+    message = schemas.OutboxMessage(
+        to=to, content=content, status="pending", attempts=0, next_attempt=now, created=now)
+    db.add(message)
+    await db.commit()
+    return message
 
 
-def delete_post(db: Session, type: models.PostType, no: int):
-    deleted = (
-        db.query(schemas.Post)
-        .filter(schemas.Post.no == no and schemas.Post.type == type)
-        .delete()
+# 아래 세 함수는 요청과 상관없이 스레드에서 도는 `push_message.Dispatcher`가 씁니다.
+def claim_outbox_messages(
+    db: Session, claim: str, limit: int, lease: timedelta
+) -> list[schemas.OutboxMessage]:
+    """보낼 때가 된 문자를 `limit`개까지 `claim`으로 가져옵니다.
+
+    가져간 문자는 `lease`만큼 다음 시도를 미뤄 두므로, 발송기가 도중에 죽어도 그 뒤에 다시 보냅니다.
+    """
+    now = datetime.utcnow()
+    due = (
+        select(schemas.OutboxMessage.id)
+        .filter(schemas.OutboxMessage.status == "pending", schemas.OutboxMessage.next_attempt <= now)
+        .order_by(schemas.OutboxMessage.id)
+        .limit(limit)
+    )
+    db.query(schemas.OutboxMessage).filter(
+        schemas.OutboxMessage.id.in_(due.scalar_subquery()),
+        schemas.OutboxMessage.status == "pending",
+        schemas.OutboxMessage.next_attempt <= now,
+    ).update(
+        {
+            schemas.OutboxMessage.claim: claim,
+            schemas.OutboxMessage.next_attempt: now + lease,
+            schemas.OutboxMessage.attempts: schemas.OutboxMessage.attempts + 1,
+        },
+        synchronize_session=False,
     )
     db.commit()
-    return deleted
+    return (
+        db.query(schemas.OutboxMessage)
+        .filter(schemas.OutboxMessage.claim == claim, schemas.OutboxMessage.status == "pending")
+        .order_by(schemas.OutboxMessage.id)
+        .all()
+    )
+
+
+def finish_outbox_messages(
+    db: Session, messages: list[schemas.OutboxMessage], error: Union[str, None] = None
+):
+    """보낸 결과를 기록합니다. 실패했으면 `SMS_MAX_ATTEMPTS`번까지 점점 늦춰 가며 다시 보냅니다."""
+    settings = get_settings()
+    now = datetime.utcnow()
+    for message in messages:
+        message.claim = None
+        if error is None:
+            message.status = "sent"
+            message.sent = now
+            continue
+        message.last_error = error
+        if message.attempts >= settings.SMS_MAX_ATTEMPTS:
+            message.status = "failed"
+        else:
+            delay = min(settings.SMS_RETRY_BASE * 2 ** (message.attempts - 1), settings.SMS_RETRY_MAX)
+            message.next_attempt = now + timedelta(seconds=delay)
+    db.commit()
 
 
-def get_club_information(db: Session):
-    return models.ClubInformation(**{row.key: row.value for row in db.query(schemas.ClubInformation).all()})
+def get_next_outbox_attempt(db: Session) -> Union[datetime, None]:
+    return db.query(func.min(schemas.OutboxMessage.next_attempt)).filter(
+        schemas.OutboxMessage.status == "pending").scalar()
 
 
-def update_club_information(db: Session, info: models.ClubInformationCreate):
+async def update_club_information(db: AsyncSession, info: models.ClubInformationCreate):
     token_excluded = models.ClubInformation(**info.dict()).dict()
-    db.query(schemas.ClubInformation).delete()
+    await db.execute(delete(schemas.ClubInformation))
     db.add_all(
         [
             schemas.ClubInformation(key=key, value=value)
             for key, value in token_excluded.items()
         ]
     )
-    db.commit()
-    return get_club_information(db)
+    await _bump_versions(db, "club-information")
+    await db.commit()
+    await _changed("club-information")
+    return await get_club_information(db)
 
 
-def get_uploaded_file(db: Session, id: int) -> schemas.UploadedFile:
-    return (
-        db.query(schemas.UploadedFile)
-        .filter(schemas.UploadedFile.id == id)
-        .first()
+async def get_uploaded_file(db: AsyncSession, id: int) -> schemas.UploadedFile:
+    return await db.scalar(
+        select(schemas.UploadedFile).filter(schemas.UploadedFile.id == id).limit(1)
     )
 
 
-async def create_uploaded_file(db: Session, file: UploadFile):
-    name = file.filename
-    content_type = file.content_type
-    row = schemas.UploadedFile(
-        name=name, content_type=content_type, binary=file.file.read()
+async def get_uploaded_binary_size(db: AsyncSession, id: int) -> int:
+    return await db.scalar(
+        select(func.coalesce(func.length(schemas.UploadedFile.binary), 0))
+        .filter(schemas.UploadedFile.id == id)
     )
-    db.add(row)
-    db.commit()
-    return row
 
 
-async def delete_uploaded_file(db: Session, id: int):
+async def iterate_uploaded_binary(db: AsyncSession, id: int, start: int, stop: int) -> AsyncIterator[bytes]:
+    """블롭 저장소 도입 전에 올라온 파일의 `[start, stop)` 구간을 DB에서 조금씩 읽습니다."""
+    for offset in range(start, stop, storage.CHUNK_SIZE):
+        yield await db.scalar(
+            select(
+                func.substr(
+                    schemas.UploadedFile.binary,
+                    offset + 1,
+                    min(storage.CHUNK_SIZE, stop - offset),
+                )
+            )
+            .filter(schemas.UploadedFile.id == id)
+        )
+
+
+async def create_uploaded_file(db: AsyncSession, store: storage.BlobStore, file: UploadFile):
     try:
-        return db.query(schemas.UploadedFile).filter(schemas.UploadedFile.id == id).delete()
+        key, size, staged = await store.stage(file, get_settings().MAX_UPLOAD_SIZE)
+    except storage.BlobTooLarge:
+        raise HTTPException(413, "파일이 너무 큽니다.")
+    committed = False
+    try:
+        # 블롭 행을 잡은 채로 파일을 옮겨, 같은 내용을 지우는 `_delete_blobs`와 엇갈리지 않게 합니다.
+        await _acquire_blob(db, key, size)
+        await run_in_threadpool(store.commit, staged, key)
+        committed = True
+        row = schemas.UploadedFile(
+            name=file.filename,
+            content_type=file.content_type,
+            key=key,
+            size=size,
+            uploaded=datetime.utcnow(),
+        )
+        db.add(row)
+        await db.commit()
+    except BaseException:
+        if committed:  # 옮긴 파일을 가리킬 행이 없을 수 있습니다.
+            await _abandon_blob(db, store, key)
+        raise
     finally:
-        db.commit()
+        store.discard(staged)
+    return row
 
 
-def get_magazine(db: Session, published: date):
-    return (
-        db.query(schemas.Magazine)
+async def _abandon_blob(db: AsyncSession, store: storage.BlobStore, key: str):
+    """커밋하지 못한 업로드가 옮겨 둔 파일을, 가리키는 블롭 행이 없으면 지웁니다.
+
+    여기서도 실패하면 (DB 연결이 끊겼을 때 등) `purge_blobs`가 나중에 지웁니다.
+    """
+    try:
+        await db.rollback()
+        await _forget_blob(db, store, key)
+    except Exception:
+        logging.exception("올리다 만 블롭을 지우지 못했습니다: %s", key)
+
+
+async def _forget_blob(db: AsyncSession, store: storage.BlobStore, key: str) -> list[str]:
+    """`key` 블롭을 아무도 가리키지 않으면 지웁니다. 행이 없으면 참조 횟수 0으로 만들어 잡은 뒤 지웁니다.
+
+    행을 잡으므로 같은 내용을 올리는 중인 `create_uploaded_file`이 있으면 그 커밋을 기다렸다가 남겨 둡니다.
+    """
+    await _increment(db, schemas.Blob.refcount, 0, 0, key=key, size=0)
+    return await _delete_blobs(db, store, [key])
+
+
+async def delete_uploaded_file(db: AsyncSession, store: storage.BlobStore, id: int):
+    key, post_no = (await db.execute(
+        select(schemas.UploadedFile.key, schemas.UploadedFile.post_no)
+        .filter(schemas.UploadedFile.id == id)
+    )).first() or (None, None)
+    if not (deleted := (await db.execute(
+        delete(schemas.UploadedFile).where(schemas.UploadedFile.id == id)
+    )).rowcount):
+        return deleted
+    released = await _release_blobs(db, [key])
+    await _bump_versions(db, *_post_resources)  # 글에 딸린 파일 목록이 바뀌었을 수 있습니다.
+    await db.commit()
+    await _changed(*_post_resources, keys=[post_no] if post_no is not None else [])
+    await _delete_blobs(db, store, released)
+    return deleted
+
+
+async def _attached_keys(db: AsyncSession, post_no: int) -> list[str]:
+    return (await db.scalars(
+        select(schemas.UploadedFile.key).filter(schemas.UploadedFile.post_no == post_no)
+    )).all()
+
+
+async def _acquire_blob(db: AsyncSession, key: str, size: int):
+    """`key` 블롭의 참조 횟수를 하나 늘립니다. 처음 보는 블롭이면 새로 기록합니다."""
+    await _increment(db, schemas.Blob.refcount, 1, 1, key=key, size=size)
+
+
+async def _release_blobs(db: AsyncSession, keys: list[str]) -> list[str]:
+    """`keys`의 참조 횟수를 줄이고, 더는 아무도 가리키지 않게 된 블롭의 key를 돌려줍니다.
+
+    돌려받은 key는 커밋한 뒤에 `_delete_blobs`에 넘기세요.
+    """
+    counts = Counter(key for key in keys if key)
+    for key, count in counts.items():
+        await db.execute(
+            update(schemas.Blob)
+            .where(schemas.Blob.key == key)
+            .values(refcount=schemas.Blob.refcount - count)
+            .execution_options(synchronize_session=False)
+        )
+    return (await db.scalars(
+        select(schemas.Blob.key)
+        .filter(schemas.Blob.key.in_(list(counts)), schemas.Blob.refcount <= 0)
+    )).all()
+
+
+async def _delete_blobs(db: AsyncSession, store: storage.BlobStore, keys: Iterable[str]) -> list[str]:
+    """참조 횟수가 0인 블롭을 지우고 커밋한 뒤, 지운 key를 돌려줍니다.
+
+    행을 지워 잡아 둔 채로 파일을 지우므로, 그사이 같은 내용을 올린 `create_uploaded_file`은 커밋을 기다렸다가
+    새 행과 파일을 만듭니다. 먼저 다시 가져간 블롭은 참조 횟수가 0이 아니므로 남겨 둡니다.
+    """
+    deleted = []
+    for key in keys:
+        if (await db.execute(
+            delete(schemas.Blob)
+            .where(schemas.Blob.key == key, schemas.Blob.refcount <= 0)
+            .execution_options(synchronize_session=False)
+        )).rowcount:
+            await run_in_threadpool(_delete_blob_files, store, key)
+            deleted.append(key)
+    await db.commit()
+    return deleted
+
+
+def _delete_blob_files(store: storage.BlobStore, key: str):
+    store.delete(key)
+    for derivative in imaging.derivative_keys(key):
+        store.delete(derivative)
+
+
+async def purge_blobs(db: AsyncSession, store: storage.BlobStore) -> list[str]:
+    """아무도 가리키지 않는 블롭을 지우고 그 key를 돌려줍니다.
+
+    커밋한 뒤 지우기 전에 멈춰 남은 행과, 업로드가 커밋하지 못해 행 없이 남은 파일을 지웁니다.
+    """
+    keys = (await db.scalars(select(schemas.Blob.key).filter(schemas.Blob.refcount <= 0))).all()
+    purged = await _delete_blobs(db, store, keys)
+    known = set((await db.scalars(select(schemas.Blob.key))).all())
+    for key in await run_in_threadpool(lambda: [key for key in store.keys() if key not in known]):
+        purged += await _forget_blob(db, store, key)
+    return purged
+
+
+async def get_magazine(db: AsyncSession, published: date):
+    """실린 작품까지 한 번에 읽습니다.
+
+    여러 호를 작품과 함께 돌려주는 함수를 만든다면 행이 작품 수만큼 불어나지 않도록 `selectinload`를 쓰세요.
+    """
+    return (await db.scalars(
+        select(schemas.Magazine)
+        .options(joinedload(schemas.Magazine.contents))
         .filter(schemas.Magazine.published == published)
-        .first()
-    )
+        .limit(1)
+        .execution_options(populate_existing=True)
+    )).unique().first()
 
 
-def get_magazines(db: Session, skip: int = 0, limit: int = 100):
-    return (
-        db.query(schemas.Magazine)
+async def get_magazines(
+    db: AsyncSession, skip: int = 0, limit: int = 100, after: Union[date, None] = None
+):
+    """최근 호부터 목록에 쓰는 열만 돌려줍니다. `after`를 주면 그날보다 먼저 나온 호부터 돌려줍니다."""
+    query = (
+        select(schemas.Magazine.published, schemas.Magazine.cover)
         .order_by(schemas.Magazine.published.desc())
-        .offset(skip)
-        .limit(limit)
-        .all()
     )
+    if after is not None:
+        query = query.filter(schemas.Magazine.published < after)
+    return (await db.execute(query.offset(skip).limit(limit))).all()
 
 
-def create_magazine(db: Session, magazine: models.MagazineCreate):
+async def create_magazine(db: AsyncSession, magazine: models.MagazineCreate):
     db_magazine = schemas.Magazine(
         year=magazine.year,
         cover=magazine.cover,
@@ -247,24 +689,31 @@ def create_magazine(db: Session, magazine: models.MagazineCreate):
             for c in magazine.contents
         ]
     )
-    db.commit()
-    return db_magazine
-
-
-def update_magazine(db: Session, published: date, magazine: models.MagazineCreate):
-    db.query(schemas.MagazineContent).filter(
-        schemas.MagazineContent.published == published
-    ).delete()
-    updated = db.query(schemas.Magazine).filter(
-        schemas.Magazine.published == published)
-    if not updated.first():
+    await db.flush()
+    await _adjust_magazine_facets(db, _facet_values(magazine.contents), 1)
+    await _bump_versions(db, "magazine")
+    await db.commit()
+    await _changed("magazine", keys=[magazine.published])
+    return await get_magazine(db, magazine.published)
+
+
+async def update_magazine(db: AsyncSession, published: date, magazine: models.MagazineCreate):
+    replaced = await get_magazine_content(db, published)
+    await db.execute(
+        delete(schemas.MagazineContent).where(schemas.MagazineContent.published == published)
+    )
+    if not await db.scalar(
+        select(schemas.Magazine.published).filter(schemas.Magazine.published == published)
+    ):
         return False
-    updated.update(
-        {
-            "year": magazine.year,
-            "cover": magazine.cover,
-            "published": magazine.published,
-        }
+    await db.execute(
+        update(schemas.Magazine)
+        .where(schemas.Magazine.published == published)
+        .values(
+            year=magazine.year,
+            cover=magazine.cover,
+            published=magazine.published,
+        )
     )
     db.add_all(
         [
@@ -278,25 +727,162 @@ def update_magazine(db: Session, published: date, magazine: models.MagazineCreat
             for c in magazine.contents
         ]
     )
-    db.commit()
+    await db.flush()
+    await _adjust_magazine_facets(
+        db, _facet_values(magazine.contents) - _facet_values(replaced), 1)
+    await _adjust_magazine_facets(
+        db, _facet_values(replaced) - _facet_values(magazine.contents), -1)
+    await _bump_versions(db, "magazine")
+    await db.commit()
+    await _changed("magazine", keys=[published, magazine.published])
     return magazine
 
 
-def delete_magazine(db: Session, published: date):
-    if db.query(schemas.Magazine).filter(schemas.Magazine.published == published).delete():
-        db.commit()
+async def delete_magazine(db: AsyncSession, published: date):
+    deleted = await get_magazine_content(db, published)
+    if (await db.execute(
+        delete(schemas.Magazine).where(schemas.Magazine.published == published)
+    )).rowcount:
+        await _adjust_magazine_facets(db, _facet_values(deleted), -1)
+        await _bump_versions(db, "magazine")
+        await db.commit()
+        await _changed("magazine", keys=[published])
         return True
     return False
 
 
-def get_magazine_content(db: Session, published: date):
-    return (
-        db.query(schemas.MagazineContent)
+async def get_magazine_content(db: AsyncSession, published: date):
+    return (await db.scalars(
+        select(schemas.MagazineContent)
         .filter(schemas.MagazineContent.published == published)
-        .all()
+    )).all()
+
+
+def _facet_filters(filters: dict[models.MagazineFacet, str]) -> list:
+    return [
+        getattr(schemas.MagazineContent, facet.value) == value
+        for facet, value in filters.items() if value is not None
+    ]
+
+
+async def get_magazine_works(
+    db: AsyncSession,
+    filters: dict[models.MagazineFacet, str],
+    skip: int = 0,
+    limit: int = 100,
+    after: Union[tuple[date, int], None] = None,
+):
+    """모든 호에서 `filters`에 맞는 작품을 최근 호부터 돌려줍니다.
+
+    `after`에 마지막으로 받은 작품의 `(published, no)`를 주면 그다음부터 돌려줍니다.
+    """
+    content = schemas.MagazineContent
+    query = (
+        select(content)
+        .filter(*_facet_filters(filters))
+        .order_by(content.published.desc(), content.no.desc())
+    )
+    if after is not None:
+        query = query.filter(tuple_(content.published, content.no) < after)
+    return (await db.scalars(query.offset(skip).limit(limit))).all()
+
+
+async def get_magazine_facets(
+    db: AsyncSession, filters: dict[models.MagazineFacet, str]
+) -> dict[str, dict[str, int]]:
+    """갈래·작가·언어마다 값별 작품 수를 돌려줍니다.
+
+    거르지 않으면 미리 세어 둔 `magazineFacets`를 읽고, 거르면 걸러진 작품만 색인으로 셉니다.
+    """
+    facets = {facet.value: {} for facet in models.MagazineFacet}
+    if conditions := _facet_filters(filters):
+        for facet in models.MagazineFacet:
+            column = getattr(schemas.MagazineContent, facet.value)
+            facets[facet.value].update((await db.execute(
+                select(column, func.count()).filter(*conditions).group_by(column)
+            )).all())
+        return facets
+    rows = (await db.execute(select(
+        schemas.MagazineFacet.field, schemas.MagazineFacet.value, schemas.MagazineFacet.count
+    ))).all()
+    if not rows:  # 세어 둔 게 없으면 세기만 합니다. 세어 두는 건 문예지를 고칠 때와 `MaintenanceFunction`이 합니다.
+        rows = await _group_magazine_facets(db)
+    for field, value, count in rows:
+        facets[field][value] = count
+    return facets
+
+
+def _facet_values(contents: list) -> Counter:
+    """작품마다 `(갈래·작가·언어, 값)`을 하나씩 셉니다."""
+    return Counter(
+        (facet.value, getattr(content, facet.value))
+        for content in contents for facet in models.MagazineFacet
     )
 
 
+async def _count_magazine_works(db: AsyncSession, field: str, value: str) -> int:
+    return await db.scalar(
+        select(func.count()).select_from(schemas.MagazineContent)
+        .filter(getattr(schemas.MagazineContent, field) == value)
+    )
+
+
+async def _adjust_magazine_facets(db: AsyncSession, counts: Counter, sign: int):
+    """`counts`만큼 작품 수를 더하거나(`sign`이 1) 뺍니다(-1). 바뀐 작품은 미리 `flush`해 두세요."""
+    if await db.scalar(select(schemas.MagazineFacet.field).limit(1)) is None:
+        await recount_magazine_facets(db)  # 아직 한 번도 세지 않았습니다.
+        return
+    for (field, value), count in counts.items():
+        if not (await db.execute(
+            update(schemas.MagazineFacet)
+            .where(schemas.MagazineFacet.field == field, schemas.MagazineFacet.value == value)
+            .values(count=schemas.MagazineFacet.count + sign * count)
+            .execution_options(synchronize_session=False)
+        )).rowcount and (actual := await _count_magazine_works(db, field, value)):
+            await _increment(db, schemas.MagazineFacet.count, sign * count, actual, field=field, value=value)
+    await db.flush()
+    await db.execute(
+        delete(schemas.MagazineFacet).where(schemas.MagazineFacet.count <= 0)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def _group_magazine_facets(db: AsyncSession) -> list[tuple[str, str, int]]:
+    rows = []
+    for facet in models.MagazineFacet:
+        column = getattr(schemas.MagazineContent, facet.value)
+        rows += [
+            (facet.value, value, count) for value, count in (await db.execute(
+                select(column, func.count()).filter(column.isnot(None)).group_by(column)
+            )).all()
+        ]
+    return rows
+
+
+async def recount_magazine_facets(db: AsyncSession) -> list[tuple[str, str, int]]:
+    """갈래·작가·언어별 작품 수를 처음부터 다시 세어 맞춥니다. 커밋은 부르는 쪽에서 하세요."""
+    rows = await _group_magazine_facets(db)
+    await db.execute(delete(schemas.MagazineFacet))
+    db.add_all([
+        schemas.MagazineFacet(field=field, value=value, count=count) for field, value, count in rows
+    ])
+    await db.flush()
+    return rows
+
+
+async def repair_summaries(db: AsyncSession) -> tuple[dict[str, int], list[tuple[str, str, int]]]:
+    """글 수와 문예지 작품 수를 처음부터 다시 세어 커밋합니다.
+
+    고친 값이 ETag와 응답 캐시, 스냅숏 뒤에 숨지 않도록 버전을 올리고 캐시에서 지웁니다.
+    """
+    counts = await recount_posts(db)
+    facets = await recount_magazine_facets(db)
+    await _bump_versions(db, *_post_resources, "magazine")
+    await db.commit()
+    await _changed(*_post_resources, "magazine")
+    return counts, facets
+
+
 # def get_class(db: Session, name: models.ClassName):
 #     return db.query(schemas.Class).filter(schemas.Class.name == name).first()
 
@@ -1,6 +1,12 @@
+import asyncio
+import weakref
+from typing import Union
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from FastAPIApp.settings import get_settings
 
 settings = get_settings()
@@ -10,6 +16,47 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# 동기 드라이버 대신 쓸 비동기 드라이버
+async_drivers = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_url(url: str) -> str:
+    """`DB_CONNECTION_STRING`을 비동기 드라이버를 쓰는 연결 문자열로 바꿉니다."""
+    parsed = make_url(url)
+    if (driver := async_drivers.get(parsed.get_backend_name())) is None:
+        return url
+    return str(parsed.set(drivername=driver))
+
+
+def create_async_sessionmaker(url: str) -> sessionmaker:
+    parsed = make_url(async_url(url))
+    # SQLite 연결은 값싸고 파일에 묶여 있으므로 모아 두지 않습니다.
+    options = {"poolclass": NullPool} if parsed.get_backend_name() == "sqlite" else {}
+    return sessionmaker(
+        create_async_engine(parsed, **options),
+        class_=AsyncSession,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+_async_sessionmakers: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def AsyncSessionLocal(url: Union[str, None] = None) -> AsyncSession:
+    """이벤트 루프마다 엔진을 하나씩 둡니다. asyncpg 연결은 만든 루프에서만 쓸 수 있습니다.
+
+    `url`을 주면 주 DB 대신 그 DB(복제본)에 연결합니다.
+    """
+    url = url or settings.DB_CONNECTION_STRING
+    factories = _async_sessionmakers.setdefault(asyncio.get_running_loop(), {})
+    if (factory := factories.get(url)) is None:
+        factory = factories[url] = create_async_sessionmaker(url)
+    return factory()
+
 
 def get_db():
     db = SessionLocal()
@@ -17,3 +64,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,97 @@
+import os
+import tempfile
+from typing import Union
+from PIL import Image, ImageOps, UnidentifiedImageError
+from FastAPIApp.settings import get_settings
+from FastAPIApp.storage import BlobStore
+from FastAPIApp.workers import WorkerPool
+
+# 줄인 이미지를 만들 수 있는 원본 형식
+resizable = {"image/jpeg", "image/png", "image/webp", "image/gif", "image/bmp"}
+# 줄인 이미지의 형식: (Pillow 형식 이름, 확장자)
+formats = {"image/webp": ("WEBP", "webp"), "image/jpeg": ("JPEG", "jpg")}
+
+pool = WorkerPool("IMAGE_WORKERS")
+
+
+def pick_width(requested: int) -> int:
+    """설정된 너비 중 `requested` 이상인 가장 작은 것을, 없으면 가장 큰 것을 고릅니다."""
+    widths = sorted(get_settings().IMAGE_DERIVATIVE_WIDTHS)
+    return next((width for width in widths if width >= requested), widths[-1])
+
+
+def pick_media_type(accept: str) -> str:
+    return "image/webp" if "image/webp" in accept else "image/jpeg"
+
+
+def derivative_key(key: str, width: int, media_type: str) -> str:
+    return f"{key}-w{width}.{formats[media_type][1]}"
+
+
+def skipped_key(key: str, width: int, media_type: str) -> str:
+    """줄일 필요가 없거나 줄일 수 없다고 확인했음을 남겨 두는 빈 파일의 key."""
+    return f"{derivative_key(key, width, media_type)}.skip"
+
+
+def derivative_keys(key: str) -> list[str]:
+    """`key` 원본에서 만들어질 수 있는 모든 줄인 이미지와 표시 파일의 key."""
+    return [
+        made(key, width, media_type)
+        for width in get_settings().IMAGE_DERIVATIVE_WIDTHS
+        for media_type in formats
+        for made in (derivative_key, skipped_key)
+    ]
+
+
+def render(source: str, destination: str, width: int, media_type: str) -> bool:
+    """`source` 이미지를 `width` 너비로 줄여 `destination`에 씁니다. 프로세스 풀에서 돕니다.
+
+    원본이 `width`보다 좁거나 이미지가 아니면 아무것도 쓰지 않고 `False`를 돌려줍니다.
+    """
+    try:
+        with Image.open(source) as image:
+            # 90도 돌려 보여야 하는 사진이면 세로 길이가 보이는 너비입니다.
+            rotated = image.getexif().get(0x0112, 1) in {5, 6, 7, 8}
+            if (image.height if rotated else image.width) <= width:
+                return False
+            image = ImageOps.exif_transpose(image)
+            height = max(round(image.height * width / image.width), 1)
+            resized = image.resize((width, height), Image.Resampling.LANCZOS)
+    # 픽셀이 너무 많은 이미지(압축 폭탄)도 줄이지 않고 원본을 보냅니다. `-W error`면 경고도 예외로 옵니다.
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError, Image.DecompressionBombWarning):
+        return False
+    format, _ = formats[media_type]
+    if format == "JPEG" and resized.mode not in {"RGB", "L"}:
+        resized = resized.convert("RGB")
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(destination), prefix=".derivative-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            resized.save(out, format, quality=80)
+        os.replace(temp, destination)
+    finally:
+        if os.path.exists(temp):
+            os.unlink(temp)
+    return True
+
+
+async def get_derivative(
+    store: BlobStore, key: str, width: int, media_type: str
+) -> Union[str, None]:
+    """`key` 원본을 줄인 이미지의 경로를 돌려줍니다. 처음 요청받으면 만들어 원본 옆에 둡니다.
+
+    줄일 필요가 없거나 줄일 수 없으면 `None`을 돌려줍니다. 이것도 표시 파일로 남겨 두어, 다음부터는
+    원본을 다시 열어 보지 않습니다.
+    """
+    source = store.path(key)
+    destination = store.path(derivative_key(key, width, media_type))
+    skipped = store.path(skipped_key(key, width, media_type))
+    if source is None or destination is None or skipped is None:
+        return None
+    if os.path.exists(destination):
+        return destination
+    if os.path.exists(skipped):
+        return None
+    if await pool.run(render, source, destination, width, media_type):
+        return destination
+    open(skipped, "wb").close()
+    return None
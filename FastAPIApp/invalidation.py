@@ -0,0 +1,218 @@
+import json
+import logging
+import select
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import closing
+from typing import Callable, Union
+import anyio
+from sqlalchemy.engine import make_url
+from FastAPIApp.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# 연결이 끊겨 알림을 놓쳤을 수 있으면 이 태그로 모든 캐시를 비웁니다.
+EVERYTHING = "*"
+RECONNECT_DELAY = 1  # 초
+
+Listener = Callable[[list[str]], None]
+# 태그를 받으면 캐시에서 지우는 함수들. 캐시를 가진 모듈이 `listen`으로 등록합니다.
+listeners: list[Listener] = []
+
+
+def listen(listener: Listener) -> Listener:
+    listeners.append(listener)
+    return listener
+
+
+class MemoryTransport:
+    """같은 프로세스 안에서만 전하는 가짜 전송로. 이름이 같은 것끼리 메시지를 주고받습니다."""
+
+    hubs: dict[str, list[Callable[[str], None]]] = defaultdict(list)
+
+    def __init__(self, name: str):
+        self.receivers = self.hubs[name]
+        self.receive = None
+
+    def publish(self, payload: str):
+        for receive in list(self.receivers):
+            receive(payload)
+
+    def start(self, receive: Callable[[str], None], reconnected: Callable[[], None]):
+        self.receive = receive
+        self.receivers.append(receive)
+
+    def close(self):
+        if self.receive in self.receivers:
+            self.receivers.remove(self.receive)
+
+
+class RedisTransport:
+    """Redis pub/sub 채널로 주고받습니다."""
+
+    def __init__(self, url: str, channel: str):
+        import redis  # Redis를 쓸 때만 필요합니다.
+        self.redis = redis
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self.closed = False
+
+    def publish(self, payload: str):
+        self.client.publish(self.channel, payload)
+
+    def start(self, receive: Callable[[str], None], reconnected: Callable[[], None]):
+        threading.Thread(
+            target=self.run, args=(receive, reconnected), name="cache-invalidation", daemon=True
+        ).start()
+
+    def run(self, receive: Callable[[str], None], reconnected: Callable[[], None]):
+        while not self.closed:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                reconnected()
+                for message in pubsub.listen():
+                    if self.closed:
+                        return
+                    receive(message["data"].decode())
+            except self.redis.RedisError:
+                logger.warning("캐시 무효화 채널에서 끊겼습니다. 다시 연결합니다.", exc_info=True)
+                time.sleep(RECONNECT_DELAY)
+
+    def close(self):
+        self.closed = True
+
+
+class PostgresTransport:
+    """Postgres `LISTEN`/`NOTIFY`로 주고받습니다. 따로 서버를 두지 않아도 됩니다."""
+
+    def __init__(self, url: str, channel: str):
+        import psycopg2
+        self.psycopg2 = psycopg2
+        self.dsn = str(make_url(url).set(drivername="postgresql"))
+        self.channel = channel
+        self.connection = None
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def connect(self):
+        connection = self.psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        return connection
+
+    def publish(self, payload: str):
+        with self.lock:
+            for retry in (True, False):
+                try:
+                    if self.connection is None or self.connection.closed:
+                        self.connection = self.connect()
+                    with self.connection.cursor() as cursor:
+                        cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+                    return
+                except self.psycopg2.OperationalError:
+                    self.connection = None
+                    if not retry:
+                        raise
+
+    def start(self, receive: Callable[[str], None], reconnected: Callable[[], None]):
+        threading.Thread(
+            target=self.run, args=(receive, reconnected), name="cache-invalidation", daemon=True
+        ).start()
+
+    def run(self, receive: Callable[[str], None], reconnected: Callable[[], None]):
+        while not self.closed:
+            try:
+                # 중간에 끊겨도 연결을 닫고 나서 다시 연결합니다.
+                with closing(self.connect()) as connection:
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'LISTEN "{self.channel}"')
+                    reconnected()
+                    while not self.closed:
+                        if select.select([connection], [], [], 5) == ([], [], []):
+                            continue
+                        connection.poll()
+                        while connection.notifies:
+                            receive(connection.notifies.pop(0).payload)
+            except (self.psycopg2.Error, OSError):
+                logger.warning("캐시 무효화 채널에서 끊겼습니다. 다시 연결합니다.", exc_info=True)
+                time.sleep(RECONNECT_DELAY)
+
+    def close(self):
+        self.closed = True
+
+
+def create_transport(url: str, channel: str):
+    """`CACHE_INVALIDATION_URL`의 scheme으로 전송로를 고릅니다. 비어 있으면 알리지 않습니다."""
+    if not url:
+        return None
+    scheme = url.split("://", 1)[0]
+    if scheme == "memory":
+        return MemoryTransport(url)
+    if scheme in ("redis", "rediss"):
+        return RedisTransport(url, channel)
+    if scheme.split("+", 1)[0] in ("postgresql", "postgres"):
+        return PostgresTransport(url, channel)
+    raise ValueError(f"알 수 없는 캐시 무효화 전송로입니다: {scheme}")
+
+
+class InvalidationBus:
+    """데이터를 고친 인스턴스가 캐시 태그를 알리면, 모든 인스턴스가 그 태그를 캐시에서 지웁니다."""
+
+    def __init__(self, transport=None, listeners: list[Listener] = listeners):
+        self.transport = transport
+        self.listeners = listeners
+        self.origin = uuid.uuid4().hex
+
+    def start(self):
+        if self.transport is not None:
+            self.transport.start(self.receive, lambda: self.drop([EVERYTHING]))
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    def drop(self, tags: list[str]):
+        for listener in self.listeners:
+            listener(tags)
+
+    def receive(self, payload: str):
+        try:
+            message = json.loads(payload)
+            if message["origin"] != self.origin:  # 보낸 인스턴스는 이미 지웠습니다.
+                self.drop(list(message["tags"]))
+        except (ValueError, KeyError, TypeError):
+            logger.warning("잘못된 캐시 무효화 메시지를 무시합니다: %r", payload)
+
+    async def publish(self, *tags: str):
+        """이 인스턴스의 캐시에서 지우고 다른 인스턴스에 알립니다. 커밋한 뒤에 부르세요."""
+        self.drop(list(tags))
+        if self.transport is None:
+            return
+        payload = json.dumps({"origin": self.origin, "tags": tags})
+        try:
+            await anyio.to_thread.run_sync(self.transport.publish, payload)
+        except Exception:  # 이미 커밋했으므로 요청은 실패시키지 않습니다. 다른 인스턴스는 TTL이 지나면 맞춰집니다.
+            logger.exception("캐시 무효화를 알리지 못했습니다: %s", tags)
+
+
+bus: Union[InvalidationBus, None] = None
+
+
+async def publish(*tags: str):
+    await bus.publish(*tags)
+
+
+def reset():
+    """설정을 바꾼 뒤 새 전송로를 쓰게 합니다."""
+    global bus
+    if bus is not None:
+        bus.close()
+    settings = get_settings()
+    bus = InvalidationBus(
+        create_transport(settings.CACHE_INVALIDATION_URL, settings.CACHE_INVALIDATION_CHANNEL))
+    bus.start()
+
+
+reset()
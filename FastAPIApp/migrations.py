@@ -0,0 +1,35 @@
+from sqlalchemy import event, inspect, text
+import FastAPIApp.schemas as schemas
+
+# 처음 만든 뒤에 더한 열. `create_all`은 이미 있는 테이블에 열을 더하지 않으므로 여기서 더합니다.
+# 이미 있는 행에는 값이 없으니 모두 NULL을 받을 수 있어야 합니다.
+ADDED_COLUMNS = {
+    schemas.UploadedFile.__table__: ("key", "size", "uploaded"),
+}
+
+
+def _add_columns(connection):
+    inspector = inspect(connection)
+    for table, names in ADDED_COLUMNS.items():
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for name in names:
+            if name in existing:
+                continue
+            column = table.columns[name]
+            # 인스턴스 여럿이 함께 켜져도 되도록 Postgres에서는 `IF NOT EXISTS`를 붙입니다.
+            guard = "IF NOT EXISTS " if connection.dialect.name == "postgresql" else ""
+            connection.execute(text(
+                f"ALTER TABLE \"{table.name}\" ADD COLUMN {guard}\"{name}\" "
+                f"{column.type.compile(dialect=connection.dialect)}"))
+        for index in table.indexes:  # 더한 열의 색인도 없으면 만듭니다.
+            if any(column.name in names for column in index.columns):
+                index.create(connection, checkfirst=True)
+
+
+@event.listens_for(schemas.Base.metadata, "after_create")
+def upgrade(target, connection, **kw):
+    """`create_all` 뒤에 이미 있던 테이블을 지금 스키마에 맞춥니다. 몇 번을 돌려도 같습니다.
+
+    새 테이블(`blobs` 등)은 `create_all`이 만듭니다.
+    """
+    _add_columns(connection)
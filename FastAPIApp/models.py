@@ -17,6 +17,12 @@ class PostType(str, Enum):
     rules = "rules"
 
 
+class MagazineFacet(str, Enum):
+    type = "type"
+    author = "author"
+    language = "language"
+
+
 class TokenData(BaseModel):
     student_id: Union[str, None] = None
 
@@ -192,6 +198,22 @@ class MagazineContent(MagazineContentBase):
         orm_mode = True
 
 
+class MagazineWork(MagazineContentBase):
+    """어느 호에 실렸는지와 함께 보내는 작품"""
+    no: int
+    published: date
+
+    class Config:
+        orm_mode = True
+
+
+class MagazineFacets(BaseModel):
+    """갈래·작가·언어마다 그 값을 가진 작품 수"""
+    type: dict[str, int]
+    author: dict[str, int]
+    language: dict[str, int]
+
+
 class MagazineBase(BaseModel):
     year: int
     cover: int
@@ -215,3 +237,18 @@ class MagazineOutline(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class SearchResult(BaseModel):
+    kind: str  # 글 종류(`PostType`) 또는 문예지 작품이면 "magazine"
+    no: int
+    published: date
+    title: str
+    snippet: str
+    rank: float
+
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    size: int
@@ -0,0 +1,61 @@
+import base64
+import json
+from datetime import date
+from typing import Any, Union
+from fastapi import HTTPException, Response
+from FastAPIApp.settings import get_settings
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+
+
+def page_size(limit: Union[int, None]) -> int:
+    """요청한 `limit`을 `PAGE_SIZE_MAX` 안으로 줄입니다. 주지 않으면 `PAGE_SIZE_MAX`개씩 보냅니다."""
+    maximum = get_settings().PAGE_SIZE_MAX
+    if limit is None:
+        return maximum
+    return max(0, min(limit, maximum))
+
+
+def _plain(key: Any) -> Any:
+    return key.isoformat() if isinstance(key, date) else key
+
+
+def _parsed(key: Any, kind: type) -> Any:
+    if kind is date:
+        return date.fromisoformat(key)
+    if not isinstance(key, kind):
+        raise ValueError(key)
+    return key
+
+
+def encode_cursor(key: Any) -> str:
+    """마지막으로 보낸 행의 key를 클라이언트가 그대로 돌려줄 불투명한 문자열로 만듭니다.
+
+    여러 열로 정렬했다면 그 값들을 tuple로 주세요.
+    """
+    key = [_plain(part) for part in key] if isinstance(key, tuple) else _plain(key)
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Union[str, None], kind: Union[type, tuple] = str) -> Any:
+    """`encode_cursor`로 만든 커서를 `kind` 값으로 되돌립니다. `kind`가 tuple이면 값도 tuple입니다."""
+    if cursor is None:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if isinstance(kind, tuple):
+            if not isinstance(key, list) or len(key) != len(kind):
+                raise ValueError(key)
+            return tuple(_parsed(part, part_kind) for part, part_kind in zip(key, kind))
+        return _parsed(key, kind)
+    except (ValueError, TypeError):
+        raise HTTPException(400, "잘못된 커서입니다.")
+
+
+def set_next_cursor(response: Response, rows: list, limit: int, key: Union[str, tuple]):
+    """한 쪽을 꽉 채웠으면 다음 쪽을 가리키는 커서를 헤더에 담습니다."""
+    if limit and len(rows) == limit:
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            tuple(getattr(last, part) for part in key) if isinstance(key, tuple) else getattr(last, key))
@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import threading
+import time
+import weakref
+from collections import deque
+import httpx
+from fastapi import HTTPException
+import FastAPIApp.models as models
+from FastAPIApp.cache import TTLCache
+from FastAPIApp.settings import get_settings
+
+
+def portal_failed():
+    return HTTPException(777, "연세포탈에서 정보를 받아오는 데 실패했습니다.")
+
+
+class PortalClient:
+    """연세포탈 인증 함수에 묻는 클라이언트.
+
+    연결을 계속 열어 두고 재사용하며, 동시에 보내는 요청 수와 기다리는 시간을 제한합니다.
+    """
+
+    def __init__(self):
+        settings = get_settings()
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                settings.YONSEI_AUTH_READ_TIMEOUT,
+                connect=settings.YONSEI_AUTH_CONNECT_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=settings.YONSEI_AUTH_CONCURRENCY,
+                max_keepalive_connections=settings.YONSEI_AUTH_CONCURRENCY,
+            ),
+        )
+        self.semaphore = asyncio.Semaphore(settings.YONSEI_AUTH_CONCURRENCY)
+
+    async def get_student_information(self, id: str, pw: str) -> models.ClubMember:
+        settings = get_settings()
+        if not breaker.allow():
+            raise portal_failed()
+        healthy = False
+        try:
+            async with self.semaphore:
+                response = await self.http.get(settings.YONSEI_AUTH_FUNCTION_ENDPOINT, params={
+                    "id": id,
+                    "pw": pw,
+                    "code": settings.YONSEI_AUTH_FUNCTION_CODE
+                })
+            # 인증 함수는 ID나 비밀번호가 틀려도 500으로 답하므로 그건 고장으로 치지 않습니다.
+            healthy = response.status_code <= 500
+        except httpx.HTTPError:
+            raise portal_failed()
+        finally:
+            breaker.record(healthy)
+        if response.status_code != 200:
+            raise portal_failed()
+        json = response.json()
+        return models.ClubMember(status=json["status"], student_id=id, name=json["name"], dept_and_major=json["deptMajor"])
+
+
+class CircuitBreaker:
+    """최근 요청 중 실패한 비율이 높으면 한동안 요청을 보내지 않고 바로 실패합니다.
+
+    최근 `window`개 중 `minimum`개 이상이 끝났고 그중 `threshold` 비율 이상이 실패하면 열립니다.
+    열린 지 `cooldown`초가 지나면 요청 하나만 시험 삼아 보내 보고(반열림), 성공하면 닫고
+    실패하면 다시 엽니다.
+    """
+
+    def __init__(self, window: int, minimum: int, threshold: float, cooldown: float):
+        self.minimum = minimum
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.results = deque(maxlen=window)
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.probing = True
+            return True
+
+    def record(self, success: bool):
+        with self.lock:
+            if self.probing:
+                self.probing = False
+                self.opened_at = None if success else time.monotonic()
+                return
+            if self.opened_at is not None:
+                return
+            self.results.append(success)
+            if (
+                len(self.results) >= self.minimum
+                and self.results.count(False) / len(self.results) >= self.threshold
+            ):
+                self.opened_at = time.monotonic()
+                self.results.clear()
+
+
+_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+# 캐시 key가 메모리에 남아도 비밀번호를 알아낼 수 없도록 프로세스마다 다른 키로 HMAC합니다.
+_cache_secret = os.urandom(32)
+
+
+def get_client() -> PortalClient:
+    """이벤트 루프마다 클라이언트를 하나씩 둡니다. 연결과 세마포어는 다른 루프에서 쓸 수 없습니다."""
+    loop = asyncio.get_running_loop()
+    if (client := _clients.get(loop)) is None:
+        client = _clients[loop] = PortalClient()
+    return client
+
+
+async def get_student_information(id: str, pw: str) -> models.ClubMember:
+    """성공한 확인 결과는 잠깐 기억해 두어 같은 ID와 비밀번호로 다시 묻지 않습니다."""
+    key = hmac.new(_cache_secret, f"{id}\0{pw}".encode(), hashlib.sha256).digest()
+    if (cached := verified.get(key)) is not None:
+        return cached
+    information = await get_client().get_student_information(id, pw)
+    verified.set(key, information)
+    return information
+
+
+def reset():
+    """설정을 바꾼 뒤 새 클라이언트와 캐시, 차단기를 쓰게 합니다."""
+    global verified, breaker
+    settings = get_settings()
+    _clients.clear()
+    verified = TTLCache(settings.YONSEI_AUTH_CACHE_SIZE, settings.YONSEI_AUTH_CACHE_TTL)
+    breaker = CircuitBreaker(
+        window=settings.YONSEI_AUTH_BREAKER_WINDOW,
+        minimum=settings.YONSEI_AUTH_BREAKER_MINIMUM,
+        threshold=settings.YONSEI_AUTH_BREAKER_THRESHOLD,
+        cooldown=settings.YONSEI_AUTH_BREAKER_COOLDOWN,
+    )
+
+
+reset()
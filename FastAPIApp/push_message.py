@@ -1,16 +1,30 @@
-import requests
 import json
+import logging
+import threading
 import urllib.parse
 import hashlib
 import hmac
 import base64
 import requests
 import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Union
+from fastapi import HTTPException
 import FastAPIApp.models as models
 import FastAPIApp.crud as crud
+import FastAPIApp.schemas as schemas
+from FastAPIApp.database import SessionLocal
 from FastAPIApp.settings import get_settings
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+logger = logging.getLogger(__name__)
+
+
+class SendFailed(Exception):
+    pass
+
 
 def make_signature(access_key: str, secret_key: str, timestamp: str, uri: str):
     secret_key = bytes(secret_key, "UTF-8")
@@ -21,31 +35,114 @@ def make_signature(access_key: str, secret_key: str, timestamp: str, uri: str):
     return signingKey
 
 
-def send_new_club_member_message(
-    club_member: models.ClubMember, db: Session, tel: str, invite_informal_chat: bool
+async def send_new_club_member_message(
+    club_member: models.ClubMember, db: AsyncSession, tel: str, invite_informal_chat: bool
 ):
+    """인사 담당자에게 보낼 문자를 outbox에 넣습니다. 실제로 보내는 건 `dispatcher`가 합니다."""
+    if not (to := (await crud.get_club_information(db=db)).HR_manager_tel):
+        raise HTTPException(500, "인사 담당자 연락처가 없습니다.")
+    await crud.create_outbox_message(
+        db,
+        to=to,
+        content=f"""{club_member.name}/{club_member.student_id}/{club_member.dept_and_major}/{club_member.status}/{tel}/잡담방 초대 {'O' if invite_informal_chat else 'X'}""",
+    )
+    dispatcher.wake()
+
+
+def send_messages(messages: list[schemas.OutboxMessage]):
+    """SENS에 한 번의 요청으로 보냅니다. 수신자마다 내용이 다를 수 있습니다."""
     settings = get_settings()
-    url = "https://sens.apigw.ntruss.com"
-    uri = f"/sms/v2/services/{urllib.parse.quote(settings.ncloud_sms_service_id)}/messages"
+    uri = f"/sms/v2/services/{urllib.parse.quote(settings.NCLOUD_SMS_SERVICE_ID)}/messages"
     timestamp = str(int(time.time() * 1000))
     data = json.dumps(
         {
             "type": "SMS",
-            "from": settings.ncloud_sms_service_phone_number,
-            "content": f"""{club_member.name}/{club_member.student_id}/{club_member.dept_and_major}/{club_member.status}/{tel}/잡담방 초대 {'O' if invite_informal_chat else 'X'}""",
-            "messages": [{"to": crud.get_club_information(db=db)["HR_chief_tel"]}],
+            "from": settings.NCLOUD_SMS_SERVICE_PHONE_NUMBER,
+            "content": messages[0].content,
+            "messages": [
+                {"to": message.to, "content": message.content} for message in messages
+            ],
         }
     )
-    response = requests.post(
-        url=url + uri,
-        data=data,
-        headers={
-            "Content-Type": "application/json; charset=utf-8",
-            "x-ncp-apigw-timestamp": timestamp,
-            "x-ncp-iam-access-key": settings.ncloud_access_key,
-            "x-ncp-apigw-signature-v2": make_signature(
-                settings.ncloud_access_key, settings.ncloud_secret_key, timestamp, uri
-            ),
-        },
-    )
-    return response.status_code == 202
+    try:
+        response = requests.post(
+            url=settings.NCLOUD_SENS_ENDPOINT.rstrip("/") + uri,
+            data=data.encode(),
+            headers={
+                "Content-Type": "application/json; charset=utf-8",
+                "x-ncp-apigw-timestamp": timestamp,
+                "x-ncp-iam-access-key": settings.NCLOUD_ACCESS_KEY,
+                "x-ncp-apigw-signature-v2": make_signature(
+                    settings.NCLOUD_ACCESS_KEY, settings.NCLOUD_SECRET_KEY, timestamp, uri
+                ),
+            },
+            timeout=settings.SMS_SEND_TIMEOUT,
+        )
+    except requests.RequestException as error:
+        raise SendFailed(repr(error))
+    if response.status_code != 202:
+        raise SendFailed(f"{response.status_code} {response.text[:200]}")
+
+
+def dispatch_due(db: Session) -> Union[float, None]:
+    """보낼 때가 된 문자를 `SMS_BATCH_SIZE`개씩 묶어 보냅니다.
+
+    다시 보내야 할 문자가 남아 있으면 그때까지 남은 초를, 없으면 `None`을 돌려줍니다.
+    """
+    settings = get_settings()
+    lease = timedelta(seconds=settings.SMS_SEND_TIMEOUT * 2)
+    while messages := crud.claim_outbox_messages(
+        db, claim=uuid.uuid4().hex, limit=settings.SMS_BATCH_SIZE, lease=lease
+    ):
+        try:
+            send_messages(messages)
+        except SendFailed as error:
+            logger.warning("문자 %d개를 보내지 못했습니다: %s", len(messages), error)
+            crud.finish_outbox_messages(db, messages, error=str(error))
+            break  # SENS가 받지 못하는 상태이므로 나머지도 나중에 보냅니다.
+        crud.finish_outbox_messages(db, messages)
+    if (next_attempt := crud.get_next_outbox_attempt(db)) is None:
+        return None
+    return max((next_attempt - datetime.utcnow()).total_seconds(), 0)
+
+
+class Dispatcher:
+    """outbox에 쌓인 문자를 응답과 상관없이 뒤에서 보내는 스레드.
+
+    `wake()`로 깨우면 보낼 때가 된 문자를 모두 보내고, 다시 보내야 할 문자가 있으면 그때까지 잡니다.
+    """
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self.event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def wake(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name="sms-dispatcher", daemon=True)
+                self.thread.start()
+        self.event.set()
+
+    def drain(self) -> Union[float, None]:
+        """보낼 때가 된 문자를 지금 이 스레드에서 보냅니다. 돌려주는 값은 `dispatch_due`와 같습니다."""
+        db = self.session_factory()
+        try:
+            return dispatch_due(db)
+        finally:
+            db.close()
+
+    def run(self):
+        while True:
+            self.event.clear()
+            try:
+                delay = self.drain()
+            except Exception:
+                logger.exception("문자를 보내다가 오류가 났습니다.")
+                delay = get_settings().SMS_RETRY_BASE
+            self.event.wait(delay)
+
+
+dispatcher = Dispatcher()
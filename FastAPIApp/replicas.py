@@ -0,0 +1,111 @@
+import itertools
+import math
+import threading
+import time
+from typing import Union
+from fastapi import Depends, Request
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.datastructures import MutableHeaders
+from FastAPIApp.database import AsyncSessionLocal, get_async_db
+from FastAPIApp.settings import get_settings
+
+PRIMARY_PIN_COOKIE = "db_primary_until"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class ReplicaSet:
+    """읽기 전용 복제본을 돌아가며 고릅니다.
+
+    연결에 실패한 복제본은 `retry_after`초 동안 빼 두고 남은 복제본에 보냅니다.
+    """
+
+    def __init__(self, urls: list[str], retry_after: float):
+        self.urls = list(urls)
+        self.retry_after = retry_after
+        self.down_until = {}
+        self.turn = itertools.count()
+        self.lock = threading.Lock()
+
+    def healthy(self) -> list[str]:
+        now = time.monotonic()
+        with self.lock:
+            return [url for url in self.urls if self.down_until.get(url, 0) <= now]
+
+    def choose(self) -> Union[str, None]:
+        if not (healthy := self.healthy()):
+            return None
+        with self.lock:
+            return healthy[next(self.turn) % len(healthy)]
+
+    def mark_down(self, url: str):
+        with self.lock:
+            self.down_until[url] = time.monotonic() + self.retry_after
+
+
+def is_pinned(request: Request) -> bool:
+    """이 클라이언트가 방금 글을 써서 복제본에 아직 반영되지 않았을 수 있는지 봅니다."""
+    try:
+        return float(request.cookies.get(PRIMARY_PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+async def _replica_session() -> Union[AsyncSession, None]:
+    """연결되는 복제본의 세션을 돌려줍니다. 모두 연결되지 않으면 `None`입니다."""
+    while (url := replicas.choose()) is not None:
+        db = AsyncSessionLocal(url)
+        try:
+            await db.connection()
+        except (DBAPIError, OSError):
+            await db.close()
+            replicas.mark_down(url)
+            continue
+        db.info["replica"] = url
+        return db
+    return None
+
+
+async def get_async_read_db(request: Request, primary: AsyncSession = Depends(get_async_db)):
+    """읽기만 하는 엔드포인트에서 `get_async_db` 대신 씁니다.
+
+    복제본이 있으면 돌아가며 읽고, 방금 글을 쓴 클라이언트나 복제본이 모두 죽었을 때는 주 DB에서 읽습니다.
+    """
+    if not replicas.urls or is_pinned(request) or (db := await _replica_session()) is None:
+        yield primary
+        return
+    async with db:
+        yield db
+
+
+class PrimaryPinMiddleware:
+    """글을 쓴 요청의 응답에 쿠키를 붙여, 그 클라이언트가 `DB_REPLICA_PIN_SECONDS`초 동안 주 DB에서 읽게 합니다."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS or not replicas.urls:
+            await self.app(scope, receive, send)
+            return
+
+        async def pinning_send(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                seconds = get_settings().DB_REPLICA_PIN_SECONDS
+                MutableHeaders(scope=message).append(
+                    "set-cookie",
+                    f"{PRIMARY_PIN_COOKIE}={time.time() + seconds:.3f}; Max-Age={math.ceil(seconds)}; "
+                    "Path=/; HttpOnly; SameSite=lax",
+                )
+            await send(message)
+        await self.app(scope, receive, pinning_send)
+
+
+def reset():
+    """설정을 바꾼 뒤 새 복제본 목록을 쓰게 합니다."""
+    global replicas
+    settings = get_settings()
+    replicas = ReplicaSet(settings.DB_REPLICA_CONNECTION_STRINGS, settings.DB_REPLICA_RETRY_AFTER)
+
+
+reset()
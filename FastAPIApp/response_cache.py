@@ -0,0 +1,170 @@
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Union
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from FastAPIApp import invalidation, replicas
+from FastAPIApp.cache import TTLCache
+from FastAPIApp.responses import is_not_modified
+from FastAPIApp.settings import get_settings
+
+CACHE_STATUS_HEADER = "X-Cache"
+# 304로 답할 때 함께 보내는 헤더
+REVALIDATION_HEADERS = {b"etag", b"cache-control", b"surrogate-key"}
+
+# 캐시해 둘 공개 GET 경로와, 그 응답을 낡게 만드는 데이터 묶음(태그)
+CACHED_PATHS = [
+    (re.compile(r"/club-information"), "club-information"),
+    (re.compile(r"/about"), "about"),
+    (re.compile(r"/rules"), "rules"),
+    (re.compile(r"/notices/(recent|count)"), "notice"),
+    (re.compile(r"/magazines/[^/]+"), "magazine"),  # /magazines/recent 포함
+]
+
+
+def cached_tag(path: str) -> Union[str, None]:
+    for pattern, tag in CACHED_PATHS:
+        if pattern.fullmatch(path):
+            return tag
+    return None
+
+
+class ResponseCache:
+    """직렬화한 JSON 응답을 태그별로 담아 두는 캐시.
+
+    데이터를 고치는 `crud` 함수가 `invalidation.publish`로 그 태그를 알리면 지웁니다. 태그마다 세대 번호를 두어,
+    고치기 전에 읽기 시작한 응답이 고친 뒤에 들어와 낡은 값이 남는 일을 막습니다.
+
+    복제본에서 읽으면 고친 내용이 늦게 보일 수 있으므로, 무효화한 뒤 `settle`초 동안은 담지 않습니다.
+    """
+
+    def __init__(self, size: int, ttl: float, settle: float = 0):
+        self.entries = TTLCache(size, ttl)
+        self.generations = Counter()
+        self.settle = settle
+        self.invalidated = {}  # 태그별로 마지막에 무효화한 때(`time.monotonic()`)
+        self.cleared = -math.inf
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple):
+        cached = self.entries.get(key)
+        with self.lock:
+            if cached is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return cached
+
+    def generation(self, tag: str) -> int:
+        with self.lock:
+            return self.generations[tag]
+
+    def set(self, key: tuple, value, generation: int):
+        """`generation`을 받은 뒤로 `key`의 태그가 무효화되지 않았을 때만 담습니다."""
+        with self.lock:
+            if self.generations[key[0]] != generation:
+                return
+            if time.monotonic() - max(self.invalidated.get(key[0], -math.inf), self.cleared) < self.settle:
+                return
+            self.entries.set(key, value)
+
+    def invalidate(self, *tags: str):
+        with self.lock:
+            now = time.monotonic()
+            for tag in tags:
+                self.generations[tag] += 1
+                self.invalidated[tag] = now
+        self.entries.pop_where(lambda key: key[0] in tags)
+
+    def clear(self):
+        with self.lock:
+            for tag in list(self.generations):
+                self.generations[tag] += 1
+            self.cleared = time.monotonic()
+        self.entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+class ResponseCacheMiddleware:
+    """`CACHED_PATHS`에 대한 GET 요청을 캐시에 있으면 DB에 가지 않고 그대로 돌려줍니다.
+
+    방금 글을 써서 주 DB에서 읽어야 하는 클라이언트의 요청은 캐시를 거치지 않습니다.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or (tag := cached_tag(scope["path"])) is None
+            or replicas.is_pinned(Request(scope))
+        ):
+            await self.app(scope, receive, send)
+            return
+        key = (tag, scope["path"], scope["query_string"])
+        if (cached := response_cache.get(key)) is not None:
+            headers, body = cached
+            etag = next((value.decode() for name, value in headers if name == b"etag"), None)
+            if etag and is_not_modified(Headers(scope=scope), etag, None):
+                await send({
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": [(name, value) for name, value in headers if name in REVALIDATION_HEADERS],
+                })
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [*headers, (CACHE_STATUS_HEADER.lower().encode(), b"HIT")],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        generation = response_cache.generation(tag)
+        headers, chunks = None, []
+
+        async def capturing_send(message):
+            nonlocal headers
+            if message["type"] == "http.response.start":
+                if message["status"] == 200:
+                    headers = [
+                        (name, value) for name, value in message["headers"]
+                        if name.lower() != b"set-cookie"
+                    ]
+                MutableHeaders(scope=message).append(CACHE_STATUS_HEADER, "MISS")
+            elif message["type"] == "http.response.body" and headers is not None:
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    response_cache.set(key, (headers, b"".join(chunks)), generation)
+            await send(message)
+        await self.app(scope, receive, capturing_send)
+
+
+@invalidation.listen
+def drop(tags: list[str]):
+    if invalidation.EVERYTHING in tags:
+        response_cache.clear()
+    else:
+        response_cache.invalidate(*tags)
+
+
+def reset():
+    """설정을 바꾼 뒤 새 캐시를 쓰게 합니다."""
+    global response_cache
+    settings = get_settings()
+    response_cache = ResponseCache(
+        settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_TTL,
+        settle=settings.DB_REPLICA_PIN_SECONDS if settings.DB_REPLICA_CONNECTION_STRINGS else 0)
+
+
+reset()
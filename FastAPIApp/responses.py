@@ -0,0 +1,186 @@
+import os
+import re
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterator, Callable, Iterator, Union
+import anyio
+from starlette.concurrency import iterate_in_threadpool
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+from FastAPIApp.storage import CHUNK_SIZE
+
+range_pattern = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# 한 번 올라온 파일의 내용은 바뀌지 않으므로 오래 캐시해도 됩니다.
+IMMUTABLE = "public, max-age=31536000, immutable"
+# 바뀔 수 있는 공개 JSON은 캐시해 두되 쓸 때마다 ETag로 다시 확인하게 합니다.
+REVALIDATE = "public, no-cache"
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: Union[str, None], size: int) -> Union[tuple[int, int], None]:
+    """`Range` 헤더를 `[start, stop)` 구간으로 바꿉니다.
+
+    헤더가 없거나 여러 구간을 요청하면 `None`을 돌려줍니다. 이때는 전체를 보내면 됩니다.
+    """
+    if header is None:
+        return None
+    match = range_pattern.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:  # bytes=-500: 마지막 500바이트
+        start, stop = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        stop = min(int(last) + 1, size) if last else size
+    if start >= size or start >= stop:
+        raise RangeNotSatisfiable
+    return start, stop
+
+
+def http_date(moment: datetime) -> str:
+    return format_datetime(moment.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def cache_headers(etag: str, last_modified: Union[datetime, None]) -> dict[str, str]:
+    headers = {"etag": etag, "cache-control": IMMUTABLE}
+    if last_modified:
+        headers["last-modified"] = http_date(last_modified)
+    return headers
+
+
+def version_headers(resource: str, version: int) -> dict[str, str]:
+    """`resource`의 버전으로 만든 ETag와, CDN이 `resource` 단위로 지울 수 있게 하는 surrogate key"""
+    return {
+        "etag": f'W/"{resource}-{version}"',
+        "cache-control": REVALIDATE,
+        "surrogate-key": resource,
+    }
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """`If-None-Match` 꼴의 헤더에 `etag`가 들어 있는지 약한 비교로 확인합니다."""
+    if header.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in {
+        tag.strip().removeprefix("W/") for tag in header.split(",")
+    }
+
+
+def is_not_modified(headers, etag: str, last_modified: Union[datetime, None]) -> bool:
+    """요청 헤더로 보아 `304 Not Modified`로 답해도 되는지 확인합니다."""
+    if (if_none_match := headers.get("if-none-match")) is not None:
+        return etag_matches(if_none_match, etag)
+    if last_modified and (if_modified_since := headers.get("if-modified-since")):
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+    return False
+
+
+def usable_range(headers, etag: str) -> Union[str, None]:
+    """`If-Range`가 지금 내용과 맞지 않으면 `Range`를 무시하고 전체를 보내야 합니다."""
+    if (if_range := headers.get("if-range")) is not None and if_range.strip() != etag:
+        return None
+    return headers.get("range")
+
+
+class BlobResponse(Response):
+    """`Range` 요청을 지원하며 내용을 조금씩 흘려보내는 응답.
+
+    `path`가 있으면 파일에서 바로 보내고, 서버가 `http.response.zerocopysend`를 지원하면
+    `sendfile`로 보냅니다. `path`가 없으면 `chunks(start, stop)`이 돌려주는 조각을 보냅니다.
+    `chunks`는 비동기 이터레이터를 돌려줘도 됩니다.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        media_type: str,
+        range_header: Union[str, None] = None,
+        path: Union[str, None] = None,
+        chunks: Union[Callable[[int, int], Union[Iterator[bytes], AsyncIterator[bytes]]], None] = None,
+        headers: Union[dict[str, str], None] = None,
+    ):
+        self.path = path
+        self.chunks = chunks
+        self.media_type = media_type
+        self.background = None
+        headers = dict(headers or {})
+        headers["accept-ranges"] = "bytes"
+        try:
+            requested = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            self.status_code = 416
+            self.start = self.stop = 0
+            headers["content-range"] = f"bytes */{size}"
+        else:
+            self.start, self.stop = requested or (0, size)
+            self.status_code = 206 if requested else 200
+            if requested:
+                headers["content-range"] = f"bytes {self.start}-{self.stop - 1}/{size}"
+        headers["content-length"] = str(self.stop - self.start)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if scope["method"] == "HEAD" or self.stop == self.start:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif self.path is not None:
+            await self.send_file(scope, send)
+        else:
+            chunks = self.chunks(self.start, self.stop)
+            if not hasattr(chunks, "__aiter__"):
+                chunks = iterate_in_threadpool(chunks)
+            async for chunk in chunks:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def send_file(self, scope: Scope, send: Send):
+        fd = await anyio.to_thread.run_sync(os.open, self.path, os.O_RDONLY)
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": fd,
+                        "offset": self.start,
+                        "count": self.stop - self.start,
+                        "more_body": False,
+                    }
+                )
+                return
+            offset = self.start
+            while offset < self.stop:
+                size = min(CHUNK_SIZE, self.stop - offset)
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, size, offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": offset < self.stop,
+                    }
+                )
+            if offset < self.stop:  # 파일이 도중에 짧아졌습니다.
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            os.close(fd)
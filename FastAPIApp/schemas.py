@@ -3,10 +3,12 @@ from sqlalchemy import (
     Integer,
     String,
     Date,
+    DateTime,
     ForeignKey,
-    LargeBinary
+    Index,
+    LargeBinary,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 
 from FastAPIApp.database import Base
 
@@ -26,6 +28,17 @@ class Member(Base):
     role = Column(String)
 
 
+class TokenVersion(Base):
+    """회원별로 지금 유효한 토큰 버전. 이보다 낮은 버전으로 발급한 토큰은 거절합니다.
+
+    역할이나 비밀번호가 바뀌거나 회원이 지워지면 올립니다. 회원이 지워져도 남겨 둡니다.
+    """
+
+    __tablename__ = "tokenVersions"
+    student_id = Column(String, primary_key=True)
+    version = Column(Integer, default=0)
+
+
 class Post(Base):
     __tablename__ = "posts"
     no = Column(Integer, primary_key=True, index=True, autoincrement=True)
@@ -36,23 +49,76 @@ class Post(Base):
     published = Column(Date)
     modified = Column(Date, nullable=True)
     modifier = Column(String, nullable=True)
+    # 읽는 쪽에서 `joinedload`나 `selectinload`로 함께 읽어야 합니다. 모르고 하나씩 읽어 N+1 쿼리가 되지 않도록 막아 둡니다.
     attached = relationship(
         "UploadedFile",
+        order_by="UploadedFile.id",
         cascade="all,delete",
         passive_deletes=True,
+        lazy="raise",
     )
 
 
+# 종류별 목록을 최신 글부터 읽고 커서로 넘기는 데 씁니다.
+Index("ix_posts_type_no", Post.type, Post.no.desc())
+
+
+class PostCount(Base):
+    """종류별 글 수. 글을 쓰고 지우는 트랜잭션에서 함께 고칩니다."""
+
+    __tablename__ = "postCounts"
+    type = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+
+
+class ResourceVersion(Base):
+    """글 종류, 동아리 정보, 문예지 같은 공개 자료의 버전. 고칠 때마다 같은 트랜잭션에서 올리고 ETag로 씁니다."""
+
+    __tablename__ = "resourceVersions"
+    resource = Column(String, primary_key=True)
+    version = Column(Integer, default=0)
+
+
 class UploadedFile(Base):
     __tablename__ = "uploadedFiles"
     id = Column(Integer, primary_key=True)
     name = Column(String)
     content_type = Column(String)
-    binary = Column(LargeBinary)
+    key = Column(String, nullable=True, index=True)  # `storage.BlobStore`의 key
+    size = Column(Integer, nullable=True)
+    uploaded = Column(DateTime, nullable=True)  # UTC
+    # 블롭 저장소 도입 전에 올라온 파일의 내용. 메타데이터만 읽을 때 딸려오지 않도록 미룹니다.
+    binary = deferred(Column(LargeBinary, nullable=True))
     post_no = Column(Integer, ForeignKey(
         "posts.no", ondelete="CASCADE"), nullable=True)
 
 
+class OutboxMessage(Base):
+    """보낼 문자 하나. `push_message.Dispatcher`가 모아서 보내고 결과를 기록합니다."""
+
+    __tablename__ = "outboxMessages"
+    id = Column(Integer, primary_key=True)
+    to = Column(String)
+    content = Column(String)
+    status = Column(String, default="pending", index=True)  # pending, sent, failed
+    attempts = Column(Integer, default=0)
+    # 다음에 보내 볼 시각(UTC). 보내는 중에는 다른 발송기가 가져가지 않도록 뒤로 미뤄 둡니다.
+    next_attempt = Column(DateTime, index=True)
+    claim = Column(String, nullable=True)  # 지금 이 문자를 보내는 발송기
+    last_error = Column(String, nullable=True)
+    created = Column(DateTime)  # UTC
+    sent = Column(DateTime, nullable=True)  # UTC
+
+
+class Blob(Base):
+    """`storage.BlobStore`에 든 내용 하나. 같은 내용의 `UploadedFile`끼리 나눠 씁니다."""
+
+    __tablename__ = "blobs"
+    key = Column(String, primary_key=True)
+    size = Column(Integer)
+    refcount = Column(Integer, default=0)  # 이 블롭을 가리키는 `UploadedFile`의 수
+
+
 class Class(Base):
     __tablename__ = "classes"
     name = Column(String, primary_key=True)
@@ -80,8 +146,10 @@ class Magazine(Base):
     cover = Column(Integer, ForeignKey("uploadedFiles.id"))  # 표지 파일 ID
     published = Column(Date, primary_key=True)
     contents = relationship("MagazineContent",
+                            order_by="MagazineContent.no",
                             cascade="all,delete",
-                            passive_deletes=True,)
+                            passive_deletes=True,
+                            lazy="raise",)  # `Post.attached`처럼 함께 읽어야 합니다.
 
 
 class MagazineContent(Base):
@@ -93,3 +161,18 @@ class MagazineContent(Base):
     title = Column(String)
     author = Column(String)
     language = Column(String)
+
+
+# 모든 호에 걸쳐 한 갈래나 작가, 언어의 작품을 최근 호부터 찾을 때 씁니다.
+Index("ix_magazineContents_type_published", MagazineContent.type, MagazineContent.published.desc())
+Index("ix_magazineContents_author_published", MagazineContent.author, MagazineContent.published.desc())
+Index("ix_magazineContents_language_published", MagazineContent.language, MagazineContent.published.desc())
+
+
+class MagazineFacet(Base):
+    """문예지 작품의 갈래·작가·언어별 작품 수. 문예지를 만들고 고치고 지우는 트랜잭션에서 함께 고칩니다."""
+
+    __tablename__ = "magazineFacets"
+    field = Column(String, primary_key=True)  # "type", "author", "language"
+    value = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
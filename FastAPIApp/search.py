@@ -0,0 +1,149 @@
+import html
+import re
+from fastapi import HTTPException
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+import FastAPIApp.models as models
+import FastAPIApp.schemas as schemas
+
+# DB가 찾은 부분을 이 글자로 감싸면, 나머지를 이스케이프한 뒤 <mark>로 바꿉니다.
+MARK_START = "\ue000"
+MARK_END = "\ue001"
+SNIPPET_WORDS = 16
+
+# SQLite: 원본 테이블을 그대로 읽는 FTS5 색인과, 글을 쓰고 고치고 지울 때 색인을 고치는 트리거
+SQLITE_INDEXES = {
+    "postsSearch": ("posts", "no", ("title", "content")),
+    "magazineContentsSearch": ("magazineContents", "no", ("title", "author")),
+}
+
+# Postgres: 원본 테이블에 저장해 두는 tsvector 열과 GIN 색인
+POSTGRES_INDEXES = {
+    "posts": ("title", "content"),
+    "magazineContents": ("title", "author"),
+}
+
+
+def _install_sqlite(connection):
+    for index, (table, key, columns) in SQLITE_INDEXES.items():
+        existed = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": index}
+        ).first()
+        listed = ", ".join(columns)
+        new = ", ".join(f"new.{column}" for column in columns)
+        old = ", ".join(f"old.{column}" for column in columns)
+        delete = (f"INSERT INTO \"{index}\"(\"{index}\", rowid, {listed}) "
+                  f"VALUES ('delete', old.{key}, {old});")
+        insert = f"INSERT INTO \"{index}\"(rowid, {listed}) VALUES (new.{key}, {new});"
+        for statement in (
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS \"{index}\" USING fts5("
+            f"{listed}, content='{table}', content_rowid='{key}')",
+            f"CREATE TRIGGER IF NOT EXISTS \"{index}Insert\" AFTER INSERT ON \"{table}\" "
+            f"BEGIN {insert} END",
+            f"CREATE TRIGGER IF NOT EXISTS \"{index}Delete\" AFTER DELETE ON \"{table}\" "
+            f"BEGIN {delete} END",
+            f"CREATE TRIGGER IF NOT EXISTS \"{index}Update\" AFTER UPDATE ON \"{table}\" "
+            f"BEGIN {delete} {insert} END",
+        ):
+            connection.execute(text(statement))
+        if not existed:  # 색인보다 먼저 있던 글도 찾을 수 있게 합니다.
+            connection.execute(text(f"INSERT INTO \"{index}\"(\"{index}\") VALUES ('rebuild')"))
+
+
+def _install_postgres(connection):
+    for table, (weighted, rest) in POSTGRES_INDEXES.items():
+        connection.execute(text(
+            f"ALTER TABLE \"{table}\" ADD COLUMN IF NOT EXISTS search tsvector "
+            f"GENERATED ALWAYS AS ("
+            f"setweight(to_tsvector('simple', coalesce({weighted}, '')), 'A') || "
+            f"setweight(to_tsvector('simple', coalesce({rest}, '')), 'B')) STORED"))
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS \"ix_{table}_search\" ON \"{table}\" USING GIN (search)"))
+
+
+@event.listens_for(schemas.Base.metadata, "after_create")
+def install(target, connection, **kw):
+    """`create_all` 뒤에 검색 색인을 만듭니다. 이미 있으면 그대로 둡니다."""
+    if connection.dialect.name == "sqlite":
+        _install_sqlite(connection)
+    elif connection.dialect.name == "postgresql":
+        _install_postgres(connection)
+
+
+SQLITE_QUERY = f"""
+SELECT kind, no, published, title, snippet, rank FROM (
+    SELECT p.type AS kind, p.no AS no, p.published AS published,
+           highlight("postsSearch", 0, :start, :end) AS title,
+           snippet("postsSearch", 1, :start, :end, '…', {SNIPPET_WORDS}) AS snippet,
+           -bm25("postsSearch", 4.0, 1.0) AS rank
+    FROM "postsSearch" JOIN posts p ON p.no = "postsSearch".rowid
+    WHERE "postsSearch" MATCH :query
+    UNION ALL
+    SELECT 'magazine', c.no, c.published,
+           highlight("magazineContentsSearch", 0, :start, :end),
+           highlight("magazineContentsSearch", 1, :start, :end),
+           -bm25("magazineContentsSearch", 4.0, 1.0)
+    FROM "magazineContentsSearch" JOIN "magazineContents" c ON c.no = "magazineContentsSearch".rowid
+    WHERE "magazineContentsSearch" MATCH :query
+) ORDER BY rank DESC, published DESC, no DESC LIMIT :limit OFFSET :skip
+"""
+
+# 요약은 보낼 쪽에 든 결과만 만들도록 순위를 매겨 자른 뒤에 만듭니다.
+POSTGRES_QUERY = """
+SELECT kind, no, published, rank,
+       ts_headline('simple', title, to_tsquery('simple', :query), :title_options) AS title,
+       ts_headline('simple', body, to_tsquery('simple', :query), :snippet_options) AS snippet
+FROM (
+    SELECT p.type AS kind, p.no AS no, p.published AS published, p.title AS title,
+           coalesce(p.content, '') AS body, ts_rank(p.search, to_tsquery('simple', :query)) AS rank
+    FROM posts p WHERE p.search @@ to_tsquery('simple', :query)
+    UNION ALL
+    SELECT 'magazine', c.no, c.published, c.title,
+           coalesce(c.author, ''), ts_rank(c.search, to_tsquery('simple', :query))
+    FROM "magazineContents" c WHERE c.search @@ to_tsquery('simple', :query)
+    ORDER BY rank DESC, published DESC, no DESC LIMIT :limit OFFSET :skip
+) found ORDER BY rank DESC, published DESC, no DESC
+"""
+
+
+def terms(query: str) -> list[str]:
+    """검색어를 낱말로 나눕니다. 따옴표나 연산자 같은 문법은 쓰지 않습니다."""
+    return re.findall(r"\w+", query)
+
+
+def highlighted(value: str) -> str:
+    return html.escape(value or "").replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+async def search(db: AsyncSession, query: str, skip: int = 0, limit: int = 100) -> list[models.SearchResult]:
+    """공지 등의 글 제목·내용과 문예지 작품 제목·작가에서 찾습니다.
+
+    낱말마다 그 낱말로 시작하는 말을 찾고(`시` → `시를`), 모든 낱말이 든 것만 돌려줍니다.
+    찾은 부분은 `<mark>`로 감쌉니다.
+    """
+    if not (words := terms(query)) or limit <= 0:
+        return []
+    dialect = db.bind.dialect.name
+    if dialect == "sqlite":
+        statement = text(SQLITE_QUERY)
+        parameters = {"query": " ".join(f'"{word}"*' for word in words)}
+    elif dialect == "postgresql":
+        statement = text(POSTGRES_QUERY)
+        marks = f"StartSel={MARK_START}, StopSel={MARK_END}"
+        parameters = {
+            "query": " & ".join(f"{word}:*" for word in words),
+            "title_options": f"{marks}, HighlightAll=true",
+            "snippet_options": f"{marks}, MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}",
+        }
+    else:
+        raise HTTPException(501, "이 DB에서는 검색할 수 없습니다.")
+    rows = (await db.execute(statement, {
+        **parameters, "start": MARK_START, "end": MARK_END, "skip": skip, "limit": limit,
+    })).all()
+    return [
+        models.SearchResult(
+            kind=row.kind, no=row.no, published=row.published,
+            title=highlighted(row.title), snippet=highlighted(row.snippet), rank=row.rank,
+        )
+        for row in rows
+    ]
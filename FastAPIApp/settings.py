@@ -1,16 +1,61 @@
+import os
 from functools import cache
-from pydantic import BaseSettings
+from pydantic import BaseSettings, validator
 
 
 class Settings(BaseSettings):
     JWT_SECRET: str
+    # 켜면 토큰에 역할 등을 담아 두고 회원 정보를 DB에서 읽지 않고 권한을 확인합니다.
+    JWT_STATELESS: bool = False
+    TOKEN_REVOCATION_REFRESH: float = 30  # 초
     NCLOUD_ACCESS_KEY: str
     NCLOUD_SECRET_KEY: str
     NCLOUD_SMS_SERVICE_ID: str
     NCLOUD_SMS_SERVICE_PHONE_NUMBER: str
+    NCLOUD_SENS_ENDPOINT: str = "https://sens.apigw.ntruss.com"
+    SMS_BATCH_SIZE: int = 100  # SENS가 한 번에 받는 최대 수신자 수
+    SMS_SEND_TIMEOUT: float = 10  # 초
+    SMS_MAX_ATTEMPTS: int = 8
+    SMS_RETRY_BASE: float = 5  # 초, 실패할 때마다 두 배로 늘립니다.
+    SMS_RETRY_MAX: float = 600  # 초
     DB_CONNECTION_STRING: str
+    # 주지 않으면 모두 주 DB에서 읽습니다.
+    DB_REPLICA_CONNECTION_STRINGS: list[str] = []
+    DB_REPLICA_PIN_SECONDS: float = 5  # 초, 글을 쓴 클라이언트는 이동안 주 DB에서 읽습니다.
+    DB_REPLICA_RETRY_AFTER: float = 30  # 초, 연결에 실패한 복제본을 빼 두는 시간
     YONSEI_AUTH_FUNCTION_ENDPOINT: str
     YONSEI_AUTH_FUNCTION_CODE: str
+    YONSEI_AUTH_CONNECT_TIMEOUT: float = 3.0  # 초
+    YONSEI_AUTH_READ_TIMEOUT: float = 10.0  # 초
+    YONSEI_AUTH_CONCURRENCY: int = 10
+    YONSEI_AUTH_CACHE_SIZE: int = 1024
+    YONSEI_AUTH_CACHE_TTL: float = 300  # 초
+    YONSEI_AUTH_BREAKER_WINDOW: int = 20
+    YONSEI_AUTH_BREAKER_MINIMUM: int = 5
+    YONSEI_AUTH_BREAKER_THRESHOLD: float = 0.5
+    YONSEI_AUTH_BREAKER_COOLDOWN: float = 30  # 초
+    PAGE_SIZE_MAX: int = 100  # 목록 한 쪽에 담는 최대 개수
+    MEMBER_CACHE_SIZE: int = 1024
+    MEMBER_CACHE_TTL: float = 60  # 초
+    RESPONSE_CACHE_SIZE: int = 256
+    RESPONSE_CACHE_TTL: float = 60  # 초
+    # "redis://...", "postgresql://..." 또는 "memory://이름". 비우면 다른 인스턴스에 알리지 않습니다.
+    CACHE_INVALIDATION_URL: str = ""
+    CACHE_INVALIDATION_CHANNEL: str = "cache_invalidation"
+    SNAPSHOT_DIRECTORY: str = ""  # 공개 페이지를 정적 JSON으로 써 둘 곳. 비우면 쓰지 않습니다.
+    # 올린 파일을 둘 디렉터리의 절대 경로. 인스턴스가 여럿이면 Azure Files처럼 모두 함께 마운트한 곳이어야 합니다.
+    BLOB_STORE_DIRECTORY: str
+    MAX_UPLOAD_SIZE: int = 256 * 1024 * 1024  # 256 MiB
+    IMAGE_DERIVATIVE_WIDTHS: list[int] = [160, 320, 640, 1280]
+    IMAGE_WORKERS: int = 2
+    PASSWORD_HASHING_WORKERS: int = 2
+
+    @validator("BLOB_STORE_DIRECTORY")
+    def _absolute(cls, directory: str) -> str:
+        # 상대 경로면 인스턴스마다 다른 곳을 가리키므로 앱을 켤 때 멈춥니다.
+        if not os.path.isabs(directory):
+            raise ValueError("모든 인스턴스가 함께 쓰는 디렉터리의 절대 경로를 주세요.")
+        return directory
 
 
 @cache
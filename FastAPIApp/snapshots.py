@@ -0,0 +1,181 @@
+"""공개 페이지의 응답을 정적 JSON 파일로 써 둡니다.
+
+`SNAPSHOT_DIRECTORY` 아래에 주소와 같은 경로로 씁니다. 예를 들어 `/notices/3`은 `notices/3.json`,
+`/magazines/recent`는 `magazines/recent.json`입니다. 목록은 쪽을 나누지 않고 `notices.json`,
+`magazines.json`에 모두 담습니다. 이 디렉터리를 블롭 저장소나 CDN에 올리면 익명 방문자는 함수 앱을
+깨우지 않고 읽을 수 있습니다.
+
+글을 고치면 `crud`가 `snapshotter.refresh`를 불러 바뀐 파일만 뒤에서 다시 씁니다.
+처음부터 모두 다시 쓰려면 `python -m FastAPIApp.snapshots [디렉터리]`를 실행하세요.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import sys
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import date
+from typing import Any, Iterable, Union
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.ext.asyncio import AsyncSession
+import FastAPIApp.crud as crud
+import FastAPIApp.models as models
+from FastAPIApp.database import AsyncSessionLocal
+from FastAPIApp.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+RECENT_LIMIT = 4  # `/notices/recent`, `/magazines/recent`의 기본 개수
+
+
+def _write(directory: str, path: str, value: Any):
+    """다 쓴 뒤에 바꿔 넣어 읽는 쪽이 반쯤 쓴 파일을 보지 않게 합니다."""
+    target = os.path.join(directory, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as file:
+        json.dump(jsonable_encoder(value), file, ensure_ascii=False, separators=(",", ":"))
+    os.replace(temporary, target)
+
+
+def _remove(directory: str, path: str):
+    try:
+        os.remove(os.path.join(directory, path))
+    except FileNotFoundError:
+        pass
+
+
+async def _render_post(db: AsyncSession, directory: str, type: models.PostType):
+    if post := await crud.get_post(db, type=type):
+        _write(directory, f"{type.value}.json", models.Post.from_orm(post))
+    else:
+        _remove(directory, f"{type.value}.json")
+
+
+async def _render_notices(db: AsyncSession, directory: str, numbers: Iterable[int]):
+    notices = [models.PostOutline.from_orm(notice)
+               for notice in await crud.get_posts(db, type=models.PostType.notice)]
+    _write(directory, "notices.json", notices)
+    _write(directory, "notices/recent.json", notices[:RECENT_LIMIT])
+    _write(directory, "notices/count.json", await crud.get_post_count(db, type=models.PostType.notice))
+    for no in numbers:
+        notice = await crud.get_post(db, type=models.PostType.notice, no=no)
+        if notice is not None and notice.type == models.PostType.notice.value:
+            _write(directory, f"notices/{no}.json", models.Post.from_orm(notice))
+        else:
+            _remove(directory, f"notices/{no}.json")
+
+
+async def _render_magazines(db: AsyncSession, directory: str, dates: Iterable[date]):
+    magazines = [models.MagazineOutline.from_orm(magazine)
+                 for magazine in await crud.get_magazines(db, limit=None)]
+    _write(directory, "magazines.json", magazines)
+    _write(directory, "magazines/recent.json", magazines[:RECENT_LIMIT])
+    for published in dates:
+        if magazine := await crud.get_magazine(db, published):
+            _write(directory, f"magazines/{published}.json", models.Magazine.from_orm(magazine))
+        else:
+            _remove(directory, f"magazines/{published}.json")
+
+
+async def render(db: AsyncSession, directory: str, resource: str, keys: Iterable = ()):
+    """`resource`가 바뀌어 낡은 파일을 다시 씁니다. `keys`는 바뀐 글 번호나 문예지 발행일입니다."""
+    if resource == "club-information":
+        _write(directory, "club-information.json", await crud.get_club_information(db))
+    elif resource in (models.PostType.about.value, models.PostType.rules.value):
+        await _render_post(db, directory, models.PostType(resource))
+    elif resource == models.PostType.notice.value:
+        await _render_notices(db, directory, keys)
+    elif resource == "magazine":
+        await _render_magazines(db, directory, keys)
+
+
+def _stale(directory: str, folder: str, kept: set[str]) -> list[str]:
+    """`folder` 안의 상세 파일 중 `kept`에 없는 것"""
+    try:
+        names = os.listdir(os.path.join(directory, folder))
+    except FileNotFoundError:
+        return []
+    return [f"{folder}/{name}" for name in names
+            if name.endswith(".json") and name not in kept | {"recent.json", "count.json"}]
+
+
+async def rebuild(db: AsyncSession, directory: str):
+    """모든 파일을 처음부터 다시 쓰고, 지워진 글과 문예지의 파일은 지웁니다."""
+    numbers = [notice.no for notice in await crud.get_posts(db, type=models.PostType.notice)]
+    dates = [magazine.published for magazine in await crud.get_magazines(db, limit=None)]
+    await render(db, directory, "club-information")
+    await render(db, directory, models.PostType.about.value)
+    await render(db, directory, models.PostType.rules.value)
+    await render(db, directory, models.PostType.notice.value, numbers)
+    await render(db, directory, "magazine", dates)
+    for path in _stale(directory, "notices", {f"{no}.json" for no in numbers}) + _stale(
+            directory, "magazines", {f"{published}.json" for published in dates}):
+        _remove(directory, path)
+
+
+class Snapshotter:
+    """바뀐 자료의 파일을 응답과 상관없이 뒤에서 다시 쓰는 스레드.
+
+    스레드마다 이벤트 루프를 하나 두고 그 안에서 `crud`의 비동기 함수를 씁니다.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def refresh(self, resources: Iterable[str], keys: Iterable = ()):
+        if not get_settings().SNAPSHOT_DIRECTORY:
+            return
+        self.queue.put((tuple(resources), tuple(keys)))
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="snapshotter", daemon=True)
+                self.thread.start()
+
+    def wait(self):
+        """지금까지 부탁받은 파일을 모두 쓸 때까지 기다립니다."""
+        self.queue.join()
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        while True:
+            batch = [self.queue.get()]
+            while not self.queue.empty():  # 몰려 온 변경은 한 번에 씁니다.
+                batch.append(self.queue.get())
+            changed = defaultdict(set)
+            for resources, keys in batch:
+                for resource in resources:
+                    changed[resource].update(keys)
+            try:
+                loop.run_until_complete(self.render(changed))
+            except Exception:
+                logger.exception("스냅숏을 쓰다가 오류가 났습니다: %s", dict(changed))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def render(self, changed: dict[str, set]):
+        directory = get_settings().SNAPSHOT_DIRECTORY
+        async with self.session_factory() as db:
+            for resource, keys in changed.items():
+                await render(db, directory, resource, sorted(keys))
+
+
+snapshotter = Snapshotter()
+
+
+async def main(directory: Union[str, None] = None):
+    if not (directory := directory or get_settings().SNAPSHOT_DIRECTORY):
+        raise SystemExit("SNAPSHOT_DIRECTORY를 정해 주세요.")
+    async with AsyncSessionLocal() as db:
+        await rebuild(db, directory)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*sys.argv[1:2]))
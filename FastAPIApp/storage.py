@@ -0,0 +1,133 @@
+import hashlib
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from functools import cache
+from typing import BinaryIO, Iterator, Union
+from starlette.concurrency import run_in_threadpool
+from FastAPIApp.settings import get_settings
+
+CHUNK_SIZE = 1024 * 1024  # 1 MiB
+KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+class BlobTooLarge(Exception):
+    """올린 파일이 `MAX_UPLOAD_SIZE`보다 큽니다."""
+
+
+class BlobStore(ABC):
+    """업로드된 파일의 내용을 담는 저장소.
+
+    내용의 SHA-256 값(16진수)을 key로 씁니다. 같은 내용이면 같은 key가 나옵니다.
+    """
+
+    @abstractmethod
+    async def stage(self, file, max_size: int) -> tuple[str, int, str]:
+        """`file.read()`로 조금씩 읽어 임시로 써 두고 `(key, 크기, 임시 위치)`를 돌려줍니다.
+
+        `commit`으로 제자리에 옮기거나, 옮기지 못했으면 `discard`로 버리세요.
+        """
+
+    @abstractmethod
+    def commit(self, staged: str, key: str):
+        """임시로 써 둔 내용을 `key` 자리에 둡니다. 이미 있어도 덮어씁니다."""
+
+    @abstractmethod
+    def discard(self, staged: str):
+        ...
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def keys(self) -> Iterator[str]:
+        """담긴 원본의 key를 모두 돌려줍니다. 줄인 이미지나 임시로 써 둔 내용은 뺍니다."""
+
+    def path(self, key: str) -> Union[str, None]:
+        """내용이 로컬 디스크에 있으면 그 경로를, 아니면 `None`을 돌려줍니다."""
+        return None
+
+    def iterate(self, key: str, start: int = 0, stop: Union[int, None] = None) -> Iterator[bytes]:
+        """`[start, stop)` 구간을 `CHUNK_SIZE`씩 읽어 돌려줍니다."""
+        with self.open(key) as f:
+            f.seek(start)
+            remaining = None if stop is None else stop - start
+            while remaining is None or remaining > 0:
+                size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+                if not (chunk := f.read(size)):
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+
+class LocalBlobStore(BlobStore):
+    """`root/ab/abcdef...` 꼴로 로컬 파일시스템에 저장합니다."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    async def stage(self, file, max_size: int) -> tuple[str, int, str]:
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp = tempfile.mkstemp(dir=self.root, prefix=".upload-")
+
+        def write(chunk: bytes):
+            digest.update(chunk)
+            out.write(chunk)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while chunk := await file.read(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise BlobTooLarge(max_size)
+                    # 해시를 구하고 디스크에 쓰는 동안 이벤트 루프를 막지 않습니다.
+                    await run_in_threadpool(write, chunk)
+        except BaseException:
+            self.discard(temp)
+            raise
+        return digest.hexdigest(), size, temp
+
+    def commit(self, staged: str, key: str):
+        # 같은 내용이 이미 있어도 옮깁니다. 있던 파일은 곧 지워질 것일 수도 있습니다.
+        destination = self.path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(staged, destination)
+
+    def discard(self, staged: str):
+        try:
+            os.unlink(staged)
+        except FileNotFoundError:
+            pass
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.path(key), "rb")
+
+    def delete(self, key: str):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self) -> Iterator[str]:
+        for directory in os.scandir(self.root):
+            if not directory.is_dir() or len(directory.name) != 2:
+                continue
+            for entry in os.scandir(directory.path):
+                if KEY_PATTERN.fullmatch(entry.name):
+                    yield entry.name
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+
+@cache
+def get_blob_store() -> BlobStore:
+    return LocalBlobStore(get_settings().BLOB_STORE_DIRECTORY)
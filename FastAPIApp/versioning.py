@@ -0,0 +1,29 @@
+from fastapi import Depends, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+import FastAPIApp.crud as crud
+from FastAPIApp.replicas import get_async_read_db
+from FastAPIApp.responses import is_not_modified, version_headers
+
+
+class NotModified(Exception):
+    def __init__(self, headers: dict[str, str]):
+        self.headers = headers
+
+
+async def not_modified_handler(request: Request, exception: NotModified) -> Response:
+    return Response(status_code=304, headers=exception.headers)
+
+
+def versioned(resource: str):
+    """`resource`의 버전으로 ETag를 붙이는 의존성을 만듭니다.
+
+    클라이언트가 가진 ETag와 같으면 버전 하나만 읽고 본 쿼리와 직렬화 없이 304로 답합니다.
+    """
+    async def check_version(
+        request: Request, response: Response, db: AsyncSession = Depends(get_async_read_db)
+    ):
+        headers = version_headers(resource, await crud.get_resource_version(db, resource))
+        if is_not_modified(request.headers, headers["etag"], None):
+            raise NotModified(headers)
+        response.headers.update(headers)
+    return Depends(check_version)
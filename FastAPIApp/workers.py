@@ -0,0 +1,33 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from FastAPIApp.settings import get_settings
+
+
+class WorkerPool:
+    """CPU를 오래 쓰는 일을 이벤트 루프 밖의 프로세스에서 돌립니다.
+
+    프로세스 수는 `Settings`의 `setting` 항목을 따르며, 처음 쓸 때 프로세스를 띄웁니다.
+    문자 발송기나 스냅숏 스레드가 잡고 있던 잠금이 복사되어 멈추지 않도록, fork하지 않고 새 인터프리터로 띄웁니다.
+    """
+
+    def __init__(self, setting: str):
+        self.setting = setting
+        self._executor = None
+        self._lock = threading.Lock()  # 여러 스레드가 처음 쓸 때 풀을 하나만 만듭니다.
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=getattr(get_settings(), self.setting),
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+        return self._executor
+
+    async def run(self, function, *args):
+        """`function(*args)`를 풀에서 돌리고 결과를 기다립니다. `function`은 모듈 수준 함수여야 합니다."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
@@ -0,0 +1,21 @@
+import logging
+import azure.functions as func
+from FastAPIApp import crud, snapshots
+from FastAPIApp.database import AsyncSessionLocal
+from FastAPIApp.settings import get_settings
+from FastAPIApp.storage import get_blob_store
+
+
+async def main(timer: func.TimerRequest) -> None:
+    """매일 새벽, 글을 쓰고 지울 때 함께 고치는 집계 값과 정적 스냅숏을 처음부터 다시 맞추고 남은 블롭을 지웁니다."""
+    async with AsyncSessionLocal() as db:
+        counts, facets = await crud.repair_summaries(db)
+    logging.info("글 수를 다시 셌습니다: %s", counts)
+    logging.info("문예지 작품을 갈래·작가·언어별로 다시 셌습니다: %d가지", len(facets))
+    async with AsyncSessionLocal() as db:
+        purged = await crud.purge_blobs(db, get_blob_store())
+    logging.info("아무도 가리키지 않는 블롭을 지웠습니다: %d개", len(purged))
+    if directory := get_settings().SNAPSHOT_DIRECTORY:
+        async with AsyncSessionLocal() as db:
+            await snapshots.rebuild(db, directory)
+        logging.info("정적 스냅숏을 다시 썼습니다: %s", directory)
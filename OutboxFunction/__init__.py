@@ -0,0 +1,13 @@
+import logging
+import azure.functions as func
+from FastAPIApp import push_message
+
+
+def main(timer: func.TimerRequest) -> None:
+    """5분마다 outbox에 남은 문자를 보냅니다.
+
+    `dispatcher` 스레드는 그 인스턴스가 살아 있는 동안만 돕니다. 인스턴스가 내려가거나 줄어들어도
+    다시 보내기로 한 문자가 남지 않게 합니다.
+    """
+    if (delay := push_message.dispatcher.drain()) is not None:
+        logging.info("다시 보낼 문자가 남았습니다: %.0f초 뒤", delay)
@@ -1,19 +1,29 @@
+import os
 import re
+import threading
+from functools import partial
 from typing import Union
 from datetime import date, timedelta
 import azure.functions as func
 from FastAPIApp import app, models, crud, auth
-from FastAPIApp.database import get_db
-from sqlalchemy.orm import Session
-from fastapi import Depends, HTTPException, UploadFile
+from FastAPIApp.database import get_async_db
+from FastAPIApp.replicas import get_async_read_db
+from FastAPIApp.responses import BlobResponse, cache_headers, is_not_modified, usable_range
+from FastAPIApp.storage import BlobStore, get_blob_store
+from FastAPIApp.versioning import NotModified, not_modified_handler, versioned
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import Depends, HTTPException, Request, UploadFile
 from fastapi.responses import Response
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
-from FastAPIApp import schemas, push_message
+from FastAPIApp import schemas, push_message, imaging, pagination, search, response_cache
+from FastAPIApp.serialization import respond, rows
 import nest_asyncio
 
 nest_asyncio.apply()
 
+app.add_exception_handler(NotModified, not_modified_handler)
+
 
 class RegisterForm(BaseModel):
     portal_id: str
@@ -33,27 +43,40 @@ class FindPWForm(BaseModel):
     new_pw: str
 
 
+# 요청마다 미들웨어를 새로 만들면 이벤트 루프도 매번 새로 생겨 연결을 재사용할 수 없습니다.
+# 함수 호출은 여러 스레드에서 동시에 들어올 수 있으므로 스레드마다 하나씩 둡니다.
+_local = threading.local()
+
+
 def main(req: func.HttpRequest, context: func.Context) -> func.HttpResponse:
-    return func.AsgiMiddleware(app).handle(req, context)
+    if not hasattr(_local, "middleware"):
+        _local.middleware = func.AsgiMiddleware(app)
+        # `AsgiMiddleware`는 startup 이벤트를 부르지 않으므로, 인스턴스가 뜰 때 여기서 남은 문자를 보내기 시작합니다.
+        push_message.dispatcher.wake()
+    return _local.middleware.handle(req, context)
 
 
-@app.get("/club-information", response_model=models.ClubInformation)
-async def get_club_information(db: Session = Depends(get_db)):
-    return crud.get_club_information(db=db)
+@app.get(
+    "/club-information",
+    response_model=models.ClubInformation,
+    dependencies=[versioned("club-information")],
+)
+async def get_club_information(db: AsyncSession = Depends(get_async_read_db)):
+    return await crud.get_club_information(db=db)
 
 
 @app.put("/club-information", response_model=models.ClubInformation)
 async def update_club_information(
     info: models.ClubInformationCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     modifier: schemas.Member = Depends(auth.get_current_member_board_only),
 ):
-    return crud.update_club_information(db=db, info=info)
+    return await crud.update_club_information(db=db, info=info)
 
 
-@app.get("/about", response_model=models.Post)
-async def get_about(db: Session = Depends(get_db)):
-    if existing := crud.get_post(db=db, type=models.PostType.about):
+@app.get("/about", response_model=models.Post, dependencies=[versioned("about")])
+async def get_about(db: AsyncSession = Depends(get_async_read_db)):
+    if existing := await crud.get_post(db=db, type=models.PostType.about):
         return existing
     raise HTTPException(404, "소개가 아직 없습니다.")
 
@@ -61,21 +84,22 @@ async def get_about(db: Session = Depends(get_db)):
 @app.put("/about", response_model=models.Post)
 async def update_about(
     about: models.PostCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    store: BlobStore = Depends(get_blob_store),
     modifier: schemas.Member = Depends(auth.get_current_member_board_only),
 ):
-    if crud.get_post(db=db, type=models.PostType.about):
-        return crud.update_post(
-            db=db, type=models.PostType.about, post=about, modifier=modifier
+    if await crud.get_post(db=db, type=models.PostType.about):
+        return await crud.update_post(
+            db=db, type=models.PostType.about, post=about, modifier=modifier, store=store
         )
-    return crud.create_post(
+    return await crud.create_post(
         db=db, author=modifier, post=about, type=models.PostType.about
     )
 
 
-@app.get("/rules", response_model=models.Post)
-async def get_rules(db: Session = Depends(get_db)):
-    if existing := crud.get_post(db=db, type=models.PostType.rules):
+@app.get("/rules", response_model=models.Post, dependencies=[versioned("rules")])
+async def get_rules(db: AsyncSession = Depends(get_async_read_db)):
+    if existing := await crud.get_post(db=db, type=models.PostType.rules):
         return existing
     raise HTTPException(404, "회칙이 아직 없습니다.")
 
@@ -83,38 +107,62 @@ async def get_rules(db: Session = Depends(get_db)):
 @app.put("/rules", response_model=models.Post)
 async def update_rules(
     rules: models.PostCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    store: BlobStore = Depends(get_blob_store),
     modifier: schemas.Member = Depends(auth.get_current_member_board_only),
 ):
-    if crud.get_post(db=db, type=models.PostType.rules):
-        return crud.update_post(
-            db=db, type=models.PostType.rules, post=rules, modifier=modifier
+    if await crud.get_post(db=db, type=models.PostType.rules):
+        return await crud.update_post(
+            db=db, type=models.PostType.rules, post=rules, modifier=modifier, store=store
         )
-    return crud.create_post(
+    return await crud.create_post(
         db=db, author=modifier, post=rules, type=models.PostType.rules
     )
 
 
 @app.get("/notices", response_model=list[models.PostOutline])
 async def get_notices(
-    skip: int = 0, limit: Union[int, None] = None, db: Session = Depends(get_db)
+    response: Response,
+    skip: int = 0,
+    limit: Union[int, None] = None,
+    cursor: Union[str, None] = None,
+    db: AsyncSession = Depends(get_async_read_db),
 ):
-    return crud.get_posts(db=db, type=models.PostType.notice, skip=skip, limit=limit)
-
-
-@app.get("/notices/recent", response_model=list[models.PostOutline])
-async def get_recent_notices(limit: int = 4, db: Session = Depends(get_db)):
-    return crud.get_posts(db=db, type=models.PostType.notice, limit=limit)
+    """한 번에 `PAGE_SIZE_MAX`개까지 보냅니다. 다음 쪽은 `X-Next-Cursor` 헤더 값을 `cursor`로 주세요.
+
+    전체 공지 수는 `X-Total-Count` 헤더에 담습니다.
+    """
+    limit = pagination.page_size(limit)
+    notices = await crud.get_posts(
+        db=db, type=models.PostType.notice, skip=skip, limit=limit,
+        after=pagination.decode_cursor(cursor, int))
+    pagination.set_next_cursor(response, notices, limit, "no")
+    response.headers[pagination.TOTAL_COUNT_HEADER] = str(
+        await crud.get_post_count(db=db, type=models.PostType.notice))
+    return respond(rows(models.PostOutline, notices), response)
+
+
+@app.get(
+    "/notices/recent",
+    response_model=list[models.PostOutline],
+    dependencies=[versioned("notice")],
+)
+async def get_recent_notices(
+    response: Response, limit: int = 4, db: AsyncSession = Depends(get_async_read_db)
+):
+    notices = await crud.get_posts(
+        db=db, type=models.PostType.notice, limit=pagination.page_size(limit))
+    return respond(rows(models.PostOutline, notices), response)
 
 
-@app.get("/notices/count", response_model=int)
-async def get_notice_count(db: Session = Depends(get_db)):
-    return crud.get_post_count(db=db, type=models.PostType.notice)
+@app.get("/notices/count", response_model=int, dependencies=[versioned("notice")])
+async def get_notice_count(db: AsyncSession = Depends(get_async_read_db)):
+    return await crud.get_post_count(db=db, type=models.PostType.notice)
 
 
 @app.get("/notices/{no:int}", response_model=models.Post)
-async def get_notice(no: int, db: Session = Depends(get_db)):
-    if notice := crud.get_post(db=db, type=models.PostType.notice, no=no):
+async def get_notice(no: int, db: AsyncSession = Depends(get_async_read_db)):
+    if notice := await crud.get_post(db=db, type=models.PostType.notice, no=no):
         return notice
     raise HTTPException(404, f"{no}번 글이 없습니다.")
 
@@ -122,10 +170,10 @@ async def get_notice(no: int, db: Session = Depends(get_db)):
 @app.post("/notices", response_model=models.Post)
 async def create_notice(
     post: models.PostCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     author: schemas.Member = Depends(auth.get_current_member_board_only),
 ):
-    return crud.create_post(
+    return await crud.create_post(
         db=db, post=post, author=author, type=models.PostType.notice
     )
 
@@ -134,10 +182,10 @@ async def create_notice(
 async def update_notice(
     no: int,
     post: models.PostCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     modifier: schemas.Member = Depends(auth.get_current_member_board_only),
 ):
-    if updated := crud.update_post(db=db, post=post, modifier=modifier, no=no):
+    if updated := await crud.update_post(db=db, post=post, modifier=modifier, no=no):
         return updated
     raise HTTPException(404, f"{no}번 글이 없습니다.")
 
@@ -145,37 +193,45 @@ async def update_notice(
 @app.delete("/notices/{no:int}")
 async def delete_notice(
     no: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    store: BlobStore = Depends(get_blob_store),
     deleter: schemas.Member = Depends(auth.get_current_member_board_only),
 ):
-    if not crud.delete_post(db=db, type=models.PostType.notice, no=no):
+    if not await crud.delete_post(db=db, store=store, type=models.PostType.notice, no=no):
         raise HTTPException(404, f"{no}번 글이 없습니다.")
 
 
 @app.get("/members", response_model=list[models.Member])
 async def get_members(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: Union[str, None] = None,
+    db: AsyncSession = Depends(get_async_db),
     accessor: schemas.Member = Depends(auth.get_current_member_board_only),
 ):
-    return crud.get_members(db, skip, limit)
+    """한 번에 `PAGE_SIZE_MAX`개까지 보냅니다. 다음 쪽은 `X-Next-Cursor` 헤더 값을 `cursor`로 주세요."""
+    limit = pagination.page_size(limit)
+    members = await crud.get_members(
+        db, skip, limit, after=pagination.decode_cursor(cursor, str))
+    pagination.set_next_cursor(response, members, limit, "student_id")
+    return members
 
 
 @app.get("/members/{student_id:str}", response_model=models.Member)
 async def get_member(
     student_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     accessing: schemas.Member = Depends(auth.get_current_member_board_only),
 ):
-    if db_member := crud.get_member(db, student_id):
+    if db_member := await crud.get_member(db, student_id):
         return db_member
     raise HTTPException(404, "가입되지 않은 학번입니다.")
 
 
 @app.get("/me", response_model=models.Member)
 async def get_myself(
-    db: Session = Depends(get_db), me: schemas.Member = Depends(auth.get_current_member)
+    db: AsyncSession = Depends(get_async_db), me: schemas.Member = Depends(auth.get_current_member)
 ):
     return me
 
@@ -184,16 +240,16 @@ async def get_myself(
 async def update_member(
     student_id: str,
     member: models.MemberModify,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     author: schemas.Member = Depends(auth.get_current_member_board_only),
 ):
-    return crud.update_member(db=db, student_id=student_id, member=member)
+    return await crud.update_member(db=db, student_id=student_id, member=member)
 
 
 @app.delete("/members/{student_id:str}")
 async def delete_member(
     student_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     deleter: schemas.Member = Depends(auth.get_current_member),
 ):
     if deleter.student_id != student_id and deleter.role not in {
@@ -201,54 +257,128 @@ async def delete_member(
         models.Role.president,
     }:
         raise HTTPException(403)
-    if not crud.delete_member(db=db, student_id=student_id):
+    if not await crud.delete_member(db=db, student_id=student_id):
         raise HTTPException(404)
 
 
 @app.get("/uploaded/{id}")
-async def get_uploaded_file(id: int, db: Session = Depends(get_db)):
-    if uploaded := crud.get_uploaded_file(db=db, id=id):
-        return Response(content=uploaded.binary, media_type=uploaded.content_type)
+async def get_uploaded_file(
+    id: int,
+    request: Request,
+    w: Union[int, None] = None,
+    db: AsyncSession = Depends(get_async_db),
+    store: BlobStore = Depends(get_blob_store),
+):
+    """`w`를 주면 이미지를 그 너비 안팎으로 줄여 보냅니다. 줄일 수 없으면 원본을 보냅니다."""
+    if uploaded := await crud.get_uploaded_file(db=db, id=id):
+        if w and uploaded.key and uploaded.content_type in imaging.resizable:
+            if derivative := await get_derivative_response(request, uploaded, w, store):
+                return derivative
+        # 한 ID의 내용은 바뀌지 않으므로 블롭이 없는 옛 파일은 ID를 ETag로 씁니다.
+        etag = f'"{uploaded.key or f"uploaded-{id}"}"'
+        headers = cache_headers(etag, uploaded.uploaded)
+        if is_not_modified(request.headers, etag, uploaded.uploaded):
+            return Response(status_code=304, headers=headers)
+        if uploaded.key:
+            return BlobResponse(
+                size=uploaded.size,
+                media_type=uploaded.content_type,
+                range_header=usable_range(request.headers, etag),
+                path=store.path(uploaded.key),
+                chunks=partial(store.iterate, uploaded.key),
+                headers=headers,
+            )
+        return BlobResponse(
+            size=await crud.get_uploaded_binary_size(db=db, id=id),
+            media_type=uploaded.content_type,
+            range_header=usable_range(request.headers, etag),
+            chunks=partial(crud.iterate_uploaded_binary, db, id),
+            headers=headers,
+        )
     raise HTTPException(404)
 
 
+async def get_derivative_response(
+    request: Request, uploaded: schemas.UploadedFile, w: int, store: BlobStore
+):
+    width = imaging.pick_width(w)
+    media_type = imaging.pick_media_type(request.headers.get("accept", ""))
+    etag = f'"{imaging.derivative_key(uploaded.key, width, media_type)}"'
+    headers = cache_headers(etag, uploaded.uploaded)
+    headers["vary"] = "Accept"
+    if is_not_modified(request.headers, etag, uploaded.uploaded):
+        return Response(status_code=304, headers=headers)
+    if path := await imaging.get_derivative(store, uploaded.key, width, media_type):
+        return BlobResponse(
+            size=os.path.getsize(path),
+            media_type=media_type,
+            range_header=usable_range(request.headers, etag),
+            path=path,
+            headers=headers,
+        )
+
+
 @app.post("/uploaded", response_model=models.UploadedFile)
 async def create_uploaded_file(
     uploaded: UploadFile,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    store: BlobStore = Depends(get_blob_store),
     uploader=Depends(auth.get_current_member_board_only),
 ):
-    return await crud.create_uploaded_file(db=db, file=uploaded)
+    return await crud.create_uploaded_file(db=db, store=store, file=uploaded)
 
 
 @app.delete("/uploaded/{id}")
 async def delete_uploaded_file(
     id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    store: BlobStore = Depends(get_blob_store),
     deleter=Depends(auth.get_current_member_board_only),
 ):
-    if not await crud.delete_uploaded_file(db=db, id=id):
+    if not await crud.delete_uploaded_file(db=db, store=store, id=id):
         raise HTTPException(404)
 
 
 @app.get("/uploaded/{id}/info", response_model=models.UploadedFile)
-async def get_uploaded_file_info(id: int, db: Session = Depends(get_db)):
-    return crud.get_uploaded_file(db=db, id=id)
+async def get_uploaded_file_info(id: int, db: AsyncSession = Depends(get_async_db)):
+    return await crud.get_uploaded_file(db=db, id=id)
 
 
 @app.get("/magazines", response_model=list[models.MagazineOutline])
-async def get_magazines(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_magazines(db=db, skip=skip, limit=limit)
-
-
-@app.get("/magazines/recent", response_model=list[models.MagazineOutline])
-async def get_recent_magazines(limit: int = 4, db: Session = Depends(get_db)):
-    return crud.get_magazines(db=db, skip=0, limit=limit)
+async def get_magazines(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Union[str, None] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """한 번에 `PAGE_SIZE_MAX`개까지 보냅니다. 다음 쪽은 `X-Next-Cursor` 헤더 값을 `cursor`로 주세요."""
+    limit = pagination.page_size(limit)
+    magazines = await crud.get_magazines(
+        db=db, skip=skip, limit=limit, after=pagination.decode_cursor(cursor, date))
+    pagination.set_next_cursor(response, magazines, limit, "published")
+    return respond(rows(models.MagazineOutline, magazines), response)
+
+
+@app.get(
+    "/magazines/recent",
+    response_model=list[models.MagazineOutline],
+    dependencies=[versioned("magazine")],
+)
+async def get_recent_magazines(
+    response: Response, limit: int = 4, db: AsyncSession = Depends(get_async_read_db)
+):
+    magazines = await crud.get_magazines(db=db, skip=0, limit=pagination.page_size(limit))
+    return respond(rows(models.MagazineOutline, magazines), response)
 
 
-@app.get("/magazines/{published}", response_model=models.Magazine)
-async def get_magazine(published: date, db: Session = Depends(get_db)):
-    if volume := crud.get_magazine(db=db, published=published):
+@app.get(
+    "/magazines/{published}",
+    response_model=models.Magazine,
+    dependencies=[versioned("magazine")],
+)
+async def get_magazine(published: date, db: AsyncSession = Depends(get_async_read_db)):
+    if volume := await crud.get_magazine(db=db, published=published):
         return volume
     raise HTTPException(404, f"{published}에 발행된 문집이 없습니다.")
 
@@ -256,20 +386,20 @@ async def get_magazine(published: date, db: Session = Depends(get_db)):
 @app.post("/magazines", response_model=models.Magazine)
 async def create_magazine(
     magazine: models.MagazineCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     publisher: schemas.Member = Depends(auth.get_current_member_board_only),
 ):
-    return crud.create_magazine(db=db, magazine=magazine)
+    return await crud.create_magazine(db=db, magazine=magazine)
 
 
 @app.put("/magazines/{published}", response_model=models.Magazine)
 async def update_magazine(
     published: date,
     magazine: models.MagazineCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     publisher: schemas.Member = Depends(auth.get_current_member_board_only),
 ):
-    if updated := crud.update_magazine(db=db, published=published, magazine=magazine):
+    if updated := await crud.update_magazine(db=db, published=published, magazine=magazine):
         return updated
     raise HTTPException(404, f"{published}에 발행된 문집이 없습니다.")
 
@@ -277,21 +407,84 @@ async def update_magazine(
 @app.delete("/magazines/{published}")
 async def delete_magazine(
     published: date,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     deleter: schemas.Member = Depends(auth.get_current_member_board_only),
 ):
-    if not crud.delete_magazine(db=db, published=published):
+    if not await crud.delete_magazine(db=db, published=published):
         raise HTTPException(404, f"{published}에 발행된 문집이 없습니다.")
 
 
+@app.get("/magazine-contents", response_model=list[models.MagazineWork])
+async def get_magazine_works(
+    response: Response,
+    type: Union[str, None] = None,
+    author: Union[str, None] = None,
+    language: Union[str, None] = None,
+    limit: Union[int, None] = None,
+    cursor: Union[str, None] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """모든 호에서 갈래·작가·언어로 거른 작품을 최근 호부터 보냅니다.
+
+    한 번에 `PAGE_SIZE_MAX`개까지 보냅니다. 다음 쪽은 `X-Next-Cursor` 헤더 값을 `cursor`로 주세요.
+    """
+    limit = pagination.page_size(limit)
+    filters = {models.MagazineFacet.type: type,
+               models.MagazineFacet.author: author,
+               models.MagazineFacet.language: language}
+    works = await crud.get_magazine_works(
+        db=db, filters=filters, limit=limit,
+        after=pagination.decode_cursor(cursor, (date, int)))
+    pagination.set_next_cursor(response, works, limit, ("published", "no"))
+    return respond(rows(models.MagazineWork, works), response)
+
+
+@app.get("/magazine-contents/facets", response_model=models.MagazineFacets)
+async def get_magazine_facets(
+    type: Union[str, None] = None,
+    author: Union[str, None] = None,
+    language: Union[str, None] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """갈래·작가·언어마다 값별 작품 수를 보냅니다. 거르면 거른 작품만 셉니다."""
+    return await crud.get_magazine_facets(db=db, filters={
+        models.MagazineFacet.type: type,
+        models.MagazineFacet.author: author,
+        models.MagazineFacet.language: language,
+    })
+
+
+@app.get("/search", response_model=list[models.SearchResult])
+async def search_everything(
+    q: str,
+    response: Response,
+    limit: Union[int, None] = None,
+    cursor: Union[str, None] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """글과 문예지 작품을 관련 있는 순서로 찾습니다. 다음 쪽은 `X-Next-Cursor` 헤더 값을 `cursor`로 주세요."""
+    limit = pagination.page_size(limit)
+    skip = pagination.decode_cursor(cursor, int) or 0
+    results = await search.search(db=db, query=q, skip=skip, limit=limit)
+    if limit and len(results) == limit:  # 순위는 keyset으로 이어 갈 수 없어 건너뛸 개수를 담습니다.
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(skip + limit)
+    return results
+
+
+@app.get("/cache-stats", response_model=models.CacheStats)
+async def get_cache_stats(viewer: schemas.Member = Depends(auth.get_current_member_board_only)):
+    """공개 응답 캐시가 이 인스턴스에서 맞힌 횟수와 놓친 횟수를 보냅니다."""
+    return response_cache.response_cache.stats()
+
+
 # @app.get("/classes", response_model=list[models.Class])
-# async def get_classes(db: Session = Depends(get_db)):
+# async def get_classes(db: AsyncSession = Depends(get_async_db)):
 #     # Depends() not working at startup.
 #     return crud.get_classes(db=db) or crud.create_classes_with_default_values(db=db)
 
 
 # @app.get("/classes/{class_name}", response_model=models.Class)
-# async def get_class(class_name: models.ClassName, db: Session = Depends(get_db)):
+# async def get_class(class_name: models.ClassName, db: AsyncSession = Depends(get_async_db)):
 #     return crud.get_class(db=db, name=class_name)
 
 
@@ -299,7 +492,7 @@ async def delete_magazine(
 # async def update_class(
 #     class_name: models.ClassName,
 #     class_data: models.ClassCreate,
-#     db: Session = Depends(get_db),
+#     db: AsyncSession = Depends(get_async_db),
 #     modifier: schemas.Member = Depends(auth.get_current_member_board_only),
 # ):
 #     return crud.update_class(db=db, name=class_name, class_data=class_data)
@@ -312,7 +505,7 @@ async def delete_magazine(
 #     class_name: models.ClassName,
 #     skip: int = 0,
 #     limit: int = 100,
-#     db: Session = Depends(get_db),
+#     db: AsyncSession = Depends(get_async_db),
 # ):
 #     return crud.get_class_records(db=db, class_name=class_name, skip=skip, limit=limit)
 
@@ -324,7 +517,7 @@ async def delete_magazine(
 # async def get_class_record(
 #     class_name: models.ClassName,
 #     conducted: date,
-#     db: Session = Depends(get_db),
+#     db: AsyncSession = Depends(get_async_db),
 #     accessing: schemas.Member = Depends(auth.get_current_member),
 # ):
 #     if record := crud.get_class_record(
@@ -338,7 +531,7 @@ async def delete_magazine(
 # async def create_class_record(
 #     class_name: models.ClassName,
 #     record: models.ClassRecordCreate,
-#     db: Session = Depends(get_db),
+#     db: AsyncSession = Depends(get_async_db),
 #     recorder: schemas.Member = Depends(auth.get_current_member_board_only),
 # ):
 #     return crud.create_class_record(
@@ -353,7 +546,7 @@ async def delete_magazine(
 #     class_name: models.ClassName,
 #     conducted: date,
 #     record: models.ClassRecordCreate,
-#     db: Session = Depends(get_db),
+#     db: AsyncSession = Depends(get_async_db),
 #     recorder: schemas.Member = Depends(auth.get_current_member_board_only),
 # ):
 #     if updated := crud.update_class_record(
@@ -368,25 +561,25 @@ async def delete_magazine(
 #     class_name: models.ClassName,
 #     conducted: date,
 #     recorder: schemas.Member = Depends(auth.get_current_member_board_only),
-#     db: Session = Depends(get_db),
+#     db: AsyncSession = Depends(get_async_db),
 # ):
 #     if not crud.delete_class_record(db=db, class_name=class_name, conducted=conducted):
 #         raise HTTPException(404, f"{conducted}에 진행된 활동이 없습니다.")
 
 
 @app.post("/register", response_model=models.Member)
-async def register(form: RegisterForm, db: Session = Depends(get_db)):
-    real_name = auth.get_student_information(
-        id=form.portal_id, pw=form.portal_pw).name
-    if crud.get_member(db=db, student_id=form.portal_id):
+async def register(form: RegisterForm, db: AsyncSession = Depends(get_async_db)):
+    real_name = (await auth.get_student_information(
+        id=form.portal_id, pw=form.portal_pw)).name
+    if await crud.get_member(db=db, student_id=form.portal_id):
         raise HTTPException(status_code=409, detail="이미 이 학번으로 가입된 계정이 있습니다.")
-    if crud.get_member_by_username(db=db, username=form.username):
+    if await crud.get_member_by_username(db=db, username=form.username):
         raise HTTPException(status_code=409, detail="이미 있는 ID입니다.")
     if not re.match(auth.password_pattern, form.password):
         raise HTTPException(status_code=422, detail="비밀번호가 안전하지 않습니다.")
     if not re.match(auth.id_pattern, form.username):
         raise HTTPException(status_code=422, detail="이런 ID는 쓸 수 없습니다.")
-    return crud.create_member(
+    return await crud.create_member(
         db=db,
         student_id=form.portal_id,
         member=models.MemberCreate(
@@ -397,9 +590,9 @@ async def register(form: RegisterForm, db: Session = Depends(get_db)):
 
 @app.post("/token")
 async def login(
-    form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+    form: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)
 ):
-    member = auth.authenticate(
+    member = await auth.authenticate(
         db=db, username=form.username, password=form.password)
     if not member:
         raise HTTPException(
@@ -409,7 +602,7 @@ async def login(
         )
     access_token_expires = timedelta(days=30)
     access_token, expires_at = auth.create_access_token(
-        data={"sub": member.username}, expires_delta=access_token_expires
+        data=await auth.token_claims(db, member), expires_delta=access_token_expires
     )
     return {
         "access_token": access_token,
@@ -419,27 +612,27 @@ async def login(
 
 
 @app.post("/find/id")
-async def find_ID(form: FindIDForm, db: Session = Depends(get_db)):
-    if auth.is_yonsei_member(form.portal_id, form.portal_pw):
-        if member := crud.get_member(db=db, student_id=form.portal_id):
+async def find_ID(form: FindIDForm, db: AsyncSession = Depends(get_async_db)):
+    if await auth.is_yonsei_member(form.portal_id, form.portal_pw):
+        if member := await crud.get_member(db=db, student_id=form.portal_id):
             return member.username
         raise HTTPException(404)
 
 
 @app.post("/find/pw")
-async def find_PW(form: FindPWForm, db: Session = Depends(get_db)):
-    if not auth.is_yonsei_member(form.portal_id, form.portal_pw):
+async def find_PW(form: FindPWForm, db: AsyncSession = Depends(get_async_db)):
+    if not await auth.is_yonsei_member(form.portal_id, form.portal_pw):
         raise HTTPException(401)
-    if crud.update_member(db=db, student_id=form.portal_id, member=models.MemberModify(password=form.new_pw)) is None:
+    if await crud.update_member(db=db, student_id=form.portal_id, member=models.MemberModify(password=form.new_pw)) is None:
         raise HTTPException(404)
 
 
 @app.post("/club-members")
 async def handle_club_member_registration(
-    model: models.ClubMemberCreate, db=Depends(get_db)
+    model: models.ClubMemberCreate, db=Depends(get_async_db)
 ):
-    if student_information := auth.is_yonsei_member(model.portal_id, model.portal_pw):
-        push_message.send_new_club_member_message(
+    if student_information := await auth.is_yonsei_member(model.portal_id, model.portal_pw):
+        await push_message.send_new_club_member_message(
             student_information, db=db, tel=model.tel, invite_informal_chat=model.invite_informal_chat)
     else:
         raise HTTPException(
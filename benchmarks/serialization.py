@@ -0,0 +1,65 @@
+"""목록 응답을 만드는 두 길의 한 항목당 시간을 잽니다.
+
+- `response_model`: 지금까지의 길. FastAPI가 `response_model`로 다시 검사하고 `jsonable_encoder`와
+  표준 `json`으로 씁니다.
+- `FastJSONResponse`: `serialization.rows`로 행에서 바로 dict를 만들고 (있으면) orjson으로 씁니다.
+
+앱과 같은 환경 변수를 둔 채 저장소 최상위에서 `python -m benchmarks.serialization [항목 수]`로 실행하세요.
+"""
+import asyncio
+import sys
+import timeit
+from datetime import date, timedelta
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+import FastAPIApp.models as models
+import FastAPIApp.schemas as schemas
+import FastAPIApp.serialization as serialization
+
+
+def load_rows(count: int):
+    """`crud.get_posts`처럼 필요한 열만 `select`한 행을 메모리 DB에서 읽어 옵니다."""
+    engine = create_engine("sqlite://")
+    schemas.Post.__table__.create(engine)
+    with Session(engine) as db:
+        db.add_all(
+            schemas.Post(
+                type=models.PostType.notice.value,
+                title=f"{no}번째 공지 제목입니다",
+                author="문학동아리",
+                content="",
+                published=date(2022, 1, 1) + timedelta(days=no),
+            )
+            for no in range(count)
+        )
+        db.commit()
+        return db.execute(select(
+            schemas.Post.no, schemas.Post.author, schemas.Post.title, schemas.Post.published
+        )).all()
+
+
+def main(count: int = 1000, repeat: int = 20):
+    notices = load_rows(count)
+    field = create_response_field("Response_get_notices", list[models.PostOutline])
+    loop = asyncio.new_event_loop()
+
+    def through_response_model():
+        content = loop.run_until_complete(serialize_response(field=field, response_content=notices))
+        return JSONResponse(content).body
+
+    def through_fast_response():
+        return serialization.FastJSONResponse(serialization.rows(models.PostOutline, notices)).body
+
+    orjson = "orjson" if serialization.orjson is not None else "json (orjson 없음)"
+    print(f"공지 {count}개, {repeat}번 중 가장 빠른 값")
+    for name, run in (("response_model", through_response_model),
+                      (f"FastJSONResponse + {orjson}", through_fast_response)):
+        best = min(timeit.repeat(run, number=1, repeat=repeat))
+        print(f"{name:>36}: 항목당 {best / count * 1e6:7.2f}µs, 모두 {best * 1e3:7.2f}ms")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
@@ -1,5 +1,6 @@
 import os
 import json
+import tempfile
 
 
 def pytest_configure(config):
@@ -7,3 +8,5 @@ def pytest_configure(config):
         with open("local.settings.json", encoding="utf-8") as f:
             for key, value in json.load(f)["Values"].items():
                 os.environ[key] = value
+    # 테스트는 `storage.get_blob_store`를 임시 디렉터리로 바꿔 쓰지만, 설정에는 값이 있어야 합니다.
+    os.environ.setdefault("BLOB_STORE_DIRECTORY", tempfile.mkdtemp())
@@ -1,20 +1,48 @@
 from __future__ import annotations
+import asyncio
+import hashlib
 import itertools
+import json
+import os
 import re
+import tempfile
+import threading
+import time
 import uuid
+import warnings
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from PIL import Image
 from datetime import date
-from pydantic import BaseSettings
-from sqlalchemy import create_engine, Table
+from pydantic import BaseSettings, ValidationError
+from sqlalchemy import create_engine, select, Table
+from sqlalchemy import inspect as sqlinspect
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool
 import sqlalchemy.event as sqlevent
+from fastapi import HTTPException, UploadFile
 from fastapi.testclient import TestClient
-from FastAPIApp import auth, app, schemas
+from FastAPIApp import auth, app, imaging, pagination, schemas
+from FastAPIApp.settings import get_settings
 import FastAPIApp.database as database
+import FastAPIApp.portal as portal
+import FastAPIApp.push_message as push_message
+import FastAPIApp.invalidation as invalidation
+import FastAPIApp.replicas as replicas
+import FastAPIApp.response_cache as response_cache
+import FastAPIApp.serialization as serialization
+import FastAPIApp.snapshots as snapshots
+import FastAPIApp.storage as storage
+import FastAPIApp.workers as workers
 import FastAPIApp.models as models
 import FastAPIApp.crud as crud
 from WrapperFunction import RegisterForm, FindIDForm, FindPWForm
+import OutboxFunction
 
 
 class Settings(BaseSettings):
@@ -30,18 +58,25 @@ class Settings(BaseSettings):
 settings = Settings()
 
 
-SQLALCHEMY_DATABASE_URL = "sqlite://"
+# 요청마다 이벤트 루프가 새로 생기므로 메모리 DB 대신 파일을 씁니다.
+SQLALCHEMY_DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "test.db")
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
+    f"sqlite:///{SQLALCHEMY_DATABASE_PATH}",
     connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
 )
-sqlevent.listen(
-    engine, "connect", lambda conn, rec: conn.execute(
-        "PRAGMA foreign_keys=ON;")
+async_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{SQLALCHEMY_DATABASE_PATH}",
+    poolclass=NullPool,
 )
+for connected in (engine, async_engine.sync_engine):
+    sqlevent.listen(
+        connected, "connect", lambda conn, rec: conn.execute(
+            "PRAGMA foreign_keys=ON;")
+    )
 TestingSessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine)
+TestingAsyncSessionLocal = sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 database.Base.metadata.create_all(bind=engine)
 
@@ -54,7 +89,25 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+def run_with_db(function, *args, **kwargs):
+    """비동기 세션을 열어 `function(db, ...)`을 기다린 결과를 돌려줍니다."""
+    async def run():
+        async with TestingAsyncSessionLocal() as db:
+            return await function(db, *args, **kwargs)
+    return asyncio.run(run())
+
+
 app.dependency_overrides[database.get_db] = override_get_db
+app.dependency_overrides[database.get_async_db] = override_get_async_db
+blob_store = storage.LocalBlobStore(tempfile.mkdtemp())
+app.dependency_overrides[storage.get_blob_store] = lambda: blob_store
+push_message.dispatcher.session_factory = TestingSessionLocal
+snapshots.snapshotter.session_factory = TestingAsyncSessionLocal
 tested = TestClient(app)
 
 
@@ -62,14 +115,147 @@ def with_table_cleared(schema: Table):
     def decorator(function):
         def wrapper(*args, **kwargs):
             db = TestingSessionLocal()
+            if schema is schemas.UploadedFile:  # 표지로 쓴 파일도 지울 수 있게 문예지부터 비웁니다.
+                db.query(schemas.Magazine).delete()
+                db.query(schemas.MagazineFacet).delete()
             db.query(schema).delete()
+            if schema is schemas.Post:  # 집계도 다시 세게 합니다.
+                db.query(schemas.PostCount).delete()
+            if schema is schemas.Magazine:
+                db.query(schemas.MagazineFacet).delete()
             db.commit()
             db.close()
+            auth.member_cache.clear()
+            response_cache.response_cache.clear()
             return function(*args, **kwargs)
         return wrapper
     return decorator
 
 
+magazine_years = itertools.count(2000)
+
+
+def create_magazine(contents: list[models.MagazineContentCreate]) -> dict:
+    """`contents`를 실은 문예지를 아직 쓰지 않은 해에 펴내고, 만든 문예지를 돌려줍니다."""
+    data = models.MagazineCreate(
+        year=next(magazine_years),
+        cover=TestUploadedFile.create_uploaded_file().id,
+        published=date(next(magazine_years), 1, 1),
+        contents=contents,
+    ).dict()
+    data["published"] = data["published"].strftime("%Y-%m-%d")
+    response = tested.post("/magazines", headers=jwt(board()), json=data)
+    assert response.status_code == 200
+    return response.json()
+
+
+@contextmanager
+def captured_statements():
+    """그동안 DB에 보낸 SQL 문을 모읍니다."""
+    statements = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    engines = (engine, async_engine.sync_engine)
+    for listened in engines:
+        sqlevent.listen(listened, "before_cursor_execute", listener)
+    try:
+        yield statements
+    finally:
+        for listened in engines:
+            sqlevent.remove(listened, "before_cursor_execute", listener)
+
+
+@contextmanager
+def query_budget(limit: int):
+    """그동안 보낸 SQL 문이 `limit`개를 넘으면 실패합니다."""
+    with captured_statements() as statements:
+        yield statements
+    assert len(statements) <= limit, "\n".join(statements)
+
+
+@contextmanager
+def overridden_settings(**changes):
+    settings = get_settings()
+    original = {key: getattr(settings, key) for key in changes}
+    for key, value in changes.items():
+        setattr(settings, key, value)
+    try:
+        yield settings
+    finally:
+        for key, value in original.items():
+            setattr(settings, key, value)
+
+
+@contextmanager
+def portal_stub(delay: float = 0, status: int = 200):
+    """연세포탈 인증 함수를 흉내 내는 로컬 서버를 띄웁니다."""
+    stats = {"requests": 0, "in_flight": 0, "max_in_flight": 0, "ports": set()}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            with lock:
+                stats["requests"] += 1
+                stats["in_flight"] += 1
+                stats["max_in_flight"] = max(
+                    stats["max_in_flight"], stats["in_flight"])
+                stats["ports"].add(self.client_address[1])
+            time.sleep(delay)
+            with lock:
+                stats["in_flight"] -= 1
+            body = json.dumps({
+                "status": "재학", "name": "홍길동", "deptMajor": "국어국문학과"
+            }).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with overridden_settings(YONSEI_AUTH_FUNCTION_ENDPOINT=f"http://127.0.0.1:{server.server_port}/"):
+            yield stats
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextmanager
+def sens_stub(status: int = 202):
+    """SENS 문자 API를 흉내 내는 로컬 서버를 띄웁니다. 받은 요청 본문을 모읍니다."""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            received.append({"headers": dict(self.headers), "json": json.loads(body)})
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with overridden_settings(NCLOUD_SENS_ENDPOINT=f"http://127.0.0.1:{server.server_port}"):
+            yield received
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 def jwt(fakemember: FakeMember):
     response = tested.post("/token", data={
         "username": fakemember.username,
@@ -88,19 +274,17 @@ class FakeMember(dict):
         self.username = self.student_id + "_username"
         self.real_name = self.student_id + "_real_name"
         self.password = self.student_id + "_password"
-        DB = TestingSessionLocal()
-        created = crud.create_member(
-            db=DB,
+        created = run_with_db(
+            crud.create_member,
             student_id=self.student_id,
             member=models.MemberCreate(
                 username=self.username,
                 real_name=self.real_name,
                 password=self.password
             ))
-        self.model = models.Member.from_orm(crud.update_member(db=DB, student_id=created.student_id, member=models.MemberModify(
+        self.model = models.Member.from_orm(run_with_db(crud.update_member, student_id=created.student_id, member=models.MemberModify(
             role=role
         )))
-        DB.close()
 
 
 def member():
@@ -145,12 +329,329 @@ class TestClubInformation:
         assert models.ClubInformation(**response.json()) == self.info
 
 
+class TestResponseCache:
+    @with_table_cleared(schemas.ClubInformation)
+    def test_club_information_cached(self):
+        headers = jwt(board())
+        information = TestClubInformation.info
+        assert tested.put("/club-information", headers=headers, json=information.dict()).status_code == 200
+        first = tested.get("/club-information")
+        assert first.headers["x-cache"] == "MISS"
+        with captured_statements() as statements:
+            second = tested.get("/club-information")
+        assert second.headers["x-cache"] == "HIT"
+        assert second.json() == first.json()
+        assert statements == []
+
+        moved = information.copy(update={"address": "다른 곳"})
+        assert tested.put("/club-information", headers=headers, json=moved.dict()).status_code == 200
+        response = tested.get("/club-information")
+        assert response.headers["x-cache"] == "MISS"
+        assert models.ClubInformation(**response.json()) == moved
+
+    @with_table_cleared(schemas.Post)
+    def test_notices_invalidated(self):
+        headers = jwt(board())
+        assert tested.get("/notices/count").json() == 0
+        assert tested.get("/notices/recent").json() == []
+        created = TestPost().create_post(models.PostType.notice, models.PostCreate(
+            title="새 글", content="", attached=[]))
+        assert tested.get("/notices/count").json() == 1
+        assert [notice["no"] for notice in tested.get("/notices/recent").json()] == [created.no]
+        tested.delete(f"/notices/{created.no}", headers=headers)
+        assert tested.get("/notices/count").json() == 0
+
+    def test_not_stored_while_replicas_settle(self):
+        cache = response_cache.ResponseCache(size=4, ttl=60, settle=60)
+        cache.set(("about", "/about", b""), ([], b"{}"), cache.generation("about"))
+        assert cache.get(("about", "/about", b"")) == ([], b"{}")
+        cache.invalidate("about")  # 복제본은 아직 고치기 전의 글을 돌려줄 수 있습니다.
+        cache.set(("about", "/about", b""), ([], b"{}"), cache.generation("about"))
+        assert cache.get(("about", "/about", b"")) is None
+
+    @with_table_cleared(schemas.ClubInformation)
+    def test_pinned_request_bypasses_cache(self):
+        tested.put("/club-information", headers=jwt(board()), json=TestClubInformation.info.dict())
+        tested.get("/club-information")
+        assert tested.get("/club-information").headers["x-cache"] == "HIT"
+        pinned = {replicas.PRIMARY_PIN_COOKIE: str(time.time() + 60)}
+        with captured_statements() as statements:
+            response = tested.get("/club-information", cookies=pinned)
+        assert "x-cache" not in response.headers
+        assert statements
+
+    def test_stale_response_not_stored(self):
+        cache = response_cache.ResponseCache(size=4, ttl=60)
+        generation = cache.generation("about")
+        cache.invalidate("about")  # 응답을 만드는 동안 글이 바뀌었습니다.
+        cache.set(("about", "/about", b""), ([], b"{}"), generation)
+        assert cache.get(("about", "/about", b"")) is None
+        cache.set(("about", "/about", b""), ([], b"{}"), cache.generation("about"))
+        assert cache.get(("about", "/about", b"")) == ([], b"{}")
+        assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+    def test_cache_stats(self):
+        assert tested.get("/cache-stats").status_code == 401
+        response = tested.get("/cache-stats", headers=jwt(board()))
+        assert response.status_code == 200
+        assert set(response.json()) == {"hits", "misses", "size"}
+
+
+class TestVersioning:
+    @with_table_cleared(schemas.Post)
+    def test_about_not_modified(self):
+        headers = jwt(board())
+        tested.put("/about", headers=headers, json=TestPost.about_data.dict())
+        response = tested.get("/about")
+        etag = response.headers["etag"]
+        assert response.headers["cache-control"] == "public, no-cache"
+        assert response.headers["surrogate-key"] == "about"
+
+        response_cache.response_cache.clear()
+        with captured_statements() as statements:
+            response = tested.get("/about", headers={"if-none-match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+        assert len(statements) == 1 and "resourceVersions" in statements[0]
+
+        tested.get("/about")
+        with captured_statements() as statements:  # 캐시해 둔 응답의 ETag와 같으면 DB에 가지 않습니다.
+            response = tested.get("/about", headers={"if-none-match": etag})
+        assert response.status_code == 304
+        assert response.headers["surrogate-key"] == "about"
+        assert statements == []
+
+        tested.put("/about", headers=headers, json=TestPost.rules_data.dict())
+        response = tested.get("/about", headers={"if-none-match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+    @with_table_cleared(schemas.Post)
+    def test_notices_version(self):
+        etag = tested.get("/notices/recent").headers["etag"]
+        assert tested.get("/notices/count").headers["etag"] == etag
+        created = TestPost().create_post(models.PostType.notice, models.PostCreate(
+            title="새 글", content="", attached=[]))
+        response = tested.get("/notices/recent", headers={"if-none-match": etag})
+        assert response.status_code == 200
+        assert [notice["no"] for notice in response.json()] == [created.no]
+        etag = response.headers["etag"]
+        tested.put("/rules", headers=jwt(board()), json=TestPost.rules_data.dict())
+        assert tested.get("/notices/recent", headers={"if-none-match": etag}).status_code == 304
+
+
+class TestInvalidation:
+    channel = "memory://tests"
+
+    @contextmanager
+    def other_instance(self):
+        """같은 채널을 듣는 다른 인스턴스를 흉내 냅니다. 받은 태그를 모아 돌려줍니다."""
+        dropped = []
+        other = invalidation.InvalidationBus(
+            invalidation.MemoryTransport(self.channel), listeners=[dropped.extend])
+        other.start()
+        with overridden_settings(CACHE_INVALIDATION_URL=self.channel):
+            invalidation.reset()
+            try:
+                yield other, dropped
+            finally:
+                other.close()
+                invalidation.reset()
+
+    def test_create_transport(self):
+        assert invalidation.create_transport("", "channel") is None
+        assert isinstance(invalidation.create_transport(
+            "memory://a", "channel"), invalidation.MemoryTransport)
+        with pytest.raises(ValueError):
+            invalidation.create_transport("ftp://somewhere", "channel")
+
+    def test_postgres_connection_closed_on_error(self, monkeypatch):
+        psycopg2 = pytest.importorskip("psycopg2")
+        transport = invalidation.PostgresTransport("postgresql://user@host/db", "channel")
+        closed = []
+
+        class Connection:
+            def cursor(self):
+                transport.closed = True  # 한 번만 연결해 봅니다.
+                raise psycopg2.OperationalError("끊겼습니다")
+
+            def close(self):
+                closed.append(self)
+        monkeypatch.setattr(transport, "connect", Connection)
+        monkeypatch.setattr(invalidation, "RECONNECT_DELAY", 0)
+        transport.run(lambda payload: None, lambda: None)
+        assert len(closed) == 1
+
+    @with_table_cleared(schemas.ClubInformation)
+    def test_writes_reach_other_instances(self):
+        with self.other_instance() as (other, dropped):
+            writer = board()
+            headers = jwt(writer)
+            response = tested.put("/club-information", headers=headers,
+                                  json=TestClubInformation.info.dict())
+            assert response.status_code == 200
+            assert "club-information" in dropped
+            response = tested.put(f"/members/{writer.student_id}", headers=jwt(president()),
+                                  json=models.MemberModify(role=models.Role.member).dict(exclude_unset=True))
+            assert response.status_code == 200
+            assert auth.member_tags(writer.username)[0] in dropped
+
+    @with_table_cleared(schemas.ClubInformation)
+    def test_other_instances_writes_dropped(self):
+        with self.other_instance() as (other, dropped):
+            tested.put("/club-information", headers=jwt(board()), json=TestClubInformation.info.dict())
+            tested.get("/club-information")
+            assert tested.get("/club-information").headers["x-cache"] == "HIT"
+            asyncio.run(other.publish("club-information"))
+            assert tested.get("/club-information").headers["x-cache"] == "MISS"
+
+            auth.member_cache.set("someone", models.Member(
+                username="someone", real_name="", student_id="", role=models.Role.member))
+            asyncio.run(other.publish(*auth.member_tags("someone")))
+            assert auth.member_cache.get("someone") is None
+            # 알린 쪽은 보내기 전에 스스로 지우고, 자기가 보낸 알림은 다시 받지 않습니다.
+            assert dropped.count("club-information") == 2  # 이 인스턴스가 고쳐서 한 번, 스스로 한 번
+            assert dropped.count("member:someone") == 1
+
+
+class TestSnapshots:
+    @contextmanager
+    def snapshot_directory(self):
+        with tempfile.TemporaryDirectory() as directory, overridden_settings(SNAPSHOT_DIRECTORY=directory):
+            yield directory
+
+    def read(self, directory: str, path: str):
+        with open(os.path.join(directory, path), encoding="utf-8") as file:
+            return json.load(file)
+
+    @with_table_cleared(schemas.Post)
+    def test_written_after_changes(self):
+        with self.snapshot_directory() as directory:
+            created = TestPost().create_post(models.PostType.notice, models.PostCreate(
+                title="스냅숏", content="정적 파일", attached=[]))
+            snapshots.snapshotter.wait()
+            assert self.read(directory, f"notices/{created.no}.json") == tested.get(
+                f"/notices/{created.no}").json()
+            assert self.read(directory, "notices/recent.json") == tested.get("/notices/recent").json()
+            assert self.read(directory, "notices/count.json") == 1
+
+            tested.delete(f"/notices/{created.no}", headers=jwt(board()))
+            snapshots.snapshotter.wait()
+            assert not os.path.exists(os.path.join(directory, f"notices/{created.no}.json"))
+            assert self.read(directory, "notices.json") == []
+            assert self.read(directory, "notices/count.json") == 0
+
+    @with_table_cleared(schemas.Post)
+    def test_not_written_without_directory(self):
+        with overridden_settings(SNAPSHOT_DIRECTORY=""):
+            TestPost().create_post(models.PostType.notice, models.PostCreate(
+                title="스냅숏", content="", attached=[]))
+            assert snapshots.snapshotter.queue.empty()
+
+    @with_table_cleared(schemas.Magazine)
+    @with_table_cleared(schemas.ClubInformation)
+    def test_rebuild(self):
+        tested.put("/club-information", headers=jwt(board()), json=TestClubInformation.info.dict())
+        magazine = TestMagazine().create_magazine()
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "magazines"))
+            with open(os.path.join(directory, "magazines/1999-01-01.json"), "w") as file:
+                file.write("{}")  # 지워진 문예지의 파일
+            run_with_db(snapshots.rebuild, directory)
+            assert self.read(directory, "club-information.json") == tested.get("/club-information").json()
+            assert self.read(directory, f"magazines/{magazine.published}.json") == tested.get(
+                f"/magazines/{magazine.published}").json()
+            assert self.read(directory, "magazines/recent.json") == tested.get("/magazines/recent").json()
+            assert not os.path.exists(os.path.join(directory, "magazines/1999-01-01.json"))
+
+
+class TestSerialization:
+    outlines = [
+        models.PostOutline(no=2, title="둘째 \"글\"", author="윤동주", published=date(2022, 3, 1)),
+        models.PostOutline(no=1, title="첫 글", author="이상", published=date(2022, 1, 1)),
+    ]
+
+    def test_same_as_response_model(self):
+        expected = json.loads(json.dumps([outline.dict() for outline in self.outlines], default=str))
+        content = serialization.rows(models.PostOutline, self.outlines)
+        assert json.loads(serialization.FastJSONResponse(content).body) == expected
+
+    def test_without_orjson(self, monkeypatch):
+        content = serialization.rows(models.PostOutline, self.outlines)
+        fast = serialization.dumps(content)
+        monkeypatch.setattr(serialization, "orjson", None)
+        assert json.loads(serialization.dumps(content)) == json.loads(fast)
+        assert serialization.dumps([models.PostType.notice]) == b'["notice"]'
+
+    @with_table_cleared(schemas.Post)
+    def test_headers_kept(self):
+        created = [TestPost().create_post(models.PostType.notice, models.PostCreate(
+            title=f"{i}", content="", attached=[])) for i in range(3)]
+        response = tested.get("/notices", params={"limit": 2})
+        assert response.headers["content-type"] == "application/json"
+        assert response.headers[pagination.NEXT_CURSOR_HEADER]
+        assert response.headers[pagination.TOTAL_COUNT_HEADER] == "3"
+        assert [notice["no"] for notice in response.json()] == [created[2].no, created[1].no]
+        response = tested.get("/notices/recent")
+        assert response.headers["etag"]
+        assert tested.get("/notices/recent", headers={"if-none-match": response.headers["etag"]}).status_code == 304
+
+
+class TestQueryBudget:
+    # 공개 GET마다 쓸 수 있는 SQL 문 수. 자료가 많아져도 늘지 않아야 합니다. ETag용 버전 읽기를 포함합니다.
+    budgets = {
+        "/club-information": 2,
+        "/about": 2,
+        "/rules": 2,
+        "/notices": 2,
+        "/notices/recent": 2,
+        "/notices/count": 2,
+        "/notices/{no}": 1,
+        "/magazines": 1,
+        "/magazines/recent": 2,
+        "/magazines/{published}": 2,
+        "/magazine-contents": 1,
+        "/magazine-contents/facets": 1,
+        "/search?q=예산": 1,
+    }
+
+    @with_table_cleared(schemas.Magazine)
+    @with_table_cleared(schemas.Post)
+    @with_table_cleared(schemas.ClubInformation)
+    def test_public_reads(self):
+        headers = jwt(board())
+        tested.put("/club-information", headers=headers, json=TestClubInformation.info.dict())
+        tested.put("/about", headers=headers, json=TestPost.about_data.dict())
+        tested.put("/rules", headers=headers, json=TestPost.rules_data.dict())
+        notices = [TestPost().create_post(models.PostType.notice, models.PostCreate(
+            title="예산", content="", attached=[TestUploadedFile.create_uploaded_file().id for _ in range(3)]))
+            for _ in range(3)]
+        magazines = [TestMagazine().create_magazine() for _ in range(3)]
+        response_cache.response_cache.clear()
+        for path, budget in self.budgets.items():
+            path = path.format(no=notices[0].no, published=magazines[0].published)
+            with query_budget(budget):
+                assert tested.get(path).status_code == 200, path
+        assert len(tested.get(f"/notices/{notices[0].no}").json()["attached"]) == 3
+        assert len(tested.get(f"/magazines/{magazines[0].published}").json()["contents"]) == 30
+
+    @with_table_cleared(schemas.Magazine)
+    def test_lazy_load_refused(self):
+        async def read_magazines(db):
+            magazine = (await db.scalars(select(schemas.Magazine).limit(1))).first()
+            return magazine and magazine.contents
+        TestMagazine().create_magazine()
+        with pytest.raises(InvalidRequestError):
+            run_with_db(read_magazines)
+
+
 class TestUploadedFile:
     file_binary = b"foo"
 
-    def create_uploaded_file():
+    def create_uploaded_file(binary: bytes = None):
         return models.UploadedFile(**tested.post("/uploaded", headers=jwt(FakeMember(models.Role.board)), files={
-            "uploaded": ("test.jpg", TestUploadedFile.file_binary, "image/jpeg")
+            "uploaded": ("test.jpg", binary or TestUploadedFile.file_binary, "image/jpeg")
         }).json())
 
     @with_table_cleared(schemas.UploadedFile)
@@ -173,6 +674,31 @@ class TestUploadedFile:
             content_type=file_info[2]
         )
 
+    @with_table_cleared(schemas.UploadedFile)
+    def test_create_uploaded_file_stored_as_blob(self):
+        file = TestUploadedFile.create_uploaded_file()
+        db = TestingSessionLocal()
+        key, size, binary = db.query(
+            schemas.UploadedFile.key,
+            schemas.UploadedFile.size,
+            schemas.UploadedFile.binary,
+        ).filter(schemas.UploadedFile.id == file.id).one()
+        db.close()
+        assert binary is None
+        assert key == hashlib.sha256(self.file_binary).hexdigest()
+        assert size == len(self.file_binary)
+        with blob_store.open(key) as f:
+            assert f.read() == self.file_binary
+
+    @with_table_cleared(schemas.UploadedFile)
+    def test_create_uploaded_file_too_large(self):
+        headers = jwt(board())
+        with overridden_settings(MAX_UPLOAD_SIZE=len(self.file_binary) - 1):
+            response = tested.post("/uploaded", headers=headers, files={
+                "uploaded": ("test.jpg", self.file_binary, "image/jpeg")
+            })
+        assert response.status_code == 413
+
     @with_table_cleared(schemas.UploadedFile)
     def test_get_uploaded_file(self):
         response = tested.get(f"/uploaded/{0}")
@@ -183,8 +709,126 @@ class TestUploadedFile:
         assert response.content == self.file_binary
 
     @with_table_cleared(schemas.UploadedFile)
-    def test_delete_uploaded_file(self):
+    def test_get_uploaded_file_range(self):
+        file = TestUploadedFile.create_uploaded_file()
+        response = tested.get(f"/uploaded/{file.id}", headers={"Range": "bytes=1-"})
+        assert response.status_code == 206
+        assert response.content == self.file_binary[1:]
+        assert response.headers["content-range"] == f"bytes 1-{len(self.file_binary) - 1}/{len(self.file_binary)}"
+        response = tested.get(f"/uploaded/{file.id}", headers={"Range": "bytes=-1"})
+        assert response.status_code == 206
+        assert response.content == self.file_binary[-1:]
+        response = tested.get(f"/uploaded/{file.id}", headers={"Range": "bytes=100-"})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{len(self.file_binary)}"
+
+    @with_table_cleared(schemas.UploadedFile)
+    def test_get_uploaded_file_not_modified(self):
         file = TestUploadedFile.create_uploaded_file()
+        response = tested.get(f"/uploaded/{file.id}")
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert etag == f'"{hashlib.sha256(self.file_binary).hexdigest()}"'
+        assert "immutable" in response.headers["cache-control"]
+        last_modified = response.headers["last-modified"]
+        response = tested.get(f"/uploaded/{file.id}", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+        response = tested.get(
+            f"/uploaded/{file.id}", headers={"If-Modified-Since": last_modified})
+        assert response.status_code == 304
+        response = tested.get(
+            f"/uploaded/{file.id}", headers={"If-None-Match": '"something-else"'})
+        assert response.status_code == 200
+        assert response.content == self.file_binary
+        response = tested.get(f"/uploaded/{file.id}", headers={
+            "Range": "bytes=1-", "If-Range": '"something-else"'})
+        assert response.status_code == 200
+        assert response.content == self.file_binary
+
+    @with_table_cleared(schemas.UploadedFile)
+    def test_get_uploaded_file_resized(self):
+        image = BytesIO()
+        Image.new("RGB", (800, 400), "red").save(image, "PNG")
+        response = tested.post("/uploaded", headers=jwt(board()), files={
+            "uploaded": ("cover.png", image.getvalue(), "image/png")
+        })
+        file = models.UploadedFile(**response.json())
+        response = tested.get(f"/uploaded/{file.id}", params={"w": 300},
+                              headers={"Accept": "image/webp,*/*"})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/webp"
+        assert response.headers["vary"] == "Accept"
+        assert Image.open(BytesIO(response.content)).size == (320, 160)
+        etag = response.headers["etag"]
+        response = tested.get(f"/uploaded/{file.id}", params={"w": 300},
+                              headers={"Accept": "image/webp,*/*", "If-None-Match": etag})
+        assert response.status_code == 304
+        response = tested.get(f"/uploaded/{file.id}", params={"w": 640})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/jpeg"
+        assert Image.open(BytesIO(response.content)).size == (640, 320)
+        # 원본보다 넓게 달라고 하면 원본을 보냅니다.
+        response = tested.get(f"/uploaded/{file.id}", params={"w": 1280})
+        assert response.status_code == 200
+        assert response.content == image.getvalue()
+
+    @with_table_cleared(schemas.UploadedFile)
+    def test_get_uploaded_file_not_resized_remembered(self):
+        image = BytesIO()
+        Image.new("RGB", (100, 50), "blue").save(image, "PNG")
+        file = TestUploadedFile.create_uploaded_file(image.getvalue())
+        response = tested.get(f"/uploaded/{file.id}", params={"w": 160})
+        assert response.content == image.getvalue()
+
+        async def must_not_run(*args):
+            raise AssertionError("원본을 다시 열었습니다.")
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            monkeypatch.setattr(imaging.pool, "run", must_not_run)
+            response = tested.get(f"/uploaded/{file.id}", params={"w": 160})
+        assert response.status_code == 200
+        assert response.content == image.getvalue()
+        # 파일을 지우면 표시 파일도 함께 지웁니다.
+        skipped = blob_store.path(imaging.skipped_key(hashlib.sha256(image.getvalue()).hexdigest(), 160, "image/jpeg"))
+        assert os.path.exists(skipped)
+        tested.delete(f"/uploaded/{file.id}", headers=jwt(board()))
+        assert not os.path.exists(skipped)
+
+    def test_decompression_bomb_not_resized(self, monkeypatch):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "bomb.png")
+            Image.new("RGB", (400, 400), "blue").save(source, "PNG")
+            destination = os.path.join(directory, "bomb-w160.jpg")
+            monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 400 * 400 // 3)
+            assert not imaging.render(source, destination, 160, "image/jpeg")
+            monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 400 * 400 - 1)
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", Image.DecompressionBombWarning)
+                assert not imaging.render(source, destination, 160, "image/jpeg")
+            assert not os.path.exists(destination)
+
+    @with_table_cleared(schemas.UploadedFile)
+    def test_get_uploaded_file_from_database(self):
+        """블롭 저장소 도입 전에 올라온 파일은 DB에서 읽습니다."""
+        db = TestingSessionLocal()
+        row = schemas.UploadedFile(
+            name="legacy.jpg", content_type="image/jpeg", binary=self.file_binary)
+        db.add(row)
+        db.commit()
+        id = row.id
+        db.close()
+        response = tested.get(f"/uploaded/{id}")
+        assert response.status_code == 200
+        assert response.content == self.file_binary
+        response = tested.get(f"/uploaded/{id}", headers={"Range": "bytes=0-1"})
+        assert response.status_code == 206
+        assert response.content == self.file_binary[:2]
+
+    @with_table_cleared(schemas.UploadedFile)
+    def test_delete_uploaded_file(self):
+        binary = uuid.uuid4().bytes
+        file = TestUploadedFile.create_uploaded_file(binary)
         response = tested.delete(f"/uploaded/{file.id}")
         assert response.status_code == 401
         response = tested.delete(f"/uploaded/{file.id}", headers=jwt(member()))
@@ -193,6 +837,144 @@ class TestUploadedFile:
         assert response.status_code == 200
         response = tested.get(f"/uploaded/{file.id}")
         assert response.status_code == 404
+        key = hashlib.sha256(binary).hexdigest()
+        assert not os.path.exists(blob_store.path(key))
+
+    @with_table_cleared(schemas.UploadedFile)
+    def test_create_uploaded_file_deduplicated(self):
+        binary = uuid.uuid4().bytes
+        key = hashlib.sha256(binary).hexdigest()
+        first = TestUploadedFile.create_uploaded_file(binary)
+        second = TestUploadedFile.create_uploaded_file(binary)
+        assert first.id != second.id
+        db = TestingSessionLocal()
+        assert db.query(schemas.Blob.refcount).filter(
+            schemas.Blob.key == key).scalar() == 2
+        db.close()
+        response = tested.delete(f"/uploaded/{first.id}", headers=jwt(board()))
+        assert response.status_code == 200
+        assert os.path.exists(blob_store.path(key))
+        response = tested.get(f"/uploaded/{second.id}")
+        assert response.status_code == 200
+        assert response.content == binary
+        response = tested.delete(f"/uploaded/{second.id}", headers=jwt(board()))
+        assert response.status_code == 200
+        assert not os.path.exists(blob_store.path(key))
+        db = TestingSessionLocal()
+        assert db.query(schemas.Blob).filter(
+            schemas.Blob.key == key).first() is None
+        db.close()
+
+    def test_blob_store_directory_checked(self):
+        with pytest.raises(TypeError):
+            storage.BlobStore()
+        with pytest.raises(ValidationError, match="BLOB_STORE_DIRECTORY"):
+            type(get_settings())(BLOB_STORE_DIRECTORY="blobs")
+        assert type(get_settings())(BLOB_STORE_DIRECTORY=blob_store.root).BLOB_STORE_DIRECTORY == blob_store.root
+
+    def test_old_table_upgraded(self):
+        old = create_engine("sqlite://")
+        with old.begin() as connection:  # 블롭 저장소 도입 전의 테이블
+            connection.exec_driver_sql(
+                'CREATE TABLE "uploadedFiles" (id INTEGER PRIMARY KEY, name VARCHAR, '
+                'content_type VARCHAR, "binary" BLOB, post_no INTEGER)')
+            connection.exec_driver_sql(
+                'INSERT INTO "uploadedFiles" (name, content_type, "binary") VALUES (\'a.txt\', \'text/plain\', x\'00\')')
+        schemas.Base.metadata.create_all(bind=old)
+        schemas.Base.metadata.create_all(bind=old)  # 두 번 돌려도 됩니다.
+        inspector = sqlinspect(old)
+        assert {"key", "size", "uploaded"} <= {column["name"] for column in inspector.get_columns("uploadedFiles")}
+        assert "ix_uploadedFiles_key" in {index["name"] for index in inspector.get_indexes("uploadedFiles")}
+        assert "blobs" in inspector.get_table_names()
+        with old.connect() as connection:
+            assert connection.exec_driver_sql('SELECT name, key FROM "uploadedFiles"').all() == [("a.txt", None)]
+
+    @with_table_cleared(schemas.UploadedFile)
+    def test_blob_reacquired_before_deletion(self):
+        binary = uuid.uuid4().bytes
+        key = hashlib.sha256(binary).hexdigest()
+        TestUploadedFile.create_uploaded_file(binary)
+
+        async def release(db):
+            released = await crud._release_blobs(db, [key])
+            await db.commit()
+            return released
+        assert run_with_db(release) == [key]
+        # 커밋한 뒤 파일을 지우기 전에 같은 내용이 다시 올라왔습니다.
+        again = TestUploadedFile.create_uploaded_file(binary)
+        assert run_with_db(crud._delete_blobs, blob_store, [key]) == []
+        assert tested.get(f"/uploaded/{again.id}").content == binary
+
+    @with_table_cleared(schemas.UploadedFile)
+    def test_blob_file_replaced(self):
+        binary = uuid.uuid4().bytes
+        path = blob_store.path(hashlib.sha256(binary).hexdigest())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(binary[:1])  # 지우다 만 파일
+        file = TestUploadedFile.create_uploaded_file(binary)
+        assert tested.get(f"/uploaded/{file.id}").content == binary
+
+    @with_table_cleared(schemas.UploadedFile)
+    def test_purge_blobs(self):
+        binary = uuid.uuid4().bytes
+        key = hashlib.sha256(binary).hexdigest()
+        TestUploadedFile.create_uploaded_file(binary)
+
+        async def release(db):
+            await crud._release_blobs(db, [key])
+            await db.commit()
+        run_with_db(release)  # 지우기 전에 멈췄습니다.
+        assert os.path.exists(blob_store.path(key))
+        assert key in run_with_db(crud.purge_blobs, blob_store)
+        assert not os.path.exists(blob_store.path(key))
+
+    @with_table_cleared(schemas.UploadedFile)
+    def test_failed_upload_discarded(self):
+        binary = uuid.uuid4().bytes
+        key = hashlib.sha256(binary).hexdigest()
+
+        async def upload(db):
+            commit = db.commit
+
+            async def fail():
+                db.commit = commit  # 한 번만 실패합니다.
+                raise ConnectionError
+            db.commit = fail
+            await crud.create_uploaded_file(db, blob_store, UploadFile(
+                "test.bin", BytesIO(binary), "application/octet-stream"))
+        with pytest.raises(ConnectionError):
+            run_with_db(upload)
+        assert not os.path.exists(blob_store.path(key))
+        db = TestingSessionLocal()
+        assert db.get(schemas.Blob, key) is None
+        db.close()
+
+    @with_table_cleared(schemas.UploadedFile)
+    def test_purge_blobs_without_rows(self):
+        binary = uuid.uuid4().bytes
+        kept = TestUploadedFile.create_uploaded_file()
+        orphan = hashlib.sha256(binary).hexdigest()
+        os.makedirs(os.path.dirname(blob_store.path(orphan)), exist_ok=True)
+        with open(blob_store.path(orphan), "wb") as f:
+            f.write(binary)  # 커밋하지 못한 업로드가 남긴 파일
+        assert orphan in run_with_db(crud.purge_blobs, blob_store)
+        assert not os.path.exists(blob_store.path(orphan))
+        assert tested.get(f"/uploaded/{kept.id}").status_code == 200
+
+    @pytest.mark.parametrize("upsert", [True, False])
+    def test_acquire_blob_upserted(self, upsert, monkeypatch):
+        """행이 없으면 만들고 있으면 참조 횟수만 늘립니다. 어느 쪽이든 `INSERT`가 부딪치지 않습니다."""
+        if not upsert:  # `ON CONFLICT`를 모르는 DB
+            monkeypatch.setattr(crud, "_upserting_inserts", {})
+        key = hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+
+        async def acquire_twice(db):
+            await crud._acquire_blob(db, key, 3)
+            await crud._acquire_blob(db, key, 3)
+            await db.commit()
+            return await db.scalar(select(schemas.Blob.refcount).filter(schemas.Blob.key == key))
+        assert run_with_db(acquire_twice) == 2
 
     @with_table_cleared(schemas.UploadedFile)
     def test_get_uploaded_file_info(self):
@@ -281,6 +1063,65 @@ class TestPost:
         assert response.status_code == 200
         assert response.json() == count
 
+    @with_table_cleared(schemas.Post)
+    def test_notice_count_not_written_by_reads(self):
+        self.create_post(models.PostType.notice, models.PostCreate(title="asdf", content="", attached=[]))
+        db = TestingSessionLocal()
+        db.query(schemas.PostCount).delete()  # 아직 세어 두지 않았습니다.
+        db.commit()
+        with captured_statements() as statements:
+            assert tested.get("/notices/count").json() == 1
+        assert all(statement.startswith("SELECT") for statement in statements)
+        assert db.query(schemas.PostCount).count() == 0
+        db.close()
+
+    @with_table_cleared(schemas.Post)
+    def test_notice_count_maintained(self):
+        created = [self.create_post(models.PostType.notice, models.PostCreate(
+            title="asdf", content="qwer", attached=[])) for _ in range(3)]
+        response = tested.delete(f"/notices/{created[0].no}", headers=jwt(board()))
+        assert response.status_code == 200
+        with captured_statements() as statements:
+            response = tested.get("/notices/count")
+        assert response.json() == 2
+        assert not [statement for statement in statements if "count(" in statement.lower()]
+        response = tested.get("/notices")
+        assert response.headers["x-total-count"] == "2"
+        headers = jwt(board())
+        for content in ("about", "replaced"):
+            response = tested.put("/about", headers=headers, json=models.PostCreate(
+                title="about", content=content, attached=[]).dict())
+            assert response.status_code == 200
+        db = TestingSessionLocal()
+        assert db.query(schemas.PostCount.count).filter(
+            schemas.PostCount.type == "about").scalar() == 1
+        db.query(schemas.PostCount).update({schemas.PostCount.count: 100})
+        db.commit()
+        db.close()
+
+        async def repair(db):
+            counts = await crud.recount_posts(db)
+            await db.commit()
+            return counts
+        assert run_with_db(repair) == {"notice": 2, "about": 1, "rules": 0}
+        assert tested.get("/notices/count").json() == 2
+
+    @with_table_cleared(schemas.Post)
+    def test_repaired_count_not_hidden(self):
+        self.create_post(models.PostType.notice, models.PostCreate(title="asdf", content="", attached=[]))
+        db = TestingSessionLocal()
+        db.query(schemas.PostCount).update({schemas.PostCount.count: 100})
+        db.commit()
+        db.close()
+        response_cache.response_cache.clear()
+        stale = tested.get("/notices/count")
+        assert stale.json() == 100
+        counts, _ = run_with_db(crud.repair_summaries)
+        assert counts["notice"] == 1
+        repaired = tested.get("/notices/count", headers={"if-none-match": stale.headers["etag"]})
+        assert repaired.status_code == 200
+        assert repaired.json() == 1
+
     @with_table_cleared(schemas.Post)
     def test_get_recent_notices(self):
         limit = 4
@@ -308,6 +1149,36 @@ class TestPost:
             for fetched, standard in zip(fetched, created[::-1][skip:][:limit]):
                 assert fetched == models.PostOutline(**standard.dict())
 
+    @with_table_cleared(schemas.Post)
+    def test_get_notices_by_cursor(self):
+        created = [self.create_post(models.PostType.notice, models.PostCreate(
+            title=str(i), content=str(i), attached=[]
+        )) for i in range(7)]
+        fetched, params = [], {"limit": 3}
+        while True:
+            response = tested.get("/notices", params=params)
+            assert response.status_code == 200
+            assert len(response.json()) <= 3
+            fetched += [data["no"] for data in response.json()]
+            if "x-next-cursor" not in response.headers:
+                break
+            params["cursor"] = response.headers["x-next-cursor"]
+        assert fetched == [post.no for post in created[::-1]]
+        response = tested.get("/notices", params={"cursor": "garbage"})
+        assert response.status_code == 400
+
+    @with_table_cleared(schemas.Post)
+    def test_get_notices_capped(self):
+        for i in range(5):
+            self.create_post(models.PostType.notice, models.PostCreate(
+                title=str(i), content=str(i), attached=[]))
+        with overridden_settings(PAGE_SIZE_MAX=2):
+            response = tested.get("/notices")
+            assert len(response.json()) == 2
+            assert "x-next-cursor" in response.headers
+            response = tested.get("/notices", params={"limit": 1000})
+            assert len(response.json()) == 2
+
     @with_table_cleared(schemas.Post)
     def test_get_notice(self):
         response = tested.get(f"/notices/1")
@@ -324,6 +1195,30 @@ class TestPost:
         fetched = models.Post(**response.json())
         assert created == fetched
 
+    @with_table_cleared(schemas.Post)
+    def test_get_notice_without_binary(self):
+        db = TestingSessionLocal()
+        legacy = schemas.UploadedFile(
+            name="legacy.jpg", content_type="image/jpeg", binary=b"x" * 1024)
+        db.add(legacy)
+        db.commit()
+        legacy_id = legacy.id
+        db.close()
+        created = self.create_post(models.PostType.notice, models.PostCreate(
+            title="asdf",
+            content="qwer",
+            attached=[legacy_id, TestUploadedFile.create_uploaded_file().id]
+        ))
+        with captured_statements() as statements:
+            response = tested.get(f"/notices/{created.no}")
+            assert response.status_code == 200
+            assert len(response.json()["attached"]) == 2
+            response = tested.get(f"/uploaded/{legacy_id}/info")
+            assert response.status_code == 200
+        assert statements
+        assert not any(re.search(r"\bbinary\b", statement)
+                       for statement in statements)
+
     @with_table_cleared(schemas.Post)
     def test_create_notice(self):
         count = 10
@@ -384,6 +1279,33 @@ class TestPost:
         assert updated.modified == date.today()
         assert updated.modifier == modifier.real_name
 
+    @with_table_cleared(schemas.Post)
+    def test_update_notice_attachments_in_bulk(self):
+        attached = [TestUploadedFile.create_uploaded_file() for _ in range(3)]
+        existing = self.create_post(models.PostType.notice, models.PostCreate(
+            title="asdf",
+            content="qwer",
+            attached=[file.id for file in attached[:2]]
+        ))
+        modified = models.PostCreate(
+            title="asdf",
+            content="qwer",
+            attached=[attached[0].id, attached[2].id]
+        )
+        headers = jwt(board())
+        with captured_statements() as statements:
+            response = tested.put(
+                f"/notices/{existing.no}", json=modified.dict(), headers=headers)
+        assert response.status_code == 200
+        assert [file["id"] for file in response.json()["attached"]] == modified.attached
+        updates = [statement for statement in statements
+                   if statement.startswith('UPDATE "uploadedFiles"')]
+        assert len(updates) == 2
+        # 파일을 통째로 읽는 건 응답을 만들 때 한 번뿐입니다.
+        loads = [statement for statement in statements
+                 if statement.startswith("SELECT") and re.search(r'"uploadedFiles(_\d+)?"\.name', statement)]
+        assert len(loads) == 1
+
     @with_table_cleared(schemas.Post)
     def test_delete_notice(self):
         count = 7
@@ -409,6 +1331,28 @@ class TestPost:
             response = tested.get(f"/uploaded/{file.id}")
             assert response.status_code == 404
 
+    @with_table_cleared(schemas.Post)
+    def test_update_about_releases_dropped_files(self):
+        headers = jwt(board())
+        binaries = [uuid.uuid4().bytes for _ in range(2)]
+        kept, dropped = [TestUploadedFile.create_uploaded_file(binary) for binary in binaries]
+        tested.put("/about", headers=headers, json=self.about_data.copy(
+            update={"attached": [kept.id, dropped.id]}).dict())
+        response = tested.put("/about", headers=headers, json=self.about_data.copy(
+            update={"attached": [kept.id]}).dict())
+        assert [file["id"] for file in response.json()["attached"]] == [kept.id]
+        assert tested.get(f"/uploaded/{kept.id}").content == binaries[0]
+        assert tested.get(f"/uploaded/{dropped.id}").status_code == 404
+        assert not os.path.exists(blob_store.path(hashlib.sha256(binaries[1]).hexdigest()))
+
+    @with_table_cleared(schemas.Post)
+    def test_delete_notice_of_other_type(self):
+        about = models.Post(**tested.put("/about", json=self.about_data.dict(), headers=jwt(board())).json())
+        response = tested.delete(f"/notices/{about.no}", headers=jwt(board()))
+        assert response.status_code == 404
+        assert tested.get("/about").json()["no"] == about.no
+        assert run_with_db(crud.get_post_count, models.PostType.about) == 1
+
 
 class TestMember:
     @with_table_cleared(schemas.Member)
@@ -428,6 +1372,19 @@ class TestMember:
         response = tested.get("/members", headers=jwt(board()))
         assert response.status_code == 200
 
+    @with_table_cleared(schemas.Member)
+    def test_get_members_by_cursor(self):
+        created = sorted(member().student_id for _ in range(4))
+        headers = jwt(board())  # 다섯 번째 회원
+        response = tested.get("/members", params={"limit": 3}, headers=headers)
+        first = [data["student_id"] for data in response.json()]
+        response = tested.get("/members", headers=headers, params={
+            "limit": 3, "cursor": response.headers["x-next-cursor"]})
+        second = [data["student_id"] for data in response.json()]
+        assert len(first) == 3 and len(second) == 2
+        assert first + second == sorted(first + second)
+        assert set(created) <= set(first + second)
+
     @with_table_cleared(schemas.Member)
     def test_get_member(self):
         queried = FakeMember(models.Role.member)
@@ -501,10 +1458,57 @@ class TestMember:
             f"/members/{deleted.student_id}", headers=jwt(board()))
         assert response.status_code == 404
 
+    @with_table_cleared(schemas.Member)
+    def test_current_member_cached(self):
+        cached = board()
+        headers = jwt(cached)
+        assert tested.get("/members", headers=headers).status_code == 200
+        with captured_statements() as statements:
+            assert tested.get("/members", headers=headers).status_code == 200
+        assert len(statements) == 1  # 회원 목록만 읽습니다.
+        run_with_db(
+            crud.update_member, student_id=cached.student_id,
+            member=models.MemberModify(role=models.Role.member))
+        assert tested.get("/members", headers=headers).status_code == 403
+
+    @with_table_cleared(schemas.Member)
+    def test_stateless_token(self):
+        with overridden_settings(JWT_STATELESS=True):
+            demoted, deleted = board(), board()
+            headers = jwt(demoted)
+            assert tested.get("/members", headers=headers).status_code == 200
+            with captured_statements() as statements:
+                assert tested.get("/members", headers=headers).status_code == 200
+            assert len(statements) == 1  # 회원 목록만 읽습니다.
+            response = tested.put(
+                f"/members/{demoted.student_id}", headers=jwt(board()),
+                json=models.MemberModify(role=models.Role.member).dict())
+            assert response.status_code == 200
+            assert tested.get("/members", headers=headers).status_code == 401
+            assert tested.get("/members", headers=jwt(demoted)).status_code == 403
+
+            headers = jwt(deleted)
+            response = tested.delete(f"/members/{deleted.student_id}", headers=headers)
+            assert response.status_code == 200
+            assert tested.get("/me", headers=headers).status_code == 401
+
+    @with_table_cleared(schemas.Member)
+    def test_stateless_token_revoked_elsewhere(self):
+        with overridden_settings(JWT_STATELESS=True, TOKEN_REVOCATION_REFRESH=60):
+            revoked = board()
+            headers = jwt(revoked)
+            assert tested.get("/me", headers=headers).status_code == 200
+
+            async def revoke_elsewhere(db):  # 다른 인스턴스에서 올렸다고 칩니다.
+                await crud.revoke_tokens(db, revoked.student_id)
+                await db.commit()
+            run_with_db(revoke_elsewhere)
+            assert tested.get("/me", headers=headers).status_code == 200
+            with overridden_settings(TOKEN_REVOCATION_REFRESH=0):
+                assert tested.get("/me", headers=headers).status_code == 401
 
-class TestMagazine:
-    year = itertools.count(2000)
 
+class TestMagazine:
     def create_magazine_content(self):
         return models.MagazineContentCreate(
             type=str(uuid.uuid4()),
@@ -514,15 +1518,7 @@ class TestMagazine:
         )
 
     def create_magazine(self):
-        data = models.MagazineCreate(
-            year=self.year.__next__(),
-            cover=TestUploadedFile.create_uploaded_file().id,
-            published=date(self.year.__next__(), 1, 1),
-            contents=[self.create_magazine_content() for _ in range(30)]
-        ).dict()
-        data["published"] = data["published"].strftime("%Y-%m-%d")
-        response = tested.post("/magazines", headers=jwt(board()), json=data)
-        return models.Magazine(**response.json())
+        return models.Magazine(**create_magazine([self.create_magazine_content() for _ in range(30)]))
 
     @with_table_cleared(schemas.Magazine)
     def test_get_magazines(self):
@@ -536,6 +1532,17 @@ class TestMagazine:
                 assert models.MagazineOutline(
                     **fetched) == models.MagazineOutline(**standard.dict())
 
+    @with_table_cleared(schemas.Magazine)
+    def test_get_magazines_by_cursor(self):
+        magazines = [self.create_magazine() for _ in range(5)]
+        response = tested.get("/magazines", params={"limit": 3})
+        assert len(response.json()) == 3
+        response = tested.get("/magazines", params={
+            "limit": 3, "cursor": response.headers["x-next-cursor"]})
+        assert [data["published"] for data in response.json()] == [
+            magazine.published.isoformat() for magazine in magazines[::-1][3:]]
+        assert "x-next-cursor" not in response.headers
+
     @with_table_cleared(schemas.Magazine)
     def test_get_magazine(self):
         created = self.create_magazine()
@@ -546,9 +1553,9 @@ class TestMagazine:
     @with_table_cleared(schemas.Magazine)
     def test_create_magazine(self):
         model = models.MagazineCreate(
-            year=self.year.__next__(),
+            year=next(magazine_years),
             cover=TestUploadedFile.create_uploaded_file().id,
-            published=date(self.year.__next__(), 1, 1),
+            published=date(next(magazine_years), 1, 1),
             contents=[self.create_magazine_content() for _ in range(50)]
         )
         data = model.dict()
@@ -580,9 +1587,9 @@ class TestMagazine:
     def test_update_magazine(self):
         updated = self.create_magazine()
         model = models.MagazineCreate(
-            year=self.year.__next__(),
+            year=next(magazine_years),
             cover=TestUploadedFile.create_uploaded_file().id,
-            published=date(self.year.__next__(), 1, 1),
+            published=date(next(magazine_years), 1, 1),
             contents=[self.create_magazine_content()] * 5
         )
         data = model.dict()
@@ -855,6 +1862,374 @@ class TestMagazine:
 #         assert response.json() == []
 
 
+class TestMagazineWork:
+    def create_magazine(self, *works: tuple[str, str, str]):
+        return create_magazine([models.MagazineContentCreate(
+            type=type, title=str(uuid.uuid4()), author=author, language=language)
+            for type, author, language in works])
+
+    def facets(self, **filters):
+        response = tested.get("/magazine-contents/facets", params=filters)
+        assert response.status_code == 200
+        return models.MagazineFacets(**response.json())
+
+    @with_table_cleared(schemas.Magazine)
+    def test_get_magazine_works(self):
+        first = self.create_magazine(("시", "윤동주", "한국어"), ("소설", "이상", "한국어"))
+        second = self.create_magazine(("시", "윤동주", "한국어"), ("시", "Poe", "영어"))
+        response = tested.get("/magazine-contents", params={"author": "윤동주", "type": "시"})
+        assert response.status_code == 200
+        works = [models.MagazineWork(**work) for work in response.json()]
+        assert [work.published.isoformat() for work in works] == [
+            second["published"], first["published"]]
+        assert {work.author for work in works} == {"윤동주"}
+
+        fetched, cursor = [], None
+        while True:
+            response = tested.get("/magazine-contents", params={
+                "limit": 3, **({"cursor": cursor} if cursor else {})})
+            fetched += [work["no"] for work in response.json()]
+            if (cursor := response.headers.get("x-next-cursor")) is None:
+                break
+        assert len(fetched) == len(set(fetched)) == 4
+        assert tested.get("/magazine-contents", params={"cursor": "garbage"}).status_code == 400
+
+    @with_table_cleared(schemas.Magazine)
+    def test_get_magazine_facets(self):
+        first = self.create_magazine(("시", "윤동주", "한국어"), ("소설", "이상", "한국어"))
+        self.create_magazine(("시", "윤동주", "한국어"), ("시", "Poe", "영어"))
+        with captured_statements() as statements:
+            facets = self.facets()
+        assert facets == models.MagazineFacets(
+            type={"시": 3, "소설": 1},
+            author={"윤동주": 2, "이상": 1, "Poe": 1},
+            language={"한국어": 3, "영어": 1})
+        assert not [statement for statement in statements if "count(" in statement.lower()]
+        assert self.facets(type="시") == models.MagazineFacets(
+            type={"시": 3}, author={"윤동주": 2, "Poe": 1}, language={"한국어": 2, "영어": 1})
+
+        headers = jwt(board())
+        first["contents"] = [models.MagazineContentCreate(
+            type="수필", title="수필", author="이상", language="한국어").dict()]
+        response = tested.put(f"/magazines/{first['published']}", headers=headers, json=first)
+        assert response.status_code == 200
+        assert self.facets() == models.MagazineFacets(
+            type={"시": 2, "수필": 1},
+            author={"윤동주": 1, "이상": 1, "Poe": 1},
+            language={"한국어": 2, "영어": 1})
+        tested.delete(f"/magazines/{first['published']}", headers=headers)
+        assert self.facets() == models.MagazineFacets(
+            type={"시": 2}, author={"윤동주": 1, "Poe": 1}, language={"한국어": 1, "영어": 1})
+
+        db = TestingSessionLocal()
+        db.query(schemas.MagazineFacet).update({schemas.MagazineFacet.count: 100})
+        db.commit()
+        db.close()
+
+        async def repair(db):
+            await crud.recount_magazine_facets(db)
+            await db.commit()
+        run_with_db(repair)
+        assert self.facets().type == {"시": 2}
+
+    @with_table_cleared(schemas.Magazine)
+    def test_magazine_facets_not_written_by_reads(self):
+        self.create_magazine(("시", "윤동주", "한국어"))
+        db = TestingSessionLocal()
+        db.query(schemas.MagazineFacet).delete()  # 아직 세어 두지 않았습니다.
+        db.commit()
+        with captured_statements() as statements:
+            assert self.facets().type == {"시": 1}
+        assert all(statement.startswith("SELECT") for statement in statements)
+        assert db.query(schemas.MagazineFacet).count() == 0
+        db.close()
+
+
+class TestSearch:
+    def create_notice(self, title: str, content: str):
+        return TestPost().create_post(models.PostType.notice, models.PostCreate(
+            title=title, content=content, attached=[]))
+
+    def create_magazine(self, *works: tuple[str, str]):
+        return models.Magazine(**create_magazine([models.MagazineContentCreate(
+            type="시", title=title, author=author, language="한국어") for title, author in works]))
+
+    def search(self, q: str, **params):
+        response = tested.get("/search", params={"q": q, **params})
+        assert response.status_code == 200
+        return [models.SearchResult(**result) for result in response.json()]
+
+    @with_table_cleared(schemas.Magazine)
+    @with_table_cleared(schemas.Post)
+    def test_search(self):
+        notice = self.create_notice("가을 낭독회", "윤동주의 <시>를 함께 읽습니다.")
+        magazine = self.create_magazine(("서시", "윤동주"), ("풀", "김수영"))
+        self.create_notice("겨울 합평회", "각자 쓴 소설을 가져옵니다.")
+        found = self.search("윤동주")
+        assert sorted(result.kind for result in found) == ["magazine", "notice"]
+        by_kind = {result.kind: result for result in found}
+        assert "<mark>윤동주의</mark> &lt;시&gt;를" in by_kind[models.PostType.notice].snippet
+        assert by_kind[models.PostType.notice].no == notice.no
+        assert by_kind["magazine"].title == "서시"
+        assert by_kind["magazine"].snippet == "<mark>윤동주</mark>"
+        assert by_kind["magazine"].published == magazine.published
+        # 제목에서 찾은 것이 앞에 옵니다.
+        self.create_notice("윤동주 읽기", "다음 주에 모입니다.")
+        assert self.search("윤동주")[0].title == "<mark>윤동주</mark> 읽기"
+        # 모든 낱말이 들어 있어야 합니다.
+        assert [result.title for result in self.search("가을 윤동")] == ["<mark>가을</mark> 낭독회"]
+        assert self.search("\"*) OR (") == []
+
+    @with_table_cleared(schemas.Magazine)
+    @with_table_cleared(schemas.Post)
+    def test_search_follows_writes(self):
+        notice = self.create_notice("봄 백일장", "시제는 당일에 알려 줍니다.")
+        assert len(self.search("백일장")) == 1
+        headers = jwt(board())
+        response = tested.put(f"/notices/{notice.no}", headers=headers, json=models.PostCreate(
+            title="봄 합평회", content="시제는 없습니다.", attached=[]).dict())
+        assert response.status_code == 200
+        assert self.search("백일장") == []
+        assert len(self.search("합평회")) == 1
+        tested.delete(f"/notices/{notice.no}", headers=headers)
+        assert self.search("합평회") == []
+
+        magazine = self.create_magazine(("님의 침묵", "한용운"))
+        assert len(self.search("한용운")) == 1
+        tested.delete(f"/magazines/{magazine.published}", headers=headers)
+        assert self.search("한용운") == []
+
+    @with_table_cleared(schemas.Post)
+    def test_search_by_cursor(self):
+        created = {self.create_notice(f"모임 {index}", "정기 모임").no for index in range(5)}
+        found, cursor = [], None
+        while True:
+            response = tested.get("/search", params={
+                "q": "모임", "limit": 2, **({"cursor": cursor} if cursor else {})})
+            found += [result["no"] for result in response.json()]
+            if (cursor := response.headers.get("x-next-cursor")) is None:
+                break
+        assert sorted(found) == sorted(created)
+
+
+class TestDatabase:
+    def test_async_url(self):
+        assert database.async_url(
+            "sqlite:////tmp/a.db") == "sqlite+aiosqlite:////tmp/a.db"
+        assert database.async_url(
+            "postgresql+psycopg2://user:pw@host:5432/db") == "postgresql+asyncpg://user:pw@host:5432/db"
+
+    def test_session_per_event_loop(self):
+        async def session_engine():
+            async with database.AsyncSessionLocal() as db:
+                return db.bind
+        with overridden_settings(DB_CONNECTION_STRING=f"sqlite:///{SQLALCHEMY_DATABASE_PATH}"):
+            assert asyncio.run(session_engine()) is asyncio.run(session_engine())
+            loop = asyncio.new_event_loop()
+            try:
+                assert loop.run_until_complete(session_engine()) is not asyncio.run(session_engine())
+            finally:
+                loop.close()
+
+    @contextmanager
+    def replicas_configured(self, urls: list[str]):
+        with overridden_settings(DB_REPLICA_CONNECTION_STRINGS=urls):
+            replicas.reset()
+            try:
+                yield replicas.replicas
+            finally:
+                replicas.reset()
+
+    def create_replica(self) -> str:
+        """주 DB에서 아무것도 복제하지 않는 빈 복제본을 만듭니다."""
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'replica.db')}"
+        database.Base.metadata.create_all(bind=create_engine(url))
+        return url
+
+    def test_replica_round_robin(self):
+        chosen = replicas.ReplicaSet(["a", "b"], retry_after=60)
+        assert [chosen.choose() for _ in range(4)] == ["a", "b", "a", "b"]
+        chosen.mark_down("a")
+        assert [chosen.choose() for _ in range(2)] == ["b", "b"]
+        chosen.mark_down("b")
+        assert chosen.choose() is None
+
+    @with_table_cleared(schemas.Post)
+    def test_read_from_replica(self):
+        with self.replicas_configured([self.create_replica()]):
+            client = TestClient(app)
+            response = client.post("/notices", headers=jwt(board()), json=models.PostCreate(
+                title="복제", content="아직 복제본에 없습니다.", attached=[]).dict())
+            assert response.status_code == 200
+            assert replicas.PRIMARY_PIN_COOKIE in response.cookies
+            no = response.json()["no"]
+            # 글을 쓴 클라이언트는 잠시 동안 주 DB에서 읽습니다.
+            assert client.get(f"/notices/{no}").status_code == 200
+            client.cookies.clear()
+            assert client.get(f"/notices/{no}").status_code == 404
+            assert client.get("/notices/count").json() == 0
+
+    @with_table_cleared(schemas.Post)
+    def test_skip_broken_replica(self):
+        broken = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'missing', 'replica.db')}"
+        with self.replicas_configured([broken, self.create_replica()]) as configured:
+            for _ in range(3):
+                response = TestClient(app).get("/notices")
+                assert response.status_code == 200
+                assert response.json() == []
+            assert configured.healthy() == configured.urls[1:]
+
+
+class TestPortal:
+    student_id = "2022123456"
+
+    def test_get_student_information(self):
+        async def verify_twice():
+            return [
+                await auth.get_student_information(self.student_id, "first"),
+                await auth.get_student_information(self.student_id, "second"),
+            ]
+        with portal_stub() as stats:
+            verified = asyncio.run(verify_twice())
+        assert all(information.name == "홍길동" for information in verified)
+        assert stats["requests"] == 2
+        assert len(stats["ports"]) == 1  # 연결을 재사용합니다.
+
+    def test_get_student_information_failed(self):
+        with portal_stub(status=500), pytest.raises(HTTPException) as raised:
+            asyncio.run(auth.get_student_information(self.student_id, "pw"))
+        assert raised.value.status_code == 777
+
+    def test_get_student_information_timeout(self):
+        with portal_stub(delay=1), overridden_settings(YONSEI_AUTH_READ_TIMEOUT=0.1):
+            portal.reset()
+            with pytest.raises(HTTPException) as raised:
+                asyncio.run(auth.get_student_information(self.student_id, "pw"))
+        portal.reset()
+        assert raised.value.status_code == 777
+
+    def test_get_student_information_concurrency(self):
+        async def verify_many():
+            await asyncio.gather(*(
+                auth.get_student_information(self.student_id, str(i)) for i in range(6)
+            ))
+        with portal_stub(delay=0.2) as stats, overridden_settings(YONSEI_AUTH_CONCURRENCY=2):
+            portal.reset()
+            asyncio.run(verify_many())
+        portal.reset()
+        assert stats["requests"] == 6
+        assert stats["max_in_flight"] == 2
+
+    def test_get_student_information_cached(self):
+        async def verify_twice():
+            return [
+                await auth.get_student_information(self.student_id, "cached"),
+                await auth.get_student_information(self.student_id, "cached"),
+            ]
+        with portal_stub() as stats:
+            first, second = asyncio.run(verify_twice())
+        assert first == second
+        assert stats["requests"] == 1
+
+    def test_get_student_information_breaker(self):
+        def verify(pw: str):
+            with pytest.raises(HTTPException) as raised:
+                asyncio.run(auth.get_student_information(self.student_id, pw))
+            assert raised.value.status_code == 777
+        with overridden_settings(YONSEI_AUTH_BREAKER_MINIMUM=3, YONSEI_AUTH_BREAKER_COOLDOWN=60):
+            portal.reset()
+            with portal_stub(status=503) as stats:
+                for i in range(5):
+                    verify(f"unavailable-{i}")
+        portal.reset()
+        assert stats["requests"] == 3  # 세 번 실패한 뒤에는 바로 실패합니다.
+
+    def test_get_student_information_breaker_recovers(self):
+        with overridden_settings(YONSEI_AUTH_BREAKER_MINIMUM=1, YONSEI_AUTH_BREAKER_COOLDOWN=0):
+            portal.reset()
+            with portal_stub(status=503), pytest.raises(HTTPException):
+                asyncio.run(auth.get_student_information(self.student_id, "down"))
+            assert portal.breaker.is_open
+            with portal_stub() as stats:
+                asyncio.run(auth.get_student_information(self.student_id, "up"))
+            assert not portal.breaker.is_open
+        portal.reset()
+        assert stats["requests"] == 1
+
+    def test_wrong_password_does_not_open_breaker(self):
+        with overridden_settings(YONSEI_AUTH_BREAKER_MINIMUM=1):
+            portal.reset()
+            with portal_stub(status=500), pytest.raises(HTTPException):
+                asyncio.run(auth.get_student_information(self.student_id, "wrong"))
+            assert not portal.breaker.is_open
+        portal.reset()
+
+
+class TestClubMember:
+    def outbox(self) -> list[schemas.OutboxMessage]:
+        db = TestingSessionLocal()
+        messages = db.query(schemas.OutboxMessage).order_by(schemas.OutboxMessage.id).all()
+        db.close()
+        return messages
+
+    @with_table_cleared(schemas.OutboxMessage)
+    def test_register_club_member(self):
+        run_with_db(crud.update_club_information, TestClubInformation.info)
+        data = models.ClubMemberCreate(
+            portal_id=TestPortal.student_id, portal_pw="club", tel="010-1234-5678",
+            invite_informal_chat=True)
+        with sens_stub() as received, portal_stub():
+            response = tested.post("/club-members", json=data.dict())
+            assert response.status_code == 200
+            for _ in range(100):
+                if all(message.status == "sent" for message in self.outbox()):
+                    break
+                time.sleep(0.05)
+        [message] = self.outbox()
+        assert message.status == "sent"
+        assert message.attempts == 1
+        [request] = received
+        assert request["json"]["messages"] == [
+            {"to": settings.HR_MANAGER_TEL, "content": message.content}]
+        assert data.tel in message.content
+        assert "x-ncp-apigw-signature-v2" in {key.lower() for key in request["headers"]}
+
+    @with_table_cleared(schemas.OutboxMessage)
+    def test_messages_batched(self):
+        for i in range(3):
+            run_with_db(crud.create_outbox_message, to=f"010-0000-000{i}", content=str(i))
+        db = TestingSessionLocal()
+        with sens_stub() as received, overridden_settings(SMS_BATCH_SIZE=2):
+            assert push_message.dispatch_due(db) is None
+        db.close()
+        assert [len(request["json"]["messages"]) for request in received] == [2, 1]
+        assert all(message.status == "sent" for message in self.outbox())
+
+    @with_table_cleared(schemas.OutboxMessage)
+    def test_messages_retried(self):
+        run_with_db(crud.create_outbox_message, to="010-0000-0000", content="retried")
+        db = TestingSessionLocal()
+        with sens_stub(status=500) as received, overridden_settings(SMS_RETRY_BASE=0, SMS_MAX_ATTEMPTS=2):
+            assert push_message.dispatch_due(db) == 0
+            [message] = self.outbox()
+            assert (message.status, message.attempts) == ("pending", 1)
+            assert message.last_error.startswith("500")
+            assert push_message.dispatch_due(db) is None
+        db.close()
+        [message] = self.outbox()
+        assert (message.status, message.attempts) == ("failed", 2)
+        assert len(received) == 2
+
+    @with_table_cleared(schemas.OutboxMessage)
+    def test_outbox_drained_by_timer(self):
+        """문자를 넣은 인스턴스가 내려가 `dispatcher`가 깨지 않아도 타이머가 보냅니다."""
+        run_with_db(crud.create_outbox_message, to="010-0000-0000", content="stranded")
+        with sens_stub() as received:
+            OutboxFunction.main(None)
+        assert [message.status for message in self.outbox()] == ["sent"]
+        assert len(received) == 1
+
+
 class TestAuth:
     @with_table_cleared(schemas.Member)
     def test_register(self):
@@ -881,6 +2256,25 @@ class TestAuth:
         })
         assert response.status_code == 200
 
+    def test_password_hashing_pool(self):
+        password = "this is a pattern-matching password 1234."
+        hashed = asyncio.run(auth.hash_password(password))
+        assert hashed != password
+        assert asyncio.run(auth.verify_password(password, hashed))
+        assert not asyncio.run(auth.verify_password(password + "?", hashed))
+        assert auth.hashing_pool.executor._max_workers == get_settings().PASSWORD_HASHING_WORKERS
+
+    def test_worker_pool_created_once(self):
+        pool = workers.WorkerPool("PASSWORD_HASHING_WORKERS")
+        with ThreadPoolExecutor(8) as threads:
+            executors = list(threads.map(lambda _: pool.executor, range(8)))
+        try:
+            assert all(executor is executors[0] for executor in executors)
+            # 스레드가 여럿 도는 프로세스를 fork하지 않습니다.
+            assert executors[0]._mp_context.get_start_method() == "spawn"
+        finally:
+            executors[0].shutdown()
+
     @with_table_cleared(schemas.Member)
     def test_find_ID(self):
         self.test_register()